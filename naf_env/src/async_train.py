@@ -0,0 +1,152 @@
+import queue
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from inference import InferencePolicy
+from metrics import ScalarWindow
+from naf import Policy
+from ounoise import OUNoise
+
+
+def actor(rank, env_fn, args, shared_model, weights_lock, weights_version, memory,
+          actor_steps, actor_episodes, stop, episode_queue):
+    """Steps one env with the latest broadcast policy and pushes into the shared memory"""
+    torch.set_num_threads(1)
+    torch.manual_seed(args.seed + rank)
+    np.random.seed(args.seed + rank)
+
+    env = env_fn()
+    policy = None
+    version = -1
+    ounoise = OUNoise(env.action_space.shape[0]) if args.ou_noise else None
+
+    while not stop.is_set():
+        # -- claim the next episode of the budget, none is started past it --
+        with actor_episodes.get_lock():
+            if actor_episodes.value >= args.num_episodes:
+                break
+            i_episode = actor_episodes.value
+            actor_episodes.value += 1
+
+        # -- pick up new weights at the start of every episode --
+        if weights_version.value != version:
+            with weights_lock:
+                if policy is None:
+                    policy = InferencePolicy(shared_model)
+                else:
+                    policy.refresh(shared_model)
+                version = weights_version.value
+
+        state = torch.Tensor([env.reset()])
+        if args.ou_noise:
+            ounoise.scale = (args.noise_scale - args.final_noise_scale) * max(
+                0, args.exploration_end - i_episode / args.exploration_end + args.final_noise_scale)
+            ounoise.reset()
+
+        episode_reward = 0
+        for _ in range(args.num_steps):
+            action = policy.select_action(state, ounoise)
+            next_state, reward, done, _ = env.step(action)
+            next_state = torch.Tensor([next_state])
+            memory.push(state, action, torch.Tensor([not done]), next_state, torch.Tensor([reward]))
+
+            with actor_steps.get_lock():
+                actor_steps.value += 1
+            episode_reward += reward
+            state = next_state
+            if done or stop.is_set():
+                break
+
+        episode_queue.put((rank, episode_reward))
+    env.close()
+
+
+def train_async(args, agent, memory, writer, env_fns):
+    """Runs one actor process per env in `env_fns` while this process learns.
+
+    The learner updates continuously from the shared `memory` (a
+    SharedReplayMemory) and broadcasts its weights every `args.sync_every`
+    updates through a Policy in shared memory. The actors run exactly
+    `args.num_episodes` episodes between them; returns their rewards.
+    """
+    ctx = mp.get_context('fork')
+    shared_model = Policy(args.hidden_size, agent.num_inputs, agent.action_space)
+    shared_model.load_state_dict(agent.model.state_dict())
+    shared_model.share_memory()
+    weights_lock = ctx.Lock()
+    weights_version = ctx.Value('l', 0)
+    actor_steps = ctx.Value('l', 0)
+    actor_episodes = ctx.Value('l', 0)
+    stop = ctx.Event()
+    episode_queue = ctx.Queue()
+    # built up front, its first use imports torch._dynamo which would stall
+    # the first update for seconds while the actors already run
+    agent.optimizer
+
+    actors = []
+    for rank, env_fn in enumerate(env_fns):
+        p = ctx.Process(target=actor, args=(rank, env_fn, args, shared_model, weights_lock, weights_version,
+                                            memory, actor_steps, actor_episodes, stop, episode_queue))
+        p.start()
+        actors.append(p)
+
+    rewards = []
+
+    def record(rank, episode_reward):
+        writer.add_scalar('reward/train', episode_reward, len(rewards))
+        print("Train Episode: {}, actor: {}, reward: {}".format(len(rewards), rank, episode_reward))
+        rewards.append(episode_reward)
+
+    updates = 0
+    value_losses = ScalarWindow(writer, 'loss/value', args.log_every)
+    report_time, report_steps, report_updates = time.time(), 0, 0
+    try:
+        while len(rewards) < args.num_episodes:
+            while not episode_queue.empty():
+                record(*episode_queue.get())
+            if not any(p.is_alive() for p in actors) and episode_queue.empty():
+                break  # the actors died before finishing the budget
+
+            if len(memory) < args.batch_size:
+                time.sleep(0.1)
+                continue
+
+            batch = memory.sample(args.batch_size)
+            value_loss, _, _ = agent.update_parameters(batch)
+            value_losses.add(value_loss, updates)
+            updates += 1
+
+            if updates % args.sync_every == 0:
+                with weights_lock:
+                    shared_model.load_state_dict(agent.model.state_dict())
+                    weights_version.value += 1
+
+            # -- throughput of both sides, reported separately --
+            elapsed = time.time() - report_time
+            if elapsed >= args.report_every:
+                steps_per_s = (actor_steps.value - report_steps) / elapsed
+                updates_per_s = (updates - report_updates) / elapsed
+                writer.add_scalar('perf/actor_steps_per_s', steps_per_s, updates)
+                writer.add_scalar('perf/learner_updates_per_s', updates_per_s, updates)
+                print("actor steps/s: {:.1f}, learner updates/s: {:.1f}".format(steps_per_s, updates_per_s))
+                report_time, report_steps, report_updates = time.time(), actor_steps.value, updates
+                memory.flush()
+    finally:
+        value_losses.flush(updates)
+        stop.set()
+        # an actor only exits once its queued episodes are flushed, so keep
+        # draining while joining, then collect the ones finished after the last poll
+        for p in actors:
+            while p.is_alive():
+                while not episode_queue.empty():
+                    record(*episode_queue.get())
+                p.join(0.1)
+        while True:
+            try:
+                record(*episode_queue.get(timeout=0.1))
+            except queue.Empty:
+                break
+
+    return rewards
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for the NAF training hot paths. Runs without ROS.
+
+    python benchmark.py replay --replay_sizes 10000 100000 1000000
+    python benchmark.py policy --batch_sizes 200 1024 4096
+    python benchmark.py soft_update --hidden_sizes 128 512
+    python benchmark.py select_action
+    python benchmark.py update --batch_sizes 128 512 --fused_updates 50
+    python benchmark.py train --num_envs 1 8
+    python benchmark.py trace --trace traces/env0
+
+Every run can be saved with --json and checked against a saved run:
+
+    python benchmark.py --json baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.15
+
+The comparison exits with status 1 if any rate (*_per_s) dropped or any
+latency (*_us) grew by more than the tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+import torch
+
+from inference import InferencePolicy
+from naf import NAF, Policy, soft_update
+from ounoise import OUNoise
+from replay_memory import ReplayMemory, PrioritizedReplayMemory
+
+
+def rate(fn, iterations):
+    """Calls per second of fn over the given number of iterations"""
+    fn()
+    t_start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return iterations / (time.perf_counter() - t_start)
+
+
+def fill(memory, size, state_dim, action_dim):
+    """Writes `size` random transitions straight into the buffer columns"""
+    memory._allocate(state_dim, action_dim)
+    for column in memory.memory:
+        column[:size] = torch.randn(column[:size].shape)
+    memory.size = size
+    memory.position = size % memory.capacity
+    if isinstance(memory, PrioritizedReplayMemory):
+        memory.update_priorities(np.arange(size), np.random.rand(size))
+
+
+def record(benchmark, params, **metrics):
+    """One machine-readable result, matched on benchmark and params by --compare"""
+    return {'benchmark': benchmark, 'params': params, 'metrics': metrics}
+
+
+def bench_replay(args):
+    results = []
+    print('{:>10} {:>12} {:>14} {:>14} {:>14}'.format(
+        'size', 'buffer', 'push/s', 'sample/s', 'update/s'))
+    for size in args.replay_sizes:
+        for name, memory in (('uniform', ReplayMemory(size)),
+                             ('prioritized', PrioritizedReplayMemory(size))):
+            fill(memory, size, args.state_dim, args.action_dim)
+            state = torch.randn(1, args.state_dim)
+            action = torch.randn(1, args.action_dim)
+            mask, reward = torch.Tensor([1]), torch.Tensor([0])
+            push_rate = rate(lambda: memory.push(state, action, mask, state, reward), args.iterations)
+            sample_rate = rate(lambda: memory.sample(args.batch_size), args.iterations)
+            if isinstance(memory, PrioritizedReplayMemory):
+                td_errors = np.random.rand(args.batch_size)
+                update_rate = rate(lambda: memory.update_priorities(
+                    memory.sample_indices(args.batch_size), td_errors), args.iterations)
+            else:
+                update_rate = float('nan')
+            print('{:>10} {:>12} {:>14.0f} {:>14.0f} {:>14.0f}'.format(
+                size, name, push_rate, sample_rate, update_rate))
+            metrics = {'push_per_s': push_rate, 'sample_per_s': sample_rate}
+            if isinstance(memory, PrioritizedReplayMemory):
+                metrics['update_priorities_per_s'] = update_rate
+            results.append(record('replay', {'size': size, 'buffer': name, 'batch_size': args.batch_size},
+                                  **metrics))
+    return results
+
+
+def reference_forward(model, inputs):
+    """The original masked full-matrix NAF forward, the timing baseline"""
+    x, u = inputs
+    x = model.bn0(x)
+    x = (model.linear1(x)).tanh()
+    x = (model.linear2(x)).tanh()
+    V = model.V(x)
+    mu = (model.mu(x)).tanh()
+    num_outputs = mu.size(1)
+    tril_mask = torch.tril(torch.ones(num_outputs, num_outputs), diagonal=-1).unsqueeze(0)
+    diag_mask = torch.diag(torch.diag(torch.ones(num_outputs, num_outputs))).unsqueeze(0)
+    L = model.L(x).view(-1, num_outputs, num_outputs)
+    L = L * tril_mask.expand_as(L) + torch.exp(L) * diag_mask.expand_as(L)
+    P = torch.bmm(L, L.transpose(2, 1))
+    u_mu = (u - mu).unsqueeze(2)
+    A = -0.5 * torch.bmm(torch.bmm(u_mu.transpose(2, 1), P), u_mu)[:, :, 0]
+    return mu, A + V, V
+
+
+def bench_policy(args):
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    model = Policy(args.hidden_size, args.state_dim, action_space)
+    variants = [('reference', lambda inputs: reference_forward(model, inputs)),
+                ('tril', model)]
+    if args.compile:
+        variants.append(('tril+compile', torch.compile(model.forward)))
+
+    results = []
+    print('{:>8} {:>14} {:>14} {:>12}'.format('batch', 'forward', 'fwd+bwd/s', 'max |dQ|'))
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, args.state_dim)
+        u = torch.rand(batch_size, args.action_dim) * 2 - 1
+        _, Q_ref, _ = reference_forward(model, (x, u))
+        for name, forward in variants:
+            _, Q, _ = forward((x, u))
+            # equivalence is checked by naf_env/test/test_naf.py, this only reports it
+            error = (Q - Q_ref).abs().max().item()
+
+            def step():
+                model.zero_grad()
+                _, Q, _ = forward((x, u))
+                Q.sum().backward()
+            step_rate = rate(step, args.iterations)
+            print('{:>8} {:>14} {:>14.0f} {:>12.2e}'.format(batch_size, name, step_rate, error))
+            results.append(record('policy', {'batch_size': batch_size, 'hidden_size': args.hidden_size,
+                                             'forward': name}, forward_backward_per_s=step_rate))
+    return results
+
+
+def reference_soft_update(target, source, tau):
+    """The original per-parameter Python loop, kept for comparison"""
+    for target_param, param in zip(target.parameters(), source.parameters()):
+        target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
+
+
+def bench_soft_update(args):
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    results = []
+    print('{:>8} {:>14} {:>14}'.format('hidden', 'update', 'us/step'))
+    for hidden_size in args.hidden_sizes:
+        target = Policy(hidden_size, args.state_dim, action_space)
+        source = Policy(hidden_size, args.state_dim, action_space)
+        for name, update in (('reference', reference_soft_update), ('foreach_lerp', soft_update)):
+            latency = 1e6 / rate(lambda: update(target, source, 0.001), args.iterations)
+            print('{:>8} {:>14} {:>14.1f}'.format(hidden_size, name, latency))
+            results.append(record('soft_update', {'hidden_size': hidden_size, 'update': name},
+                                  latency_us=latency))
+    return results
+
+
+def bench_select_action(args):
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    agent = NAF(0.99, 0.001, args.hidden_size, args.state_dim, action_space)
+    # non-trivial BatchNorm statistics so the folding is actually exercised
+    agent.model((torch.randn(512, args.state_dim) * 3 + 1, None))
+    policy = InferencePolicy(agent.model)
+    ounoise = OUNoise(args.action_dim)
+    state = torch.randn(1, args.state_dim)
+
+    error = (agent.select_action(state) - policy.select_action(state)).abs().max().item()
+    if error > 1e-5:
+        raise AssertionError('InferencePolicy differs from NAF.select_action by {}'.format(error))
+    results = []
+    print('{:>24} {:>12} {:>12}'.format('path', 'us/call', 'max |da|'))
+    for name, fn in (('NAF.select_action', lambda: agent.select_action(state, ounoise)),
+                     ('InferencePolicy', lambda: policy.select_action(state, ounoise)),
+                     ('InferencePolicy.refresh', lambda: policy.refresh(agent.model))):
+        latency = 1e6 / rate(fn, args.iterations)
+        print('{:>24} {:>12.1f} {:>12.2e}'.format(name, latency, error))
+        results.append(record('select_action', {'hidden_size': args.hidden_size, 'path': name},
+                              latency_us=latency))
+    return results
+
+
+def bench_update(args):
+    """Sampling plus one update_parameters call per step against update_many on K batches"""
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    k = args.fused_updates
+    results = []
+    print('{:>8} {:>8} {:>14} {:>18}'.format('hidden', 'batch', 'updates/s', 'fused K={} /s'.format(k)))
+    for hidden_size in args.hidden_sizes:
+        agent = NAF(0.99, 0.001, hidden_size, args.state_dim, action_space)
+        memory = ReplayMemory(max(args.replay_sizes[0], max(args.batch_sizes)))
+        fill(memory, memory.capacity, args.state_dim, args.action_dim)
+        for batch_size in args.batch_sizes:
+            iterations = max(1, args.iterations // 10)
+            update_rate = rate(lambda: agent.update_parameters(memory.sample(batch_size)), iterations)
+            fused_rate = k * rate(lambda: agent.update_many(memory.sample_batches(k, batch_size)),
+                                  max(1, iterations // k))
+            print('{:>8} {:>8} {:>14.0f} {:>18.0f}'.format(hidden_size, batch_size, update_rate, fused_rate))
+            results.append(record('update', {'hidden_size': hidden_size, 'batch_size': batch_size},
+                                  updates_per_s=update_rate, fused_updates_per_s=fused_rate))
+    return results
+
+
+def bench_trace(args):
+    """ReplayEnv steps of a recorded trace, alone and with the policy acting on them"""
+    if not args.trace:
+        print('skipped, needs --trace DIR (record one with main.py --record DIR)')
+        return []
+    # environment.py imports rospy and the message packages, so only when asked for
+    from environment import ReplayEnv
+    from recording import Trace
+    from planar_arm import shaped_reward
+
+    t_start = time.perf_counter()
+    trace = Trace(args.trace)
+    rewards = trace.transitions(shaped_reward)[2]
+    load_s = time.perf_counter() - t_start
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    policy = InferencePolicy(NAF(0.99, 0.001, args.hidden_size, args.state_dim, action_space).model)
+
+    def replay(act):
+        env = ReplayEnv(trace)
+        steps = 0
+        t_start = time.perf_counter()
+        while True:
+            try:
+                state = torch.from_numpy(env.reset()).float().unsqueeze(0)
+            except EOFError:
+                break
+            done = False
+            while not done:
+                action = act(state)
+                observation, _, done, _ = env.step(action)
+                state = torch.from_numpy(observation).float().unsqueeze(0)
+                steps += 1
+        return steps / (time.perf_counter() - t_start)
+
+    env_rate = replay(lambda state: torch.zeros(1, args.action_dim))
+    agent_rate = replay(policy.select_action)
+    print('{} states, {} steps, loaded in {:.3f} s'.format(len(trace), len(rewards), load_s))
+    print('{:>16} {:>16}'.format('env steps/s', 'with policy /s'))
+    print('{:>16.0f} {:>16.0f}'.format(env_rate, agent_rate))
+    return [record('trace', {'trace': args.trace, 'states': len(trace)},
+                   env_steps_per_s=env_rate, policy_steps_per_s=agent_rate)]
+
+
+class StubEnv(object):
+    """VecEnv-compatible point mass that costs next to nothing to step"""
+
+    def __init__(self, num_envs, state_dim, action_dim):
+        self.num_envs = num_envs
+        self.observation_space = SimpleNamespace(shape=(state_dim,))
+        self.action_space = SimpleNamespace(shape=(action_dim,))
+        self.goal = np.zeros((num_envs, state_dim))
+        self.reset_latency = 0.0
+        self.steps = 0
+
+    def seed(self, seed):
+        pass
+
+    def reset(self):
+        self.observations = np.ones((self.num_envs, self.observation_space.shape[0]), dtype=np.float32)
+        return self.observations.copy()
+
+    def step(self, actions, active=None):
+        actions = np.asarray(actions)
+        n = min(actions.shape[1], self.observations.shape[1])
+        self.observations[:, :n] -= 0.01 * actions[:, :n]
+        self.steps += self.num_envs if active is None else int(np.sum(active))
+        rewards = -np.sqrt((self.observations ** 2).sum(axis=1))
+        return self.observations.copy(), rewards, np.zeros(self.num_envs, dtype=bool), [None] * self.num_envs
+
+    def close(self):
+        pass
+
+
+class NullWriter(object):
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+
+def bench_train(args):
+    """main.train end to end, the environment replaced by StubEnv"""
+    import main
+    action_space = SimpleNamespace(shape=(args.action_dim,))
+    results = []
+    print('{:>8} {:>14}'.format('envs', 'env steps/s'))
+    for num_envs in args.num_envs:
+        train_args = SimpleNamespace(num_episodes=args.train_episodes, num_steps=args.num_steps,
+                                     batch_size=args.batch_size, updates_per_step=1, train_model=True,
+                                     ou_noise=True, noise_scale=0.3, final_noise_scale=0.3,
+                                     exploration_end=100, beta=0.4, prioritized=False, hindsight=False,
+                                     hindsight_ratio=0.8, log_every=100, fused_updates=args.fused_updates,
+                                     plot_every=0, export_policy=None)
+        agent = NAF(0.99, 0.001, args.hidden_size, args.state_dim, action_space)
+        memory = ReplayMemory(args.replay_sizes[0], args.state_dim, args.action_dim)
+        env = StubEnv(num_envs, args.state_dim, args.action_dim)
+        t_start = time.perf_counter()
+        main.train(train_args, agent, memory, NullWriter(), env)
+        elapsed = time.perf_counter() - t_start
+        print('{:>8} {:>14.0f}'.format(num_envs, env.steps / elapsed))
+        results.append(record('train', {'num_envs': num_envs, 'num_steps': args.num_steps,
+                                        'episodes': args.train_episodes, 'batch_size': args.batch_size,
+                                        'hidden_size': args.hidden_size},
+                              env_steps_per_s=env.steps / elapsed))
+    return results
+
+
+BENCHMARKS = {
+    'replay': bench_replay,
+    'policy': bench_policy,
+    'soft_update': bench_soft_update,
+    'select_action': bench_select_action,
+    'update': bench_update,
+    'train': bench_train,
+    'trace': bench_trace,
+}
+
+
+def compare(results, baseline, tolerance):
+    """Prints every metric next to its baseline, returns the regressed ones"""
+    stored = dict((json.dumps([r['benchmark'], r['params']], sort_keys=True), r['metrics'])
+                  for r in baseline['results'])
+    regressions = []
+    print('{:>14} {:>24} {:>12} {:>12} {:>8}  {}'.format(
+        'benchmark', 'metric', 'baseline', 'current', 'change', 'params'))
+    for result in results:
+        metrics = stored.get(json.dumps([result['benchmark'], result['params']], sort_keys=True))
+        if metrics is None:
+            continue
+        for name, value in sorted(result['metrics'].items()):
+            if name not in metrics or not metrics[name]:
+                continue
+            change = value / metrics[name] - 1
+            if name.endswith('_per_s'):
+                regressed = change < -tolerance
+            elif name.endswith('_us'):
+                regressed = change > tolerance
+            else:
+                continue
+            params = ','.join('{}={}'.format(k, v) for k, v in sorted(result['params'].items()))
+            print('{:>14} {:>24} {:>12.4g} {:>12.4g} {:>+8.1%}  {}{}'.format(
+                result['benchmark'], name, metrics[name], value, change, params,
+                '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((result, name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='naf_env hot path benchmarks')
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--replay_sizes', type=int, nargs='+', default=[10**4, 10**5, 10**6])
+    parser.add_argument('--batch_size', type=int, default=200)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[200, 512, 1024, 4096])
+    parser.add_argument('--hidden_size', type=int, default=128)
+    parser.add_argument('--hidden_sizes', type=int, nargs='+', default=[128, 512])
+    parser.add_argument('--compile', action='store_true', help='also time the torch.compile variants')
+    parser.add_argument('--state_dim', type=int, default=2)
+    parser.add_argument('--action_dim', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--fused_updates', type=int, default=50, help='K of the update_many benchmark')
+    parser.add_argument('--seed', type=int, default=4)
+    parser.add_argument('--num_envs', type=int, nargs='+', default=[1, 8],
+                        help='parallel stub envs for the train benchmark')
+    parser.add_argument('--num_steps', type=int, default=100)
+    parser.add_argument('--train_episodes', type=int, default=3)
+    parser.add_argument('--trace', metavar='DIR', help='trace of the trace benchmark, see recording.py')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='flag regressions against the results in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change counted as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    results = []
+    for name in args.benchmarks:
+        print('== {} =='.format(name))
+        results.extend(BENCHMARKS[name](args))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'torch': torch.__version__,
+                       'machine': platform.machine(), 'threads': torch.get_num_threads(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args),
+                       'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('== compared to {} =='.format(args.compare))
+        regressions = compare(results, baseline, args.tolerance)
+        print('{} regression(s) beyond {:.0%}'.format(len(regressions), args.tolerance))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import glob
+import os
+import random
+import threading
+import numpy as np
+import torch
+
+PATTERN = 'checkpoint_{:08d}.pt'
+
+
+def rng_state():
+    return {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'python': random.getstate()}
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+
+class Checkpointer(object):
+    """Writes training state snapshots in the background and keeps the newest `keep`.
+
+    `save` takes a state that is already a copy (the state_dict methods of
+    NAF, the memories, OUNoise etc. return copies), so training can go on
+    while a thread serializes it. The file is written to a temporary name,
+    fsynced and renamed into place, so a crash leaves either the previous
+    checkpoints or a complete new one, never a partial file. Only one save
+    is in flight: the next `save` first waits for the previous one.
+    """
+
+    def __init__(self, directory='checkpoints/', keep=3):
+        if keep < 1:
+            raise ValueError('Checkpointer has to keep at least one checkpoint, got keep={}'.format(keep))
+        self.directory = directory
+        self.keep = keep
+        self.thread = None
+        self.error = None
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def checkpoints(self):
+        """Paths of the complete checkpoints, oldest first"""
+        return sorted(glob.glob(os.path.join(self.directory, PATTERN.replace('{:08d}', '[0-9]' * 8))))
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, state, step):
+        self.wait()
+        path = os.path.join(self.directory, PATTERN.format(step))
+        self.thread = threading.Thread(target=self._write, args=(state, path), name='checkpoint-writer')
+        self.thread.start()
+
+    def _write(self, state, path):
+        try:
+            tmp = os.path.join(self.directory, '.' + os.path.basename(path) + '.tmp')
+            with open(tmp, 'wb') as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, path)
+            for old in self.checkpoints()[:-self.keep]:
+                os.remove(old)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """Blocks until the pending save is on disk, raising its error if it failed"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    @staticmethod
+    def load(path):
+        print('Loading checkpoint from {}'.format(path))
+        # the state holds NumPy arrays and RNG states next to the tensors
+        return torch.load(path, weights_only=False)
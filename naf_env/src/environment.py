@@ -7,51 +7,140 @@ import torch
 import gym
 from gym import spaces
 import numpy as np
+import threading
 import time
+from state_channel import StateChannel, FIELDS
+from recording import TraceWriter, Trace, RESET, STEP
+import instrumentation
 
 from controller_manager_msgs.srv import *
 from std_msgs.msg import *
 from hiqp_msgs.srv import *
 from hiqp_msgs.msg import *
 from trajectory_msgs.msg import *
+from sensor_msgs.msg import JointState
+
+HOME_JOINTS = ['three_dof_planar_joint1','three_dof_planar_joint2','three_dof_planar_joint3']
+HOME_POSE = [0.1,-0.3,0.0]
+
+#serializes registering topics and services, envs connect from VecEnv's worker threads
+_connect_lock = threading.Lock()
+
+
+def init_node(ros=rospy):
+    """Registers the ROS node of this process, has to run on the main thread"""
+    if not ros.core.is_initialized():
+        ros.init_node('DRL_node', anonymous=True)
 
 class ManipulateEnv(gym.Env):
     """Manipulation Environment that follows gym interface"""
     metadata = {'render.modes': ['human']}
-    def __init__(self):
+    action_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
+    observation_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
+
+    def __init__(self, ns='', reload_controller=True, home_tolerance=0.01, home_timeout=6.0, home_time=1.0,
+                 state_timeout=1.0, ros=rospy, state_channel=None,
+                 control_rate=10.0, sync_step=False, step_timeout=0.5, record=None):
         super(ManipulateEnv, self).__init__()
 
         self.goal = [-0.2, -0.5]
-        
-        self.action_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
-        self.observation_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
-
-        rospy.init_node('DRL_node', anonymous=True)
-        rospy.Subscriber("/ee_rl/state", StateMsg, self._next_observation)
-        self.pub = rospy.Publisher('/ee_rl/act', DesiredErrorDynamicsMsg)
-        self.effort_pub = rospy.Publisher('/position_joint_trajectory_controller/command', JointTrajectory)
-        self.rate = rospy.Rate(10) #10Hz
+        self.ns = ns #ROS namespace of this simulator instance, for running several in parallel
+        self.reload_controller = reload_controller #unload/load hiqp on reset, otherwise only stop/start it
+        self.home_tolerance = home_tolerance #rad, max joint error to the home pose
+        self.home_timeout = home_timeout
+        #s, time_from_start of the home trajectory; reset cannot finish before the arm
+        #gets there, so this bounds its latency (it used to be a fixed 4 s)
+        self.home_time = home_time
+        self.state_timeout = state_timeout
+        self.reset_latency = None #wall time of the last reset, in seconds
+        self.state_channel = state_channel #shared memory channel name, replaces the ee_rl/state topic
+        self.channel = None
+        self.channel_seq = 0
+        self.control_rate = control_rate #Hz, env steps per second
+        #sync_step: instead of sleeping at control_rate, wait for a state computed
+        #1/control_rate after the controller applied the action
+        self.sync_step = sync_step
+        self.step_timeout = step_timeout
+        self.action_seq = 0 #number of the last action sent
+        self.applied_seq = 0 #number of the last action the latest state was computed with
+        self.applied_stamp = None #controller time of the first state with applied_seq
+        self.applied_received = None #wall time that state arrived
+        self.state_stamp = None #controller time of the latest state
+        self.state_received = None #wall time the latest state arrived
+        self.obs_age = None #seconds between the controller computing and step returning the observation
+        self.action_latency = None #seconds from publishing the action to a state reflecting it
+        #trace directory every state, action and step is appended to, see recording.py
+        self.recorder = TraceWriter(record, self.goal, self.action_space.shape[0]) if record else None
+
+        #reset waits on these instead of fixed sleeps
+        self.cond = threading.Condition()
+        self.state_seq = 0
+        self.joint_positions = None
+        self.joint_velocities = None
+
+        #definitions the running controller already has, by name
+        self.uploaded_primitives = {}
+        self.uploaded_tasks = {}
+
+        #ROS is only contacted on first use, so creating envs is instant. `ros` is
+        #rospy or a stand-in with the same init_node, core, Subscriber, Publisher,
+        #ServiceProxy, Rate, Duration, get_time and logwarn, e.g. a local fake for tests
+        self.ros = ros
+        self.connected = False
+
+    def connect(self):
+        """Registers this env's topics and services and uploads the tasks, done on first use
+
+        The node itself is registered by init_node, which rospy only allows on the
+        main thread; connecting from another thread before that is an error.
+        """
+        if self.connected:
+            return
+        ros = self.ros
+        service_proxy = ros.ServiceProxy
+        with _connect_lock:
+            if not ros.core.is_initialized():
+                if threading.current_thread() is not threading.main_thread():
+                    raise RuntimeError('ManipulateEnv.connect: call environment.init_node() on the main thread '
+                                       'before connecting from other threads')
+                init_node(ros)
+            ros.Subscriber(self.ns + "/ee_rl/state", StateMsg, self._next_observation)
+            ros.Subscriber(self.ns + "/joint_states", JointState, self._joint_states)
+            self.pub = ros.Publisher(self.ns + '/ee_rl/act', DesiredErrorDynamicsMsg)
+            self.effort_pub = ros.Publisher(self.ns + '/position_joint_trajectory_controller/command', JointTrajectory)
+
+            #service proxies are created once and reused by every reset
+            self.set_primitives_srv = service_proxy(self.ns + '/hiqp_joint_effort_controller/set_primitives', SetPrimitives)
+            self.set_tasks_srv = service_proxy(self.ns + '/hiqp_joint_effort_controller/set_tasks', SetTasks)
+            self.remove_tasks_srv = service_proxy(self.ns + '/hiqp_joint_effort_controller/remove_tasks', RemoveTasks)
+            self.switch_srv = service_proxy(self.ns + '/controller_manager/switch_controller', SwitchController)
+            self.unload_srv = service_proxy(self.ns + '/controller_manager/unload_controller', UnloadController)
+            self.load_srv = service_proxy(self.ns + '/controller_manager/load_controller', LoadController)
+
+            self.rate = ros.Rate(self.control_rate)
         self.set_primitives()
         self.set_tasks()
-        self.rate.sleep()
-        time.sleep(1) #wait for ros to start up
+        #wait for ros to start up: the trajectory controller listens and joint states arrive
+        if not self._wait_for(lambda: self.effort_pub.get_num_connections() > 0
+                              and self.joint_positions is not None, 1.0, poll=0.01):
+            self.ros.logwarn("ManipulateEnv.connect: {} not up within 1 s".format(self.ns or '/'))
+        self.connected = True
 
     def set_primitives(self):
         #print("setting primitves")
         #set all primitives into hiqp
-        hiqp_primitve_srv = rospy.ServiceProxy('/hiqp_joint_effort_controller/set_primitives', SetPrimitives)
         ee_prim = Primitive(name='ee_point',type='point',frame_id='three_dof_planar_eef',visible=True,color=[1,0,0,1],parameters=[0,0,0])
         goal_prim = Primitive(name='goal',type='sphere',frame_id='world',visible=True,color=[0,1,0,1],parameters=[self.goal[0],self.goal[1],0,0.02])
         back_plane = Primitive(name='back_plane',type='plane',frame_id='world',visible=True,color=[0,1,0,0.5],parameters=[0,1,0,-0.8])
         front_plane = Primitive(name='front_plane',type='plane',frame_id='world',visible=True,color=[0,1,0,0.5],parameters=[0,1,0,0.8])
         left_plane = Primitive(name='left_plane',type='plane',frame_id='world',visible=True,color=[0,1,0,0.5],parameters=[1,0,0,-0.8])
         right_plane = Primitive(name='right_plane',type='plane',frame_id='world',visible=True,color=[0,1,0,0.5],parameters=[1,0,0,0.8])
-        hiqp_primitve_srv([ee_prim, back_plane, front_plane, left_plane, right_plane, goal_prim])
+        self._upload(self.set_primitives_srv, self.uploaded_primitives,
+                     [ee_prim, back_plane, front_plane, left_plane, right_plane, goal_prim])
 
     def set_tasks(self):
         #set the tasks to hiqp
         #print("setting tasks")
-        hiqp_task_srv = rospy.ServiceProxy('/hiqp_joint_effort_controller/set_tasks', SetTasks)
         cage_front = Task(name='ee_cage_front',priority=0,visible=True,active=True,monitored=True,
                           def_params=['TDefGeomProj','point', 'plane', 'ee_point < front_plane'],
                           dyn_params=['TDynPD', '1.0', '2.0'])
@@ -64,63 +153,221 @@ class ManipulateEnv(gym.Env):
         cage_right = Task(name='ee_cage_right',priority=0,visible=True,active=True,monitored=True,
                           def_params=['TDefGeomProj','point', 'plane', 'ee_point < right_plane'],
                           dyn_params=['TDynPD', '1.0', '2.0'])
+        rl_dyn_params = ['TDynAsyncPolicy', '10.0', 'ee_rl/act', 'ee_rl/state', '/home/tsv/hiqp_logs/']
+        if self.state_channel:
+            rl_dyn_params.append(self.state_channel)
         rl_task = Task(name='ee_rl',priority=1,visible=True,active=True,monitored=True,
                           def_params=['TDefRL2DSpace','1','0','0','0','1','0','ee_point'],
-                          dyn_params=['TDynAsyncPolicy', '10.0', 'ee_rl/act', 'ee_rl/state', '/home/tsv/hiqp_logs/'])
+                          dyn_params=rl_dyn_params)
         redundancy = Task(name='full_pose',priority=2,visible=True,active=True,monitored=True,
                           def_params=['TDefFullPose', '0.1', '-0.3', '0.0'],
                           dyn_params=['TDynPD', '0.5', '1.5'])
-        hiqp_task_srv([cage_front,cage_back,cage_left,cage_right,rl_task,redundancy])
+        self._upload(self.set_tasks_srv, self.uploaded_tasks,
+                     [cage_front,cage_back,cage_left,cage_right,rl_task,redundancy])
+
+    def _upload(self, srv, uploaded, definitions):
+        #only send definitions the controller does not already have
+        changed = [d for d in definitions if uploaded.get(d.name) != d]
+        if changed:
+            with instrumentation.span('env/service_calls'):
+                try:
+                    srv(changed)
+                except Exception:
+                    #the controller may hold any part of the request, send everything next time
+                    uploaded.clear()
+                    raise
+            for d in changed:
+                uploaded[d.name] = d
 
     def _next_observation(self, data):
-        delta_x = self.goal[0] - data.e[0]
-        delta_y = self.goal[1] - data.e[1]
-        self.observation = np.array([delta_x, delta_y])
+        received = self._now()
+        if self.recorder is not None:
+            self.recorder.state(received, data)
+        self._set_observation(data.e, data.stamp, data.action_seq, received)
+
+    def _read_channel(self):
+        #the sequence number only changes when the controller wrote a newer state
+        seq = self.channel.read()
+        if seq != self.channel_seq:
+            self.channel_seq = seq
+            received = self._now()
+            if self.recorder is not None:
+                self.recorder.state(received, self.channel.message())
+            self._set_observation(self.channel.get('e'), self.channel.stamp, self.channel.action_seq, received)
+
+    def _set_observation(self, e, stamp, action_seq, received):
+        delta_x = self.goal[0] - e[0]
+        delta_y = self.goal[1] - e[1]
+        with self.cond:
+            self.observation = np.array([delta_x, delta_y])
+            self.state_seq += 1
+            self.state_stamp = stamp
+            self.state_received = received
+            if action_seq != self.applied_seq:
+                self.applied_seq = action_seq
+                self.applied_stamp = stamp
+                self.applied_received = self.state_received
+            self.cond.notify_all()
+
+    def _joint_states(self, data):
+        if not set(HOME_JOINTS).issubset(data.name):
+            return
+        idx = [data.name.index(j) for j in HOME_JOINTS]
+        with self.cond:
+            self.joint_positions = np.array([data.position[i] for i in idx])
+            if len(data.velocity) == len(data.name):
+                self.joint_velocities = np.array([data.velocity[i] for i in idx])
+            self.cond.notify_all()
+
+    def _open_channel(self):
+        #the task creates the channel when it is initialized, only e is needed unless recording
+        if self.state_channel and self.channel is None:
+            self.channel = StateChannel(self.state_channel, fields=FIELDS if self.recorder else ['e'])
+
+    def _wait_for(self, predicate, timeout, poll=None):
+        #block until predicate() holds, checked every time a callback notifies
+        #and every `poll` seconds for conditions nothing notifies about, like
+        #a state channel
+        if self.channel is not None:
+            poll = 0.005
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if self.channel is not None:
+                    self._read_channel()
+                if predicate():
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining if poll is None else min(remaining, poll))
+
+    def _at_home(self):
+        if self.joint_positions is None:
+            return False
+        if np.max(np.abs(self.joint_positions - HOME_POSE)) > self.home_tolerance:
+            return False
+        return self.joint_velocities is None or np.max(np.abs(self.joint_velocities)) < 10*self.home_tolerance
 
     def step(self, action):
         # Execute one time step within the environment
+        if not self.connected:
+            self.connect()
+            self._open_channel()
         a = action.numpy()[0] * 100
         act_pub = [a[0], a[1]]
-        self.pub.publish(act_pub)
-        self.rate.sleep()
+        seq = self.state_seq
+        self.action_seq += 1
+        t_action = self._now()
+        with instrumentation.span('env/publish'):
+            self.pub.publish(DesiredErrorDynamicsMsg(e_ddot_star=act_pub, seq=self.action_seq))
+        if self.recorder is not None:
+            self.recorder.action(t_action, self.action_seq, act_pub)
+        if self.sync_step:
+            with instrumentation.span('env/wait_state'):
+                self._wait_for_applied(self.action_seq, t_action)
+        else:
+            with instrumentation.span('env/rate_sleep'):
+                self.rate.sleep()
+            if self.channel is not None:
+                with instrumentation.span('env/read_state'):
+                    self._read_channel()
+        if self.state_seq == seq:
+            #no state arrived during this step, the observation is stale
+            instrumentation.count('env/stale_states')
+        if self.applied_seq >= self.action_seq:
+            self.action_latency = self.applied_received - t_action
+            instrumentation.record('env/action_to_state', self.action_latency)
+        else:
+            #the observation does not reflect the action yet
+            self.action_latency = None
+            instrumentation.count('env/unapplied_actions')
+        now = self._ros_time()
+        if self.state_stamp is not None:
+            self.obs_age = now - self.state_stamp
+            instrumentation.record('env/obs_age', self.obs_age)
+        if self.recorder is not None:
+            self.recorder.step(STEP, self._now(), now)
 
         reward, done, obs_hit = self.calc_shaped_reward()
         return self.observation, reward, done, obs_hit
 
+    def _now(self):
+        #wall clock of receive, send and return times
+        return time.time()
+
+    def _ros_time(self):
+        return self.ros.get_time()
+
+    def _wait_for_applied(self, action_seq, t_action):
+        #first the state of the control cycle that applied the action, then
+        #the first state computed at least one step period after it
+        deadline = t_action + self.step_timeout
+        applied = self._wait_for(lambda: self.applied_seq >= action_seq, self.step_timeout)
+        if applied:
+            step_end = self.applied_stamp + 1.0 / self.control_rate
+            applied = self._wait_for(lambda: self.state_stamp >= step_end, deadline - self._now())
+        if not applied:
+            #the observation is whatever arrived last
+            instrumentation.count('env/step_timeouts')
+        return applied
+
     def reset(self):
         # Reset the state of the environment to an initial state
         # subprocess.call("~/Workspaces/catkin_ws/src/panda_demos/panda_table_launch/scripts/sim_reset_episode_fast.sh", shell=True)
 
+        t_start = time.time()
+        self.connect()
         #print("Resetting environment")
-        cs = rospy.ServiceProxy('/controller_manager/switch_controller', SwitchController)
-        cs_unload = rospy.ServiceProxy('/controller_manager/unload_controller', UnloadController)
-        cs_load = rospy.ServiceProxy('/controller_manager/load_controller', LoadController)
-        remove_tasks = rospy.ServiceProxy('/hiqp_joint_effort_controller/remove_tasks', RemoveTasks)
-        #print('removing tasks')
-        remove_tasks(['ee_cage_back','ee_cage_left','ee_cage_right','ee_cage_front','ee_rl','full_pose'])
-        #time.sleep(1)
+        if self.reload_controller:
+            #print('removing tasks')
+            with instrumentation.span('env/service_calls'):
+                self.remove_tasks_srv(['ee_cage_back','ee_cage_left','ee_cage_right','ee_cage_front','ee_rl','full_pose'])
+        else:
+            #the tasks stay loaded, make sure the old action does not act on restart
+            self.action_seq += 1
+            self.pub.publish(DesiredErrorDynamicsMsg(e_ddot_star=[0,0], seq=self.action_seq))
+            if self.recorder is not None:
+                self.recorder.action(self._now(), self.action_seq, [0,0])
 
         #stop hiqp
         #print('switching controller')
-        resp = cs({'position_joint_trajectory_controller'},{'hiqp_joint_effort_controller'},2,True,0.1)
-        #time.sleep(0.2)
-        cs_unload('hiqp_joint_effort_controller')
+        with instrumentation.span('env/service_calls'):
+            resp = self.switch_srv({'position_joint_trajectory_controller'},{'hiqp_joint_effort_controller'},2,True,0.1)
+            if self.reload_controller:
+                self.unload_srv('hiqp_joint_effort_controller')
+                #a fresh controller instance knows no primitives or tasks
+                self.uploaded_primitives.clear()
+                self.uploaded_tasks.clear()
 
         #print('setting to home pose')
-        joints = ['three_dof_planar_joint1','three_dof_planar_joint2','three_dof_planar_joint3']
-        self.effort_pub.publish(JointTrajectory(joint_names=joints,points=[JointTrajectoryPoint(positions=[0.1,-0.3,0.0],time_from_start=rospy.Duration(4.0))]))
-        time.sleep(4.5)
+        self.effort_pub.publish(JointTrajectory(joint_names=HOME_JOINTS,points=[JointTrajectoryPoint(positions=HOME_POSE,time_from_start=self.ros.Duration(self.home_time))]))
+        with instrumentation.span('env/wait_home'):
+            at_home = self._wait_for(self._at_home, self.home_timeout)
+        if not at_home:
+            self.ros.logwarn("ManipulateEnv.reset: home pose not reached within {} s".format(self.home_timeout))
         #restart hiqp
-        cs_load('hiqp_joint_effort_controller')
+        with instrumentation.span('env/service_calls'):
+            if self.reload_controller:
+                self.load_srv('hiqp_joint_effort_controller')
 
-        #print("restarting controller")
-        resp = cs({'hiqp_joint_effort_controller'},{'position_joint_trajectory_controller'},2,True,0.1)
+            #print("restarting controller")
+            resp = self.switch_srv({'hiqp_joint_effort_controller'},{'position_joint_trajectory_controller'},2,True,0.1)
         #set tasks to controller
         self.set_primitives()
         self.set_tasks()
-        #self.pub.publish([0,0])
-        time.sleep(0.5)
+        self._open_channel()
+        #the observation is valid once the restarted task publishes its first state
+        seq = self.state_seq
+        with instrumentation.span('env/wait_state'):
+            fresh = self._wait_for(lambda: self.state_seq > seq, self.state_timeout)
+        if not fresh:
+            self.ros.logwarn("ManipulateEnv.reset: no fresh state within {} s".format(self.state_timeout))
         #print("Now acting")
+        self.reset_latency = time.time() - t_start
+        if self.recorder is not None:
+            self.recorder.step(RESET, self._now(), self._ros_time())
+            self.recorder.flush()
 
         return self.observation  # reward, done, info can't be included
          
@@ -128,7 +375,9 @@ class ManipulateEnv(gym.Env):
         pass
 
     def close (self):
-        pass
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def calc_dist(self):
         dist = math.sqrt(self.observation[0] ** 2 + self.observation[1] ** 2)
@@ -149,4 +398,91 @@ class ManipulateEnv(gym.Env):
             reward += -10*dist
 
         return reward, done, obs_hit
-        
+
+
+class _ReplayPublisher(object):
+    #publishing an action delivers the states recorded up to the end of the step
+    def __init__(self, env):
+        self.env = env
+
+    def publish(self, msg):
+        self.env._deliver()
+
+    def get_num_connections(self):
+        return 1
+
+
+class _NoSleep(object):
+    def sleep(self):
+        pass
+
+
+class ReplayEnv(ManipulateEnv):
+    """Plays a trace recorded with ManipulateEnv(record=...) back at full speed.
+
+    Every reset and step returns what the recorded env returned at the same
+    point: the recorded states are fed through the same callbacks, so the
+    observation, reward, staleness and latency code runs on real traces
+    without ROS. The actions passed to `step` cannot change what happens
+    next; the recorded one is in `recorded_action`. Resetting past the last
+    recorded episode raises EOFError.
+    """
+
+    def __init__(self, trace, **kwargs):
+        kwargs.update(state_channel=None, record=None, step_timeout=0.0)
+        super(ReplayEnv, self).__init__(**kwargs)
+        self.trace = trace if isinstance(trace, Trace) else Trace(trace)
+        self.goal = list(self.trace.goal)
+        self.pub = _ReplayPublisher(self)
+        self.rate = _NoSleep()
+        self.connected = True
+        self.event = -1 #index of the current row of trace.steps
+        self.num_delivered = 0
+        self.recorded_action = None
+        self.clock = 0.0 #recorded wall time, stands in for time.time()
+
+    def connect(self):
+        pass
+
+    def _deliver(self):
+        #every state received before the current event returned
+        end = int(self.trace.steps['states'][self.event])
+        for i in range(self.num_delivered, end):
+            self.clock = float(self.trace.states['time'][i])
+            self._next_observation(self.trace.state(i))
+        self.num_delivered = max(self.num_delivered, end)
+        self.clock = float(self.trace.steps['time'][self.event])
+
+    def _now(self):
+        return self.clock
+
+    def _ros_time(self):
+        return float(self.trace.steps['ros_time'][self.event])
+
+    def seed(self, seed=None):
+        pass
+
+    def reset(self):
+        kinds = self.trace.steps['kind']
+        resets = np.flatnonzero(kinds[self.event + 1:] == RESET)
+        if len(resets) == 0:
+            raise EOFError('{}: no recorded episode left'.format(self.trace.directory))
+        t_start = time.time()
+        self.event += 1 + resets[0]
+        self._deliver()
+        self.reset_latency = time.time() - t_start
+        return self.observation
+
+    def step(self, action):
+        kinds = self.trace.steps['kind']
+        if self.event + 1 >= len(kinds) or kinds[self.event + 1] != STEP:
+            #the recorded episode ended here
+            return self.observation, 0.0, True, False
+        self.event += 1
+        last_action = int(self.trace.steps['actions'][self.event]) - 1
+        self.recorded_action = self.trace.actions['e_ddot_star'][last_action] / 100
+        #number and time the action like the recorded one, so latencies compare the same
+        self.action_seq = int(self.trace.actions['seq'][last_action]) - 1
+        self.clock = float(self.trace.actions['time'][last_action])
+        return super(ReplayEnv, self).step(action)
+
@@ -0,0 +1,68 @@
+import json
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# One .npy file per Transition field plus a small JSON header with the ring
+# state. The column files are memory-mapped, so rows written by
+# ReplayMemory.push land in the page cache immediately and a store can be
+# reopened without reading it into RAM.
+HEADER = 'header.json'
+VERSION = 1
+
+
+def column_shapes(capacity, state_dim, action_dim):
+    return {'state': (capacity, state_dim),
+            'action': (capacity, action_dim),
+            'mask': (capacity,),
+            'next_state': (capacity, state_dim),
+            'reward': (capacity,)}
+
+
+def exists(directory):
+    return os.path.exists(os.path.join(directory, HEADER))
+
+
+def create(directory, capacity, state_dim, action_dim, overwrite=False):
+    """Creates an empty store and returns its memory-mapped columns.
+
+    Refuses to replace an existing store unless `overwrite` is set, since
+    creating truncates every column.
+    """
+    if exists(directory) and not overwrite:
+        raise IOError('{} already holds an experience store, load it or allow overwriting it'.format(directory))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    columns = {}
+    for name, shape in column_shapes(capacity, state_dim, action_dim).items():
+        columns[name] = open_memmap(os.path.join(directory, name + '.npy'), mode='w+',
+                                    dtype=np.float32, shape=shape)
+    write_header(directory, {'version': VERSION, 'capacity': capacity, 'state_dim': state_dim,
+                             'action_dim': action_dim, 'size': 0, 'position': 0})
+    return columns
+
+
+def open_store(directory, mode='r+'):
+    """Maps an existing store, returns (header, columns)"""
+    header = read_header(directory)
+    if header['version'] != VERSION:
+        raise ValueError('Unsupported experience store version {} in {}'.format(header['version'], directory))
+    columns = {}
+    for name in column_shapes(header['capacity'], header['state_dim'], header['action_dim']):
+        columns[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode)
+    return header, columns
+
+
+def read_header(directory):
+    with open(os.path.join(directory, HEADER)) as f:
+        return json.load(f)
+
+
+def write_header(directory, header):
+    """Atomically replaces the header so a crash never leaves it half written"""
+    path = os.path.join(directory, HEADER)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(header, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
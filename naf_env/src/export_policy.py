@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Exports the mu head of a saved NAF model for the TDynNAFPolicy controller plugin.
+
+    python export_policy.py --model_path models/naf_..._.pth --output policy.bin
+    python export_policy.py --model_path models/naf_..._.pth --output policy.bin \\
+        --check ../../../devel/lib/rl_task_plugins/rl_task_plugins_check_policy
+
+The input BatchNorm is folded into the first layer as in InferencePolicy,
+see inference.py for the file layout. The plugin then runs the policy in the
+controller at its full rate, in place of TDynAsyncPolicy and this process:
+
+    dyn_params=['TDynNAFPolicy', '10.0', '/abs/path/policy.bin', '100', '-0.2', '-0.5']
+
+i.e. the damping, the weight file, the action scale of ManipulateEnv.step
+and the goal, the observation being goal - e as in ManipulateEnv. The
+plugin reloads the file whenever it changes, so exporting again (or
+main.py --export_policy during training) updates the running policy.
+
+--check feeds random observations to the rl_task_plugins_check_policy
+binary and compares its outputs to InferencePolicy.
+"""
+import argparse
+import subprocess
+import sys
+from types import SimpleNamespace
+import numpy as np
+import torch
+
+from inference import InferencePolicy
+from naf import NAF
+
+
+def check(policy, path, binary, samples, tolerance, seed=0):
+    """Largest |C++ - PyTorch| over `samples` random observations, raises beyond `tolerance`"""
+    rng = np.random.RandomState(seed)
+    num_inputs = policy.weight1.shape[0]
+    # the env observations are goal deltas, mostly within a meter
+    states = (rng.randn(samples, num_inputs) * 0.5).astype(np.float32)
+    inputs = '\n'.join(' '.join('{:.9g}'.format(v) for v in row) for row in states) + '\n'
+    output = subprocess.run([binary, path], input=inputs, stdout=subprocess.PIPE, universal_newlines=True,
+                            check=True).stdout
+    cpp = np.array([[float(v) for v in line.split()] for line in output.splitlines()])
+    with torch.inference_mode():
+        expected = policy.forward(torch.from_numpy(states)).numpy()
+    error = np.abs(cpp - expected).max()
+    print('check: {} observations, max |C++ - PyTorch| = {:.3g}'.format(samples, error))
+    if not error <= tolerance:
+        raise AssertionError('exported policy differs from InferencePolicy by {:.3g}'.format(error))
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a NAF policy for TDynNAFPolicy')
+    parser.add_argument('--model_path', required=True, help='model saved by main.py --save_agent')
+    parser.add_argument('--output', default='policy.bin', help='weight file to write (default: policy.bin)')
+    parser.add_argument('--hidden_size', type=int, default=128, metavar='N',
+                        help='hidden size of the model (default: 128)')
+    parser.add_argument('--state_dim', type=int, default=2)
+    parser.add_argument('--action_dim', type=int, default=2)
+    parser.add_argument('--check', metavar='BINARY', help='compare rl_task_plugins_check_policy to PyTorch')
+    parser.add_argument('--samples', type=int, default=1000, metavar='N',
+                        help='observations compared by --check (default: 1000)')
+    parser.add_argument('--tolerance', type=float, default=1e-5,
+                        help='largest accepted difference (default: 1e-5)')
+    args = parser.parse_args()
+
+    agent = NAF(0.99, 0.001, args.hidden_size, args.state_dim, SimpleNamespace(shape=(args.action_dim,)))
+    agent.load_model(None, None, None, model_path=args.model_path)
+    policy = InferencePolicy(agent.model)
+    policy.export(args.output)
+    print('Exported policy to {}'.format(args.output))
+    if args.check:
+        try:
+            check(policy, args.output, args.check, args.samples, args.tolerance)
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+
+from planar_arm import shaped_reward
+
+
+class HindsightRelabeler(object):
+    """Hindsight goal relabeling between a ReplayMemory and NAF.update_parameters.
+
+    Observations are goal deltas (goal - end effector), so next to every
+    memory row the relabeler keeps the goal the env was given and the end
+    effector position reached. When an episode ends, its reached positions
+    are appended, in order, to a ring of achieved goals, and each of its
+    rows remembers where it sits in that ring and where its episode ends.
+
+    `relabel` swaps the goal of a `ratio` fraction of a sampled batch for
+    one the arm actually reached later in the same episode (the "future"
+    strategy) and recomputes state, next_state, reward and mask with
+    `reward_fn`, all batched in NumPy. Rows of episodes still running, or
+    loaded from an experience store, are passed through unchanged. Stacked
+    batches from `sample_batches` are relabeled row by row, the same way.
+    """
+
+    def __init__(self, capacity, goal_dim=2, ratio=0.8, reward_fn=shaped_reward):
+        self.capacity = capacity
+        self.ratio = ratio
+        self.reward_fn = reward_fn
+        self.goals = np.zeros((capacity, goal_dim))
+        self.achieved = np.zeros((capacity, goal_dim))
+        # position of every row in the achieved goal ring and of its episode's last row, -1 if open
+        self.episode_pos = np.full(capacity, -1, dtype=np.int64)
+        self.episode_end = np.full(capacity, -1, dtype=np.int64)
+        self.future = np.zeros((capacity, goal_dim))
+        self.position = 0
+        self.open_rows = {}
+
+    def state_dict(self):
+        return {'goals': self.goals.copy(), 'achieved': self.achieved.copy(),
+                'episode_pos': self.episode_pos.copy(), 'episode_end': self.episode_end.copy(),
+                'future': self.future.copy(), 'position': self.position,
+                'open_rows': dict((env, list(rows)) for env, rows in self.open_rows.items())}
+
+    def load_state_dict(self, state):
+        for name in ('goals', 'achieved', 'episode_pos', 'episode_end', 'future'):
+            getattr(self, name)[:] = state[name]
+        self.position = state['position']
+        self.open_rows = dict((env, list(rows)) for env, rows in state['open_rows'].items())
+
+    def extend(self, rows, envs, goals, achieved):
+        """Records goal and reached position of the memory rows just written by `envs`"""
+        rows = np.asarray(rows)
+        self.goals[rows] = goals
+        self.achieved[rows] = achieved
+        self.episode_pos[rows] = -1
+        self.episode_end[rows] = -1
+        for row, env in zip(rows, envs):
+            self.open_rows.setdefault(env, []).append(row)
+
+    def end_episodes(self):
+        """Closes every open episode, making its rows available for relabeling"""
+        for rows in self.open_rows.values():
+            rows = np.array(rows[-self.capacity:])
+            positions = (self.position + np.arange(len(rows))) % self.capacity
+            self.future[positions] = self.achieved[rows]
+            self.episode_pos[rows] = positions
+            self.episode_end[rows] = positions[-1]
+            self.position = (self.position + len(rows)) % self.capacity
+        self.open_rows.clear()
+
+    def relabel(self, batch, indices):
+        """Relabels a batch gathered from the memory rows `indices`, in place"""
+        indices = np.asarray(indices).ravel()
+        pos = self.episode_pos[indices]
+        chosen = np.flatnonzero((np.random.rand(len(indices)) < self.ratio) & (pos >= 0))
+        if len(chosen) == 0:
+            return batch
+        rows, pos = indices[chosen], pos[chosen]
+        span = (self.episode_end[rows] - pos) % self.capacity + 1
+        goals = self.future[(pos + (np.random.rand(len(rows)) * span).astype(np.int64)) % self.capacity]
+
+        # goal - position is linear in the goal, shift both observations by the change of goal
+        shift = goals - self.goals[rows]
+        # flat views of the batch tensors, the writes below land in them
+        state = batch.state.numpy().reshape(len(indices), -1)
+        next_state = batch.next_state.numpy().reshape(len(indices), -1)
+        state[chosen] += shift
+        next_state[chosen] += shift
+        rewards, dones = self.reward_fn(next_state[chosen])
+        batch.reward.numpy().reshape(-1)[chosen] = rewards
+        batch.mask.numpy().reshape(-1)[chosen] = ~dones
+        return batch
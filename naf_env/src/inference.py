@@ -0,0 +1,81 @@
+import os
+import struct
+import numpy as np
+import torch
+
+# weight file of the mu head read by the TDynNAFPolicy controller plugin
+# (rl_task_plugins/src/mlp_policy.cpp), all little-endian: magic, version,
+# number of layers, then per layer outputs, inputs, activation, the
+# outputs x inputs float32 weights row-major and the float32 biases
+EXPORT_MAGIC = b'NAFP'
+EXPORT_VERSION = 1
+TANH = 1
+
+
+class InferencePolicy(object):
+    """Frozen snapshot of the mu head of a NAF Policy for acting.
+
+    The input BatchNorm is folded into the first linear layer using its
+    running statistics, which is exactly what Policy computes in eval mode,
+    and only the layers leading to mu are kept. Acting runs three fused
+    addmm+tanh calls under torch.inference_mode, without touching the
+    training model or its train/eval state. Call `refresh` to pick up new
+    weights.
+    """
+
+    def __init__(self, policy):
+        self.refresh(policy)
+
+    @torch.no_grad()
+    def refresh(self, policy):
+        bn = policy.bn0
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        shift = bn.bias - scale * bn.running_mean
+        # linear1(scale * x + shift) = (W1 * scale) x + (W1 shift + b1)
+        self.weight1 = (policy.linear1.weight * scale).t().contiguous()
+        self.bias1 = policy.linear1.bias + policy.linear1.weight.mv(shift)
+        # cloned, for a single action the transposed mu weight is already
+        # contiguous and .contiguous() would alias the training parameter
+        self.weight2 = policy.linear2.weight.t().clone(memory_format=torch.contiguous_format)
+        self.bias2 = policy.linear2.bias.clone()
+        self.weight_mu = policy.mu.weight.t().clone(memory_format=torch.contiguous_format)
+        self.bias_mu = policy.mu.bias.clone()
+
+    def layers(self):
+        """(weight, bias) of every layer as (outputs, inputs) and (outputs,) float32 arrays"""
+        return [(w.t().numpy().astype(np.float32), b.numpy().astype(np.float32))
+                for w, b in ((self.weight1, self.bias1), (self.weight2, self.bias2), (self.weight_mu, self.bias_mu))]
+
+    def export(self, path):
+        """Writes the mu head to `path` for TDynNAFPolicy.
+
+        The file is written to a temporary name and renamed into place, so a
+        controller watching `path` never loads a partial file.
+        """
+        data = [EXPORT_MAGIC, struct.pack('<II', EXPORT_VERSION, 3)]
+        for weight, bias in self.layers():
+            data.append(struct.pack('<III', weight.shape[0], weight.shape[1], TANH))
+            data.append(weight.astype('<f4').tobytes())
+            data.append(bias.astype('<f4').tobytes())
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = os.path.join(directory, '.' + os.path.basename(path) + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    def forward(self, state):
+        x = torch.addmm(self.bias1, state, self.weight1).tanh_()
+        x = torch.addmm(self.bias2, x, self.weight2).tanh_()
+        return torch.addmm(self.bias_mu, x, self.weight_mu).tanh_()
+
+    def select_action(self, state, action_noise=None):
+        """Same contract as NAF.select_action"""
+        with torch.inference_mode():
+            mu = self.forward(state)
+            if action_noise is not None:
+                mu.add_(torch.from_numpy(np.asarray(action_noise.noise(), dtype=np.float32)))
+            return mu.clamp_(-1, 1)
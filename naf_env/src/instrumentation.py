@@ -0,0 +1,158 @@
+"""Named timing spans and counters for the training loop.
+
+    with instrumentation.span('env/step'):
+        ...
+    instrumentation.count('env/steps', n)
+    instrumentation.record('env/obs_age', seconds)
+
+Everything is off until `enable()` is called. While off, `span` returns a
+shared no-op context manager and `count` returns right away, so the
+instrumented code pays one function call per span. `record` adds a
+duration measured elsewhere, like a latency, as a sample of a span. Samples are collected
+per episode: `write_episode` sends that episode's totals, p50/p99
+latencies, counters and steps/s to a SummaryWriter and folds the samples
+into a window, which `report` formats as a text table and clears.
+"""
+import time
+from collections import defaultdict
+import functools
+import numpy as np
+
+_enabled = False
+_episode = defaultdict(list)
+_window = defaultdict(list)
+_episode_counters = defaultdict(int)
+_window_counters = defaultdict(int)
+_episode_start = time.perf_counter()
+_window_start = time.perf_counter()
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _episode[self.name].append(time.perf_counter() - self.start)
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+    clear()
+
+
+def enabled():
+    return _enabled
+
+
+def span(name):
+    """Context manager timing its body under `name`"""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def timed(name):
+    """Decorator timing every call of the function under `name`"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    """Adds a duration measured by the caller as a sample of `name`"""
+    if _enabled:
+        _episode[name].append(seconds)
+
+
+def count(name, n=1):
+    if _enabled:
+        _episode_counters[name] += n
+
+
+def clear():
+    """Drops all samples and counters and restarts the clocks"""
+    global _episode_start, _window_start
+    for samples in (_episode, _window, _episode_counters, _window_counters):
+        samples.clear()
+    _episode_start = _window_start = time.perf_counter()
+
+
+def _summarize(samples, counters, elapsed):
+    spans = {}
+    for name, durations in samples.items():
+        durations = np.asarray(durations)
+        p50, p99 = np.percentile(durations, [50, 99])
+        spans[name] = {'count': len(durations), 'total': float(durations.sum()),
+                       'p50': float(p50), 'p99': float(p99)}
+    return {'elapsed': elapsed, 'spans': spans, 'counters': dict(counters),
+            'steps_per_s': counters.get('env/steps', 0) / elapsed if elapsed > 0 else 0.0}
+
+
+def summary():
+    """Breakdown of the current episode"""
+    return _summarize(_episode, _episode_counters, time.perf_counter() - _episode_start)
+
+
+def write_episode(writer, step):
+    """Writes the episode breakdown to a SummaryWriter and starts a new episode"""
+    global _episode_start
+    if not _enabled:
+        return
+    stats = summary()
+    for name, s in stats['spans'].items():
+        writer.add_scalar('timing/{}/total_s'.format(name), s['total'], step)
+        writer.add_scalar('timing/{}/p50_ms'.format(name), 1e3 * s['p50'], step)
+        writer.add_scalar('timing/{}/p99_ms'.format(name), 1e3 * s['p99'], step)
+    for name, value in stats['counters'].items():
+        writer.add_scalar('count/{}'.format(name), value, step)
+    writer.add_scalar('timing/episode_s', stats['elapsed'], step)
+    writer.add_scalar('perf/steps_per_s', stats['steps_per_s'], step)
+
+    for name, durations in _episode.items():
+        _window[name].extend(durations)
+    for name, value in _episode_counters.items():
+        _window_counters[name] += value
+    _episode.clear()
+    _episode_counters.clear()
+    _episode_start = time.perf_counter()
+
+
+def report():
+    """Text table of the episodes written since the last report, then clears them"""
+    global _window_start
+    stats = _summarize(_window, _window_counters, time.perf_counter() - _window_start)
+    lines = ['{:<28} {:>8} {:>10} {:>7} {:>10} {:>10}'.format(
+        'span', 'count', 'total s', 'share', 'p50 ms', 'p99 ms')]
+    for name, s in sorted(stats['spans'].items(), key=lambda item: -item[1]['total']):
+        lines.append('{:<28} {:>8} {:>10.3f} {:>6.1%} {:>10.3f} {:>10.3f}'.format(
+            name, s['count'], s['total'], s['total'] / stats['elapsed'], 1e3 * s['p50'], 1e3 * s['p99']))
+    for name, value in sorted(stats['counters'].items()):
+        lines.append('{:<28} {:>8}'.format(name, value))
+    lines.append('{:.1f} s wall, {:.1f} steps/s'.format(stats['elapsed'], stats['steps_per_s']))
+    _window.clear()
+    _window_counters.clear()
+    _window_start = time.perf_counter()
+    return '\n'.join(lines)
@@ -1,25 +1,27 @@
 #!/usr/bin/env python
+import time
+IMPORT_START = time.perf_counter()
 import argparse
-import matplotlib.pyplot as plt
 import numpy as np
 import torch
-import time
-import pickle
-import matplotlib.colors as colors
-import matplotlib.cm as cmx
-import gym
-from torch.autograd import Variable
-from tensorboardX import SummaryWriter
 
 #import files...
 from naf import NAF
 from ounoise import OUNoise
-from replay_memory import Transition, ReplayMemory
-from environment import ManipulateEnv
+from replay_memory import ReplayMemory, PrioritizedReplayMemory, SharedReplayMemory
+from vec_env import VecEnv
+from inference import InferencePolicy
+import instrumentation
+import checkpoint
+from metrics import ScalarWindow
 
+# the envs (ROS or gym), tensorboardX and the optional training modes are
+# imported where they are used, so --eval_only starts without them
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 
-def main():
+
+def build_parser():
     parser = argparse.ArgumentParser(description='PyTorch X-job')
     parser.add_argument('--env_name', default="Pendulum-v0",
                         help='name of the environment')
@@ -27,6 +29,8 @@ def main():
                         help='discount factor for reward (default: 0.99)')
     parser.add_argument('--tau', type=float, default=0.001,
                         help='discount factor for model (default: 0.001)')
+    parser.add_argument('--target_update_every', type=int, default=1, metavar='N',
+                        help='gradient steps between target network updates, tau is scaled to match (default: 1)')
     parser.add_argument('--ou_noise', type=bool, default=True)
     parser.add_argument('--noise_scale', type=float, default=0.4, metavar='G',
                         help='initial noise scale (default: 0.3)')
@@ -54,53 +58,331 @@ def main():
                         help='Training or run')
     parser.add_argument('--load_agent', type=bool, default=False,
                         help='load model from file')
-    parser.add_argument('--load_exp', type=bool, default=False,
-                        help='load saved experience')
+    parser.add_argument('--load_exp', default=None, metavar='DIR',
+                        help='experience store to warm-start from, new experience keeps appending to it')
+    parser.add_argument('--load_exp_limit', type=int, default=None, metavar='N',
+                        help='only load the newest N transitions of --load_exp, into a new store at --exp_dir '
+                             'if given')
+    parser.add_argument('--exp_dir', default=None, metavar='DIR',
+                        help='directory experience is streamed to, must not hold a store already unless '
+                             '--overwrite_exp is given (default: off, experience is kept in memory)')
+    parser.add_argument('--overwrite_exp', action='store_true',
+                        help='replace an existing experience store at --exp_dir, e.g. when resuming a run')
     parser.add_argument('--greedy_steps', type=int, default=10, metavar='N',
                         help='amount of times greedy goes (default: 10)')
+    parser.add_argument('--compile_model', action='store_true',
+                        help='compile the NAF forward with torch.compile')
+    parser.add_argument('--fused_updates', type=int, default=1, metavar='K',
+                        help='gradient steps run per NAF.update_many call, on K batches sampled at once '
+                             '(default: 1)')
+    parser.add_argument('--prioritized', action='store_true',
+                        help='use prioritized experience replay')
+    parser.add_argument('--alpha', type=float, default=0.6, metavar='G',
+                        help='prioritization exponent (default: 0.6)')
+    parser.add_argument('--beta', type=float, default=0.4, metavar='G',
+                        help='initial importance-sampling exponent, annealed to 1 (default: 0.4)')
+    parser.add_argument('--hindsight', action='store_true',
+                        help='relabel sampled transitions with goals reached later in their episode')
+    parser.add_argument('--hindsight_ratio', type=float, default=0.8, metavar='G',
+                        help='fraction of every batch that is relabeled (default: 0.8)')
+    parser.add_argument('--num_envs', type=int, default=1, metavar='N',
+                        help='number of environments stepped in parallel (default: 1)')
+    parser.add_argument('--env_ns', default='/env{}',
+                        help='ROS namespace pattern of the parallel environments (default: /env{})')
+    parser.add_argument('--surrogate', action='store_true',
+                        help='train on the headless NumPy planar arm instead of ROS (default: off)')
+    parser.add_argument('--state_channel', default=None, metavar='NAME',
+                        help='read states from the shared memory channel NAME ({} is replaced by the env index) '
+                             'instead of the ee_rl/state topic (default: off)')
+    parser.add_argument('--record', default=None, metavar='DIR',
+                        help='append every state, action and step of the ROS env to a trace in DIR '
+                             '({} is replaced by the env index, see recording.py) (default: off)')
+    parser.add_argument('--replay', default=None, metavar='DIR',
+                        help='replay the trace in DIR ({} is replaced by the env index) instead of ROS')
+    parser.add_argument('--control_rate', type=float, default=10.0, metavar='HZ',
+                        help='env steps per second of the ROS env (default: 10)')
+    parser.add_argument('--home_time', type=float, default=1.0, metavar='S',
+                        help='duration of the move to the home pose on every ROS env reset (default: 1.0)')
+    parser.add_argument('--sync_step', action='store_true',
+                        help='end every ROS env step on a state computed 1/control_rate after the action '
+                             'was applied, instead of sleeping at control_rate')
+    parser.add_argument('--step_timeout', type=float, default=0.5, metavar='S',
+                        help='longest wait for that state with --sync_step (default: 0.5)')
+    parser.add_argument('--plot_every', type=int, default=0, metavar='N',
+                        help='plot the path of env 0 over the V/mu field every N episodes, in a '
+                             'worker process (default: 0, off)')
+    parser.add_argument('--plot_dir', default='plots/',
+                        help='directory of the path plots (default: plots/)')
+    parser.add_argument('--export_policy', default=None, metavar='PATH',
+                        help='write the policy for the TDynNAFPolicy controller plugin to PATH after '
+                             'every training block, see export_policy.py (default: off)')
+    parser.add_argument('--timing', action='store_true',
+                        help='time the training stages and write the breakdown to tensorboard')
+    parser.add_argument('--timing_every', type=int, default=10, metavar='N',
+                        help='episodes between printed timing summaries (default: 10)')
+    parser.add_argument('--eval_only', '--eval-only', action='store_true',
+                        help='load a saved model and only run greedy episodes with it')
+    parser.add_argument('--eval_episodes', type=int, default=10, metavar='N',
+                        help='greedy episodes run by --eval_only (default: 10)')
+    parser.add_argument('--model_path', default=None,
+                        help='model file to load (default: models/naf_<env_name>_<batch_size>_<num_episodes>_.pth)')
+    parser.add_argument('--log_every', type=int, default=100, metavar='N',
+                        help='updates per logged loss mean/min/max (default: 100)')
+    parser.add_argument('--checkpoint_every', type=int, default=0, metavar='N',
+                        help='save the full training state every N episodes, e.g. 10 (default: 0, off)')
+    parser.add_argument('--checkpoint_dir', default='checkpoints/',
+                        help='directory of the checkpoints (default: checkpoints/)')
+    parser.add_argument('--keep_checkpoints', type=int, default=3, metavar='K',
+                        help='number of newest checkpoints kept, at least 1 (default: 3)')
+    parser.add_argument('--resume', nargs='?', const='latest', default=None, metavar='PATH',
+                        help='continue from a checkpoint, the newest in --checkpoint_dir without PATH')
+    parser.add_argument('--async_actors', type=int, default=0, metavar='N',
+                        help='run N actor processes next to a continuously updating learner (default: 0, off)')
+    parser.add_argument('--sync_every', type=int, default=100, metavar='N',
+                        help='learner updates between policy broadcasts to the actors (default: 100)')
+    parser.add_argument('--report_every', type=float, default=10.0, metavar='S',
+                        help='seconds between actor/learner throughput reports (default: 10)')
+    parser.add_argument('--num_threads', type=int, default=0, metavar='N',
+                        help='torch intra-op threads (default: 0, torch picks)')
+    parser.add_argument('--results', default=None, metavar='PATH',
+                        help='write the final reward statistics to PATH as JSON')
+    return parser
 
-    args = parser.parse_args()
 
-    env = ManipulateEnv()
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    print('startup: imports took {:.2f} s'.format(IMPORT_SECONDS))
+    if args.fused_updates < 1:
+        parser.error('--fused_updates must be at least 1')
+    if args.keep_checkpoints < 1:
+        parser.error('--keep_checkpoints must be at least 1')
+    if args.async_actors and args.prioritized:
+        parser.error('--prioritized is not supported with --async_actors')
+    if args.async_actors and args.hindsight:
+        parser.error('--hindsight is not supported with --async_actors')
+    if args.async_actors and (args.checkpoint_every or args.resume):
+        parser.error('checkpoints are not supported with --async_actors')
+    if args.async_actors and args.plot_every:
+        parser.error('--plot_every is not supported with --async_actors')
+
+    # one env per parallel instance, or per actor process in async mode
+    num_envs = args.async_actors or args.num_envs
+    if args.surrogate:
+        # the surrogate steps all its arms as one batch, no ROS needed
+        from planar_arm import PlanarArmEnv, PlanarArmVecEnv
+        env_cls = PlanarArmEnv
+        env_fns = [env_cls] * num_envs
+        make_env = lambda: PlanarArmVecEnv(num_envs)
+    else:
+        from environment import ManipulateEnv, ReplayEnv, init_node
+        env_cls = ManipulateEnv
+        channel = (lambda i: args.state_channel.format(i)) if args.state_channel else (lambda i: None)
+        record = (lambda i: args.record.format(i)) if args.record else (lambda i: None)
+        stepping = dict(control_rate=args.control_rate, sync_step=args.sync_step, step_timeout=args.step_timeout,
+                        home_time=args.home_time)
+        if args.replay:
+            env_fns = [lambda i=i: ReplayEnv(args.replay.format(i), **stepping) for i in range(num_envs)]
+        elif num_envs == 1:
+            env_fns = [lambda: ManipulateEnv(state_channel=channel(0), record=record(0), **stepping)]
+        else:
+            env_fns = [lambda i=i: ManipulateEnv(ns=args.env_ns.format(i), state_channel=channel(i),
+                                                 record=record(i), **stepping)
+                       for i in range(num_envs)]
+
+        def make_env():
+            # rospy only registers the node on the main thread, the envs then
+            # connect their own topics from VecEnv's workers
+            if not args.replay:
+                init_node()
+            return VecEnv(env_fns)
     #env = gym.make(args.env_name)
-    writer = SummaryWriter('runs/')
 
-    env.seed(args.seed)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
     torch.manual_seed(args.seed)
     np.random.seed(args.seed)
+    if args.eval_only:
+        return run_eval(args, env_cls, make_env)
+
+    t_writer = time.perf_counter()
+    from metrics import MetricsWriter
+    writer = MetricsWriter('runs/')
+    print('startup: tensorboardX writer took {:.2f} s'.format(time.perf_counter() - t_writer))
+    instrumentation.enable(args.timing)
 
     # -- initialize agent --
     agent = NAF(args.gamma, args.tau, args.hidden_size,
-                env.observation_space.shape[0], env.action_space)
+                env_cls.observation_space.shape[0], env_cls.action_space, args.compile_model,
+                args.target_update_every)
 
     # -- declare memory buffer and random process N
-    memory = ReplayMemory(args.replay_size)
-    ounoise = OUNoise(env.action_space.shape[0]) if args.ou_noise else None
+    # experience is streamed to a memory-mapped store, or loaded from one
+    if args.async_actors:
+        memory_cls = SharedReplayMemory
+    else:
+        memory_cls = PrioritizedReplayMemory if args.prioritized else ReplayMemory
+    memory_kwargs = {'alpha': args.alpha} if args.prioritized else {}
+    if args.load_exp and args.load_exp_limit is None:
+        memory = memory_cls.load(args.load_exp, **memory_kwargs)
+    elif args.load_exp:
+        memory = memory_cls.load(args.load_exp, args.load_exp_limit, capacity=args.replay_size,
+                                 directory=args.exp_dir, overwrite=args.overwrite_exp, **memory_kwargs)
+    else:
+        memory = memory_cls(args.replay_size, state_dim=env_cls.observation_space.shape[0],
+                            action_dim=env_cls.action_space.shape[0], directory=args.exp_dir,
+                            overwrite=args.overwrite_exp, **memory_kwargs)
+    if args.load_exp:
+        print("experience: {} transitions loaded from {}".format(len(memory), args.load_exp))
 
     # -- load existing model --
     if args.load_agent:
         agent.load_model(args.env_name, args.batch_size, args.num_episodes, '.pth')
         print("agent: naf_{}_{}_{}_{}, is loaded".format(args.env_name, args.batch_size, args.num_episodes, '.pth'))
 
-    # -- load experience buffer --
-    if args.load_exp:
-        with open('/home/quantao/Workspaces/catkin_ws/src/panda_demos/naf_env/src/exp_replay.pk1', 'rb') as input:
-            memory.memory = pickle.load(input)
-            memory.position = len(memory)
+    t_start = time.time()
+
+    if args.async_actors:
+        from async_train import train_async
+        rewards = train_async(args, agent, memory, writer, env_fns)
+    else:
+        env = make_env()
+        env.seed(args.seed)
+        checkpointer = None
+        if args.checkpoint_every or args.resume:
+            checkpointer = checkpoint.Checkpointer(args.checkpoint_dir, args.keep_checkpoints)
+        resume = None
+        if args.resume:
+            path = checkpointer.latest() if args.resume == 'latest' else args.resume
+            if path is None:
+                raise IOError('no checkpoint to resume from in {}'.format(args.checkpoint_dir))
+            resume = checkpoint.Checkpointer.load(path)
+        rewards = train(args, agent, memory, writer, env, checkpointer if args.checkpoint_every else None, resume)
+        if checkpointer is not None:
+            checkpointer.wait()
+        env.close()
+
+    #-- saves model --
+    if args.save_agent:
+        agent.save_model(args.env_name, args.batch_size, args.num_episodes, '.pth')
+    memory.flush()
+    writer.close()
+
+    print('Training ended after {} minutes'.format((time.time() - t_start)/60))
+    print('Time per episode: {} s'.format((time.time() - t_start) / len(rewards)))
+    print('Mean reward: {}'.format(np.mean(rewards)))
+    print('Max reward: {}'.format(np.max(rewards)))
+    print('Min reward: {}'.format(np.min(rewards)))
+    if args.results:
+        import json
+        with open(args.results, 'w') as f:
+            json.dump({'mean_reward': float(np.mean(rewards)), 'max_reward': float(np.max(rewards)),
+                       'min_reward': float(np.min(rewards)), 'final_reward': float(np.mean(rewards[-10:])),
+                       'minutes': (time.time() - t_start) / 60}, f, indent=2)
+
+
+def run_eval(args, env_cls, make_env):
+    """Loads a saved model and runs greedy episodes, without logging or replay memory"""
+    t_start = time.perf_counter()
+    agent = NAF(args.gamma, args.tau, args.hidden_size,
+                env_cls.observation_space.shape[0], env_cls.action_space)
+    agent.load_model(args.env_name, args.batch_size, args.num_episodes, '.pth', model_path=args.model_path)
+    policy = InferencePolicy(agent.model)
+    print('startup: model loaded in {:.2f} s'.format(time.perf_counter() - t_start))
+
+    env = make_env()
+    env.seed(args.seed)
+    rewards = []
+    for i_episode in range(args.eval_episodes):
+        rewards.append(evaluate(args, policy, env))
+        if i_episode == 0:
+            print('startup: first reset took {:.2f} s, first action {:.2f} s after start'.format(
+                env.reset_latency, time.perf_counter() - IMPORT_START))
+        print("Eval Episode: {}, reward: {}".format(i_episode, rewards[-1]))
+    env.close()
+    print('Mean reward: {}'.format(np.mean(rewards)))
+    return rewards
+
+
+def evaluate(args, policy, env):
+    """Runs one greedy episode in every env of `env`, returns the mean episode reward"""
+    state = torch.Tensor(env.reset())
+    active = np.ones(env.num_envs, dtype=bool)
+    episode_rewards = np.zeros(env.num_envs)
+    greedy_numsteps = 0
+    while True:
+        action = policy.select_action(state)
+
+        next_state, reward, done, info = env.step(action, active)
+        episode_rewards += reward
+        greedy_numsteps += 1
+
+        state = torch.Tensor(next_state)
+        active &= ~done
+
+        if not active.any() or greedy_numsteps % args.num_steps == 0:
+            break
+    return episode_rewards.mean()
+
+
+def train(args, agent, memory, writer, env, checkpointer=None, resume=None):
+    """Alternates collecting an episode in every env of `env` with a block of updates.
+
+    With a `checkpointer` the whole training state is saved every
+    `args.checkpoint_every` episodes; `resume` is such a state to continue from.
+    """
+    ounoise = OUNoise(env.action_space.shape[0], num_envs=env.num_envs) if args.ou_noise else None
+    # acting uses a frozen snapshot of the policy, refreshed after every training block
+    policy = InferencePolicy(agent.model)
+    value_losses = ScalarWindow(writer, 'loss/value', args.log_every)
+    if args.hindsight:
+        from hindsight import HindsightRelabeler
+        hindsight = HindsightRelabeler(memory.capacity, ratio=args.hindsight_ratio)
+    else:
+        hindsight = None
+    if args.plot_every:
+        from visualize import PathPlotter
+        plotter = PathPlotter(args.plot_dir)
+    else:
+        plotter = None
 
     rewards = []
     total_numsteps = 0
     updates = 0
+    start_episode = 0
+
+    def training_state(i_episode):
+        return {'episode': i_episode, 'total_numsteps': total_numsteps, 'updates': updates,
+                'rewards': list(rewards), 'agent': agent.state_dict(), 'memory': memory.state_dict(),
+                'ounoise': ounoise.state_dict() if ounoise is not None else None,
+                'hindsight': hindsight.state_dict() if hindsight is not None else None,
+                'env': env.state_dict() if hasattr(env, 'state_dict') else None,
+                'rng': checkpoint.rng_state()}
+
+    if resume is not None:
+        agent.load_state_dict(resume['agent'])
+        memory.load_state_dict(resume['memory'])
+        if ounoise is not None:
+            ounoise.load_state_dict(resume['ounoise'])
+        if hindsight is not None:
+            hindsight.load_state_dict(resume['hindsight'])
+        if resume['env'] is not None:
+            env.load_state_dict(resume['env'])
+        checkpoint.set_rng_state(resume['rng'])
+        policy.refresh(agent.model)
+        total_numsteps, updates, rewards = resume['total_numsteps'], resume['updates'], resume['rewards']
+        start_episode = resume['episode'] + 1
+        print("Resuming after episode {}, total numsteps: {}".format(resume['episode'], total_numsteps))
     
     #env.init_ros()
     #env.reset()
 
-    t_start = time.time()
-
-    for i_episode in range(args.num_episodes+1):
+    for i_episode in range(start_episode, args.num_episodes+1):
         # -- reset environment for every episode --
         #state = env.reset()
-        state = torch.Tensor([env.reset()])
+        with instrumentation.span('train/reset'):
+            state = torch.Tensor(env.reset())
+        writer.add_scalar('perf/reset_latency', env.reset_latency, i_episode)
 
         # -- initialize noise (random process N) --
         if args.ou_noise:
@@ -108,26 +390,40 @@ def main():
                 0, args.exploration_end - i_episode / args.exploration_end + args.final_noise_scale)
             ounoise.reset()
 
-        episode_reward = 0
+        # -- every env runs one episode, finished envs are masked out --
+        active = np.ones(env.num_envs, dtype=bool)
+        episode_rewards = np.zeros(env.num_envs)
+        episode_numsteps = 0
+        plot = plotter is not None and i_episode % args.plot_every == 0
+        path_states, path_actions = [], []
         while True:
             # -- action selection, observation and store transition --
-            action = agent.select_action(state, ounoise) if args.train_model else agent.select_action(state)
+            with instrumentation.span('train/select_action'):
+                action = policy.select_action(state, ounoise) if args.train_model else policy.select_action(state)
             
-            next_state, reward, done, info = env.step(action)
+            if plot and active[0]:
+                path_states.append(state[0].numpy())
+                path_actions.append(action[0].numpy())
+            with instrumentation.span('train/env_step'):
+                next_state, reward, done, info = env.step(action, active)
 
             #env.render()
-            total_numsteps += 1
-            episode_reward += reward
-
-            action = torch.Tensor(action)
-            mask = torch.Tensor([not done])
-            reward = torch.Tensor([reward])
-            next_state = torch.Tensor([next_state])
-
-            #print('reward:', reward)
-            memory.push(state, action, mask, next_state, reward)
+            instrumentation.count('env/steps', int(active.sum()))
+            total_numsteps += int(active.sum())
+            episode_numsteps += 1
+            episode_rewards += reward
+
+            next_state = torch.Tensor(next_state)
+            idx = torch.from_numpy(np.flatnonzero(active))
+            with instrumentation.span('train/store'):
+                rows = memory.extend(state[idx], action[idx], torch.Tensor(~done)[idx], next_state[idx],
+                                     torch.Tensor(reward)[idx])
+                if hindsight is not None:
+                    goal = env.goal[active]
+                    hindsight.extend(rows, np.flatnonzero(active), goal, goal - next_state[idx].numpy())
 
             state = next_state
+            active &= ~done
 
             #else:
             #    time.sleep(0.005)
@@ -136,69 +432,75 @@ def main():
             #time.sleep(0.005)
             #env.rate.sleep()
 
-            if done or total_numsteps % args.num_steps == 0:
+            if not active.any() or episode_numsteps % args.num_steps == 0:
                 break
+        episode_reward = episode_rewards.mean()
+        if hindsight is not None:
+            hindsight.end_episodes()
 
         if len(memory) >= args.batch_size and args.train_model:
             env.reset()
             print("Training model")
 
-            for _ in range(args.updates_per_step*args.num_steps):
-                transitions = memory.sample(args.batch_size)
-                batch = Transition(*zip(*transitions))
-                value_loss, policy_loss = agent.update_parameters(batch)
-
-                writer.add_scalar('loss/value', value_loss, updates)
-                writer.add_scalar('loss/policy', policy_loss, updates)
-
-                updates += 1
+            beta = args.beta + (1.0 - args.beta) * min(1.0, i_episode / float(args.num_episodes))
+            with instrumentation.span('train/update_block'):
+                # the updates run in chunks of fused_updates steps, each on batches sampled up front
+                remaining = args.updates_per_step*args.num_steps
+                while remaining > 0:
+                    k = min(args.fused_updates, remaining)
+                    if args.prioritized:
+                        batches, weights, indices = memory.sample_batches(k, args.batch_size, beta)
+                        if hindsight is not None:
+                            batches = hindsight.relabel(batches, indices)
+                        value_loss, td_errors = agent.update_many(batches, weights)
+                        memory.update_priorities(indices, td_errors.numpy())
+                    elif hindsight is not None:
+                        indices = memory.sample_indices(k * args.batch_size).view(k, args.batch_size)
+                        batches = hindsight.relabel(memory.gather(indices), indices)
+                        value_loss, _ = agent.update_many(batches)
+                    else:
+                        batches = memory.sample_batches(k, args.batch_size)
+                        value_loss, _ = agent.update_many(batches)
+
+                    updates += k
+                    remaining -= k
+                    value_losses.extend(value_loss, updates - 1)
+                    instrumentation.count('naf/updates', k)
+            policy.refresh(agent.model)
+            if args.export_policy is not None:
+                policy.export(args.export_policy)
+            value_losses.flush(updates)
+        if plot:
+            with instrumentation.span('train/plot'):
+                plotter.submit(agent.model, np.array(path_states), np.array(path_actions), i_episode)
         writer.add_scalar('reward/train', episode_reward, i_episode)
         print("Train Episode: {}, total numsteps: {}, reward: {}".format(i_episode, total_numsteps,
                                                                                        episode_reward))
 
         rewards.append(episode_reward)
+        memory.flush()
     
-    
-        greedy_numsteps = 0
         if i_episode % 10 == 0:
-            #state = env.reset()
-            state = torch.Tensor([env.reset()])
-
-            episode_reward = 0
-            while True:
-                action = agent.select_action(state)
-        
-                next_state, reward, done, info = env.step(action)
-                episode_reward += reward
-                greedy_numsteps += 1
-                        
-                #state = next_state
-                state = torch.Tensor([next_state])
-
-                #env.render()
-                #time.sleep(0.01)
-                #   env.rate.sleep()
-
-                if done or greedy_numsteps % args.num_steps == 0:
-                    break
+            with instrumentation.span('train/eval'):
+                episode_reward = evaluate(args, policy, env)
                 
             writer.add_scalar('reward/test', episode_reward, i_episode)
         
             rewards.append(episode_reward)
             print("Episode: {}, total numsteps: {}, reward: {}, average reward: {}".format(i_episode, total_numsteps, rewards[-1], np.mean(rewards[-10:])))
-            
 
-    #-- saves model --
-    if args.save_agent:
-        agent.save_model(args.env_name, args.batch_size, args.num_episodes, '.pth')
-        with open('exp_replay.pk1', 'wb') as output:
-            pickle.dump(memory.memory, output, pickle.HIGHEST_PROTOCOL)
+        instrumentation.write_episode(writer, i_episode)
+        if instrumentation.enabled() and i_episode % args.timing_every == 0:
+            print(instrumentation.report())
 
-    print('Training ended after {} minutes'.format((time.time() - t_start)/60))
-    print('Time per episode: {} s'.format((time.time() - t_start) / args.num_episodes))
-    print('Mean reward: {}'.format(np.mean(rewards)))
-    print('Max reward: {}'.format(np.max(rewards)))
-    print('Min reward: {}'.format(np.min(rewards)))
+        # -- snapshot everything, written to disk in the background --
+        if checkpointer is not None and (i_episode % args.checkpoint_every == 0 or i_episode == args.num_episodes):
+            checkpointer.save(training_state(i_episode), i_episode)
+            
+    if plotter is not None:
+        plotter.close()
+
+    return rewards
     
 
 if __name__ == '__main__':
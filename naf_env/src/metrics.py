@@ -0,0 +1,81 @@
+import queue
+import threading
+import torch
+
+
+class MetricsWriter(object):
+    """SummaryWriter owned by a background thread.
+
+    `add_scalar` only puts the call on a queue and returns; the thread does
+    all the event file I/O, so the training loop never waits on it. When the
+    queue is full new scalars are dropped and counted in `dropped` rather
+    than blocking the caller. `close` writes out what is queued.
+    """
+
+    def __init__(self, log_dir='runs/', max_queue=100000):
+        from tensorboardX import SummaryWriter
+        self.writer = SummaryWriter(log_dir)
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.writer.add_scalar(*item)
+
+    def add_scalar(self, tag, value, step):
+        try:
+            self.queue.put_nowait((tag, float(value), step))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+
+
+class ScalarWindow(object):
+    """Collects one scalar per update as tensors and logs mean/min/max every `every` updates.
+
+    Values are copied into a preallocated tensor without reading them back,
+    so only the reduction at the end of every window syncs with the device.
+    """
+
+    def __init__(self, writer, tag, every=100):
+        self.writer = writer
+        self.tag = tag
+        self.buffer = torch.zeros(every)
+        self.count = 0
+
+    def add(self, value, step):
+        self.buffer[self.count] = value
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush(step)
+
+    def extend(self, values, step):
+        """Adds a tensor of consecutive values, the last one at `step`"""
+        first = step - len(values) + 1
+        start = 0
+        while start < len(values):
+            n = min(len(values) - start, len(self.buffer) - self.count)
+            self.buffer[self.count:self.count + n] = values[start:start + n]
+            self.count += n
+            start += n
+            if self.count == len(self.buffer):
+                self.flush(first + start - 1)
+
+    def flush(self, step):
+        if self.count == 0:
+            return
+        window = self.buffer[:self.count]
+        mean, low, high = torch.stack([window.mean(), window.min(), window.max()]).tolist()
+        self.writer.add_scalar(self.tag, mean, step)
+        self.writer.add_scalar(self.tag + '_min', low, step)
+        self.writer.add_scalar(self.tag + '_max', high, step)
+        self.count = 0
@@ -1,27 +1,28 @@
+import copy
 import os
 import sys
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.optim import Adam
-from torch.autograd import Variable
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import matplotlib.cm as cmx
+
+import instrumentation
 
 #@profile
 def MSELoss(input, target):
-    return torch.sum((input - target)**2) / input.data.nelement()
+    return F.mse_loss(input, target)
 
 #@profile
+@torch.no_grad()
 def soft_update(target, source, tau):
-    for target_param, param in zip(target.parameters(), source.parameters()):
-        target_param.data.copy_(target_param.data * (1.0 - tau) + param.data * tau)
+    # target += tau * (source - target), one fused in-place multi-tensor op
+    torch._foreach_lerp_(list(target.parameters()), list(source.parameters()), tau)
 
 #@profile
+@torch.no_grad()
 def hard_update(target, source):
-    for target_param, param in zip(target.parameters(), source.parameters()):
-        target_param.data.copy_(param.data)
+    torch._foreach_copy_(list(target.parameters()), list(source.parameters()))
 
 # -- Network --
 class Policy(nn.Module):
@@ -57,9 +58,13 @@ class Policy(nn.Module):
         self.L.weight.data.mul_(0.1)
         self.L.bias.data.mul_(0.1)
 
-        self.tril_mask = Variable(torch.tril(torch.ones(
-            num_outputs, num_outputs), diagonal=-1).unsqueeze(0))
-        self.diag_mask = Variable(torch.diag(torch.diag(torch.ones(num_outputs, num_outputs))).unsqueeze(0))
+        # nonzero entries of the lower-triangular factor L, row-major; the L head
+        # keeps its full num_outputs**2 outputs so saved models still load
+        rows, cols = torch.tril_indices(num_outputs, num_outputs)
+        self.register_buffer('tril_rows', rows, persistent=False)
+        self.register_buffer('tril_cols', cols, persistent=False)
+        self.register_buffer('tril_flat', rows * num_outputs + cols, persistent=False)
+        self.register_buffer('tril_diag', rows == cols, persistent=False)
 
     #@profile
     def forward(self, inputs):
@@ -73,16 +78,14 @@ class Policy(nn.Module):
 
         Q = None
         if u is not None:
-            num_outputs = mu.size(1)
-            L = self.L(x).view(-1, num_outputs, num_outputs)
-            L = L * \
-                self.tril_mask.expand_as(
-                    L) + torch.exp(L) * self.diag_mask.expand_as(L)
-            P = torch.bmm(L, L.transpose(2, 1))
+            # A = -0.5 (u-mu)^T L L^T (u-mu) = -0.5 ||L^T (u-mu)||^2, evaluated
+            # from the lower-triangular entries of L only (diagonal kept positive)
+            L = F.linear(x, self.L.weight[self.tril_flat], self.L.bias[self.tril_flat])
+            L = torch.where(self.tril_diag, L.exp(), L)
 
-            u_mu = (u - mu).unsqueeze(2)
-            A = -0.5 * \
-                torch.bmm(torch.bmm(u_mu.transpose(2, 1), P), u_mu)[:, :, 0]
+            u_mu = u - mu
+            LT_u_mu = torch.zeros_like(u_mu).index_add(1, self.tril_cols, L * u_mu[:, self.tril_rows])
+            A = -0.5 * (LT_u_mu ** 2).sum(1, keepdim=True)
 
             Q = A + V
 
@@ -91,23 +94,58 @@ class Policy(nn.Module):
 
 class NAF:
 
-    def __init__(self, gamma, tau, hidden_size, num_inputs, action_space):
+    def __init__(self, gamma, tau, hidden_size, num_inputs, action_space, compile_model=False,
+                 target_update_every=1):
         self.action_space = action_space
         self.num_inputs = num_inputs
 
         self.model = Policy(hidden_size, num_inputs, action_space)
         self.target_model = Policy(hidden_size, num_inputs, action_space)
-        self.optimizer = Adam(self.model.parameters(), lr=1e-3)
+        if compile_model:
+            # compile the forward in place so state_dict keys stay unchanged
+            self.model.forward = torch.compile(self.model.forward)
+            self.target_model.forward = torch.compile(self.target_model.forward)
+        self._optimizer = None
 
         self.gamma = gamma
         self.tau = tau
+        # updating every k steps with 1-(1-tau)^k decays the target like k updates with tau
+        self.target_update_every = target_update_every
+        self.target_tau = 1.0 - (1.0 - tau) ** target_update_every
+        self.updates = 0
 
         hard_update(self.target_model, self.model)
 
+    @property
+    def optimizer(self):
+        # created on the first update, building Adam imports torch._dynamo which takes seconds.
+        # The fused kernel updates all parameters at once, torch before 2.4 only has it on CUDA
+        if self._optimizer is None:
+            try:
+                self._optimizer = Adam(self.model.parameters(), lr=1e-3, fused=True)
+            except RuntimeError:
+                self._optimizer = Adam(self.model.parameters(), lr=1e-3, foreach=True)
+        return self._optimizer
+
+    def state_dict(self):
+        """Copies of everything update_parameters changes, safe to serialize while training goes on"""
+        return {'model': {k: v.clone() for k, v in self.model.state_dict().items()},
+                'target_model': {k: v.clone() for k, v in self.target_model.state_dict().items()},
+                'optimizer': None if self._optimizer is None else copy.deepcopy(self._optimizer.state_dict()),
+                'updates': self.updates}
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model'])
+        self.target_model.load_state_dict(state['target_model'])
+        if state['optimizer'] is not None:
+            self.optimizer.load_state_dict(state['optimizer'])
+        self.updates = state['updates']
+
     #@profile
+    @instrumentation.timed('naf/select_action')
     def select_action(self, state, action_noise=None):
         self.model.eval()
-        mu, _, _ = self.model((Variable(state), None))
+        mu, _, _ = self.model((state, None))
         self.model.train()
         mu = mu.data
         if action_noise is not None:
@@ -115,15 +153,48 @@ class NAF:
         return mu.clamp(-1, 1)
 
     #@profile
-    def update_parameters(self, batch):
+    @instrumentation.timed('naf/update_parameters')
+    def update_parameters(self, batch, weights=None):
+        """One gradient step on a sampled batch.
+
+        `weights` are optional per-sample importance-sampling weights from
+        prioritized replay. Returns value loss, policy loss and the per-sample
+        TD errors used to refresh replay priorities.
+        """
+
+        loss, td_errors = self._loss(batch.state, batch.action, batch.reward, batch.mask, batch.next_state,
+                                     weights)
+        self._step(loss, list(self.model.parameters()))
 
-        state_batch = Variable(torch.cat(batch.state))
-        action_batch = Variable(torch.cat(batch.action))
-        reward_batch = Variable(torch.cat(batch.reward))
-        mask_batch = Variable(torch.cat(batch.mask))
-        next_state_batch = Variable(torch.cat(batch.next_state))
+        # the loss stays a tensor, reading it back every update would sync with the device
+        return loss.detach(), 0, td_errors.detach().squeeze(1)
 
-        _, _, next_state_values = self.target_model((next_state_batch, None))
+    #@profile
+    @instrumentation.timed('naf/update_many')
+    def update_many(self, batches, weights=None):
+        """K gradient steps in one call, on batches stacked as (K, B, ...).
+
+        Takes what ReplayMemory.sample_batches returns, with (K, B) `weights`
+        for prioritized replay, and runs the same steps as K calls to
+        update_parameters without their per call overhead. Returns the K
+        value losses and the (K, B) TD errors, as tensors.
+        """
+        num_updates = batches.state.shape[0]
+        parameters = list(self.model.parameters())
+        losses = torch.empty(num_updates)
+        td_errors = torch.empty(batches.reward.shape)
+        for k in range(num_updates):
+            loss, td = self._loss(batches.state[k], batches.action[k], batches.reward[k], batches.mask[k],
+                                  batches.next_state[k], None if weights is None else weights[k])
+            self._step(loss, parameters)
+            losses[k] = loss.detach()
+            td_errors[k] = td.detach().squeeze(1)
+        return losses, td_errors
+
+    def _loss(self, state_batch, action_batch, reward_batch, mask_batch, next_state_batch, weights):
+        # the target only provides values, no graph is needed through it
+        with torch.no_grad():
+            _, _, next_state_values = self.target_model((next_state_batch, None))
 
         reward_batch = reward_batch.unsqueeze(1)
         mask_batch = mask_batch.unsqueeze(1)
@@ -132,16 +203,22 @@ class NAF:
 
         _, state_action_values, _ = self.model((state_batch, action_batch))
 
-        loss = MSELoss(state_action_values, expected_state_action_values)
+        td_errors = expected_state_action_values - state_action_values
+        if weights is None:
+            loss = MSELoss(state_action_values, expected_state_action_values)
+        else:
+            loss = torch.mean(weights.unsqueeze(1) * td_errors ** 2)
+        return loss, td_errors
 
+    def _step(self, loss, parameters):
         self.optimizer.zero_grad()
         loss.backward()
-        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1)
+        torch.nn.utils.clip_grad_norm_(parameters, 1, foreach=True)
         self.optimizer.step()
 
-        soft_update(self.target_model, self.model, self.tau)
-
-        return loss.item(), 0
+        self.updates += 1
+        if self.updates % self.target_update_every == 0:
+            soft_update(self.target_model, self.model, self.target_tau)
 
     def save_model(self, env_name, batch_size, episode, suffix="", model_path=None):
         if not os.path.exists('models/'):
@@ -159,24 +236,12 @@ class NAF:
         self.model.load_state_dict(torch.load(model_path))
 
     def plot_path(self, state, action, ep):
-        self.model.eval()
-        _, Q, _ = self.model((Variable(torch.cat(state)), Variable(torch.cat(action))))
-        self.model.train()
-        sx, sy = torch.cat(state).numpy().T
-        ax, ay = torch.cat(action).numpy().T
-
-        qCat = []
-        for j in range(len(Q.data.numpy())):
-            qCat.append(Q.data.numpy()[j][0])
-
-        cmap = plt.cm.viridis
-        cNorm = colors.Normalize(vmin=np.min(qCat), vmax=np.max(qCat))
-        scalarMap = cmx.ScalarMappable(norm=cNorm, cmap=cmap)
-        plt.scatter(sx, sy)
-        for i in range(len(sx)):
-            colorVal = scalarMap.to_rgba(qCat[i])
-            plt.arrow(sx[i], sy[i], ax[i]/150, ay[i]/150, fc=colorVal, ec=colorVal, head_width=0.004, head_length=0.008)
-
-        figname= 'path_{}_{}'.format(ep, '.png')
-        plt.savefig(figname)
-        plt.close()
+        """Writes the path of an episode over the V/mu field of the model, see visualize.py.
+
+        Renders in this process; visualize.PathPlotter does the same in a
+        worker process.
+        """
+        # matplotlib is slow to import and only needed here
+        import visualize
+        values = visualize.evaluate_path(self.model, torch.cat(state), torch.cat(action))
+        visualize.render(values, 'path_{}_{}'.format(ep, '.png'))
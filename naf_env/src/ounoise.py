@@ -1,21 +1,35 @@
 import numpy as np
 
 class OUNoise:
+    """Ornstein-Uhlenbeck process. With `num_envs` it keeps one independent
+    process per environment and `noise()` returns an (num_envs, action_dim) array."""
 
-    def __init__(self, action_dimension, scale=0.1, mu=0, theta=0.15, sigma=0.2):
+    def __init__(self, action_dimension, scale=0.1, mu=0, theta=0.15, sigma=0.2, num_envs=None):
         self.action_dimension = action_dimension
+        self.num_envs = num_envs
+        self.shape = (action_dimension,) if num_envs is None else (num_envs, action_dimension)
         self.scale = scale
         self.mu = mu
         self.theta = theta
         self.sigma = sigma
-        self.state = np.ones(self.action_dimension) * self.mu
+        self.state = np.ones(self.shape) * self.mu
         self.reset()
 
-    def reset(self):
-        self.state = np.ones(self.action_dimension) * self.mu
+    def reset(self, indices=None):
+        if indices is None:
+            self.state = np.ones(self.shape) * self.mu
+        else:
+            self.state[indices] = self.mu
+
+    def state_dict(self):
+        return {'state': self.state.copy(), 'scale': self.scale}
+
+    def load_state_dict(self, state):
+        self.state = state['state'].copy()
+        self.scale = state['scale']
 
     def noise(self):
         x = self.state
-        dx = self.theta * (self.mu - x) + self.sigma * np.random.randn(len(x))
+        dx = self.theta * (self.mu - x) + self.sigma * np.random.randn(*self.shape)
         self.state = x + dx
-        return self.state * self.scale
\ No newline at end of file
+        return self.state * self.scale
@@ -0,0 +1,194 @@
+import time
+import numpy as np
+from gym import spaces
+
+# same home posture, goal and cage as ManipulateEnv.set_primitives/set_tasks
+HOME_POSE = [0.1, -0.3, 0.0]
+GOAL = [-0.2, -0.5]
+CAGE = 0.8
+
+
+def shaped_reward(observations):
+    """ManipulateEnv.calc_shaped_reward for a batch of goal deltas (N, 2)"""
+    dist = np.sqrt((observations ** 2).sum(axis=1))
+    dones = dist < 0.02
+    rewards = np.where(dones, 500.0, -10 * dist)
+    return rewards, dones
+
+
+def _pinv(A, damping):
+    #damped least squares pseudo-inverse of a batch of (m, n) matrices
+    AAt = A @ A.transpose(0, 2, 1)
+    AAt += damping * np.eye(A.shape[1])
+    return np.linalg.solve(AAt, A).transpose(0, 2, 1)
+
+
+class PlanarArmVecEnv(object):
+    """Headless kinematic surrogate of the three joint planar arm of ManipulateEnv.
+
+    Simulates `num_envs` arms at once with the same task hierarchy the
+    environment uploads to HiQP, resolved at the acceleration level every
+    `control_dt`:
+
+    0. ee_cage_*: the end effector stays inside the four planes at +-0.8,
+       inequalities with TDynPD(1.0, 2.0) dynamics
+    1. ee_rl: e is the end effector position (TDefRL2DSpace with the x and
+       y normals), driven by TDynAsyncPolicy, e_ddot* = 100 a - 10 e_dot
+    2. full_pose: TDynPD(0.5, 1.5) towards HOME_POSE
+
+    Levels are solved with damped pseudo-inverses in the null space of the
+    ones above; cage rows violated by the unconstrained solution are added
+    as equalities and the hierarchy is solved once more, a single active-set
+    pass in place of HiQP's QP cascade. The link lengths and base position
+    are a guess, the robot description is not part of this repository.
+
+    Follows the VecEnv interface: `reset` returns (N, 2) goal deltas and
+    `step(actions, active)` returns (observations, rewards, dones, infos)
+    with the rewards of ManipulateEnv.calc_shaped_reward.
+    """
+    action_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
+    observation_space = spaces.Box(low=np.array([-10, -10]), high=np.array([10, 10]), dtype=np.float32)
+
+    def __init__(self, num_envs=1, link_lengths=(0.35, 0.3, 0.2), base=(-0.3, 0.0), step_dt=0.1, control_dt=0.01,
+                 damping=10.0, cage_gains=(1.0, 2.0), posture_gains=(0.5, 1.5), home_noise=0.0,
+                 max_joint_acceleration=100.0):
+        self.num_envs = num_envs
+        self.link_lengths = np.asarray(link_lengths, dtype=np.float64)
+        self.base = np.asarray(base, dtype=np.float64)
+        self.substeps = max(1, int(round(step_dt / control_dt)))
+        self.control_dt = control_dt
+        self.damping = damping
+        self.cage_gains = cage_gains
+        self.posture_gains = posture_gains
+        self.home_noise = home_noise #rad, uniform noise on the home pose at reset
+        self.max_joint_acceleration = max_joint_acceleration
+        self.goal = np.tile(np.asarray(GOAL, dtype=np.float64), (num_envs, 1))
+        self.rng = np.random.RandomState()
+        self.reset_latency = None
+
+        # cage rows as sign * (axis coordinate) >= -CAGE: right, left, front, back
+        self.cage_axes = np.array([0, 0, 1, 1])
+        self.cage_signs = np.array([-1.0, 1.0, -1.0, 1.0])
+
+        n = len(self.link_lengths)
+        self.q = np.zeros((num_envs, n))
+        self.dq = np.zeros((num_envs, n))
+        self.observations = np.zeros((num_envs, 2), dtype=np.float32)
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    def state_dict(self):
+        return {'rng': self.rng.get_state(), 'q': self.q.copy(), 'dq': self.dq.copy(),
+                'goal': self.goal.copy(), 'observations': self.observations.copy()}
+
+    def load_state_dict(self, state):
+        self.rng.set_state(state['rng'])
+        for name in ('q', 'dq', 'goal', 'observations'):
+            getattr(self, name)[:] = state[name]
+
+    def kinematics(self, q, dq):
+        """End effector position, Jacobian and J_dot*dq for joint states (N, n)"""
+        phi = np.cumsum(q, axis=1)
+        omega = np.cumsum(dq, axis=1)
+        cos = self.link_lengths * np.cos(phi)
+        sin = self.link_lengths * np.sin(phi)
+        position = self.base + np.stack([cos.sum(axis=1), sin.sum(axis=1)], axis=1)
+        # joint j moves every link from j on
+        J = np.stack([-np.cumsum(sin[:, ::-1], axis=1)[:, ::-1],
+                      np.cumsum(cos[:, ::-1], axis=1)[:, ::-1]], axis=1)
+        omega2 = omega ** 2
+        dJdq = -np.stack([(cos * omega2).sum(axis=1), (sin * omega2).sum(axis=1)], axis=1)
+        return position, J, dJdq
+
+    def _accelerations(self, actions):
+        N, n = self.q.shape
+        eye = np.eye(n)
+        position, J, dJdq = self.kinematics(self.q, self.dq)
+        velocity = np.einsum('bij,bj->bi', J, self.dq)
+
+        # level 0: cage
+        kp, kd = self.cage_gains
+        sign = self.cage_signs
+        e_cage = sign * position[:, self.cage_axes] + CAGE
+        de_cage = sign * velocity[:, self.cage_axes]
+        A_cage = sign[None, :, None] * J[:, self.cage_axes]
+        b_cage = -kp * e_cage - kd * de_cage - sign * dJdq[:, self.cage_axes]
+        # level 1: ee_rl
+        b_rl = 100 * actions - self.damping * velocity - dJdq
+        # level 2: full_pose
+        kp, kd = self.posture_gains
+        b_pose = -kp * (self.q - HOME_POSE) - kd * self.dq
+
+        def solve(active):
+            A = A_cage * active[:, :, None]
+            pinv = _pinv(A, 1e-8)
+            ddq = np.einsum('bij,bj->bi', pinv, b_cage * active)
+            N0 = eye - pinv @ A
+            JN = J @ N0
+            pinv = _pinv(JN, 1e-6)
+            ddq = ddq + np.einsum('bij,bj->bi', pinv, b_rl - np.einsum('bij,bj->bi', J, ddq))
+            N1 = N0 - pinv @ JN
+            return ddq + np.einsum('bij,bj->bi', N1, b_pose - ddq)
+
+        ddq = solve(np.zeros((N, len(sign))))
+        violated = np.einsum('bij,bj->bi', A_cage, ddq) < b_cage
+        if violated.any():
+            ddq = solve(violated.astype(np.float64))
+        return np.clip(ddq, -self.max_joint_acceleration, self.max_joint_acceleration)
+
+    def _observe(self):
+        position, _, _ = self.kinematics(self.q, self.dq)
+        self.end_effector = position
+        return self.goal - position
+
+    def reset(self):
+        """Puts every arm at rest in the home pose, returns (N, 2) observations"""
+        t_start = time.time()
+        self.q[:] = HOME_POSE
+        if self.home_noise:
+            self.q += self.rng.uniform(-self.home_noise, self.home_noise, self.q.shape)
+        self.dq[:] = 0
+        self.observations[:] = self._observe()
+        self.reset_latency = time.time() - t_start
+        return self.observations.copy()
+
+    def step(self, actions, active=None):
+        """Steps the arms flagged in `active` (default all) for one env step.
+
+        Inactive arms are left untouched and report their last observation,
+        zero reward and done=True, like VecEnv.
+        """
+        actions = np.asarray(actions, dtype=np.float64).reshape(self.num_envs, -1)
+        moving = np.ones(self.num_envs, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        q, dq = self.q.copy(), self.dq.copy()
+        for _ in range(self.substeps):
+            ddq = self._accelerations(actions)
+            self.dq += ddq * self.control_dt
+            self.q += self.dq * self.control_dt
+        self.q[~moving] = q[~moving]
+        self.dq[~moving] = dq[~moving]
+
+        observations = self._observe()
+        rewards, dones = shaped_reward(observations)
+        self.observations[moving] = observations[moving]
+        rewards[~moving] = 0
+        dones[~moving] = True
+        return self.observations.copy(), rewards.astype(np.float32), dones, [None] * self.num_envs
+
+    def close(self):
+        pass
+
+
+class PlanarArmEnv(PlanarArmVecEnv):
+    """A single surrogate arm with the ManipulateEnv interface"""
+
+    def __init__(self, **kwargs):
+        super(PlanarArmEnv, self).__init__(num_envs=1, **kwargs)
+
+    def reset(self):
+        return super(PlanarArmEnv, self).reset()[0]
+
+    def step(self, action):
+        observations, rewards, dones, _ = super(PlanarArmEnv, self).step(action)
+        return observations[0], float(rewards[0]), bool(dones[0]), False
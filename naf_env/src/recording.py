@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+from state_channel import FIELDS, field_shape
+
+# A trace is a directory with a JSON header and one append-only raw
+# little-endian file per column, grouped by stream:
+#
+#   states/   time, seq, stamp, action_seq, n_joints, n_upper, n_lower, one
+#             row per StateMsg, and per StateMsg array field the values of
+#             all rows concatenated (row i holds field_shape(dims of i) values)
+#   actions/  time, seq, e_ddot_star, one row per DesiredErrorDynamicsMsg
+#   steps/    time, ros_time, kind (0 reset, 1 step), states, actions: one
+#             row each time reset or step returned, with the number of
+#             states received and actions sent up to then
+#
+# `time` is the local wall clock, `stamp` and `ros_time` the ROS clock.
+# Rows are only appended, a crash loses at most the unflushed tail and the
+# reader drops a partially written last row.
+HEADER = 'header.json'
+VERSION = 1
+RESET, STEP = 0, 1
+
+STATE_COLUMNS = (('time', '<f8'), ('seq', '<u4'), ('stamp', '<f8'), ('action_seq', '<u4'),
+                 ('n_joints', '<u4'), ('n_upper', '<u4'), ('n_lower', '<u4'))
+ACTION_COLUMNS = (('time', '<f8'), ('seq', '<u4'), ('e_ddot_star', '<f8'))
+STEP_COLUMNS = (('time', '<f8'), ('ros_time', '<f8'), ('kind', 'u1'), ('states', '<u8'), ('actions', '<u8'))
+# StateMsg names of the state columns that are called differently
+MSG_NAMES = {'n_upper': 'n_constraints_upper', 'n_lower': 'n_constraints_lower'}
+
+
+class TraceWriter(object):
+    """Appends the state and action streams of one ManipulateEnv to a trace.
+
+    Called from the ROS callback thread and the env's thread alike, every
+    append takes a lock. Data reaches the files when `flush` or `close` is
+    called, which the env does at every reset.
+    """
+
+    def __init__(self, directory, goal, action_dim=2):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for stream in ('states', 'actions', 'steps'):
+            if not os.path.exists(os.path.join(directory, stream)):
+                os.makedirs(os.path.join(directory, stream))
+        self.directory = directory
+        self.action_dim = action_dim
+        header_path = os.path.join(directory, HEADER)
+        if not os.path.exists(header_path):
+            with open(header_path, 'w') as f:
+                json.dump({'version': VERSION, 'goal': list(goal), 'action_dim': action_dim,
+                           'created': time.time()}, f)
+        self.files = {}
+        for stream, columns in (('states', STATE_COLUMNS), ('actions', ACTION_COLUMNS), ('steps', STEP_COLUMNS)):
+            for name, _ in columns:
+                self.files[stream, name] = open(os.path.join(directory, stream, name + '.bin'), 'ab')
+        for name in FIELDS:
+            self.files['states', name] = open(os.path.join(directory, 'states', name + '.bin'), 'ab')
+        self.lock = threading.Lock()
+        self.num_states = self._count('states', STATE_COLUMNS)
+        self.num_actions = self._count('actions', ACTION_COLUMNS)
+
+    def _count(self, stream, columns):
+        name, dtype = columns[0]
+        return os.path.getsize(os.path.join(self.directory, stream, name + '.bin')) // np.dtype(dtype).itemsize
+
+    def _write(self, stream, columns, values):
+        for (name, dtype), value in zip(columns, values):
+            self.files[stream, name].write(np.asarray(value, dtype=dtype).tobytes())
+
+    def state(self, received, msg):
+        """Appends a StateMsg, or anything with its fields, received at wall time `received`"""
+        with self.lock:
+            self._write('states', STATE_COLUMNS, (received, msg.seq, msg.stamp, msg.action_seq, msg.n_joints,
+                                                  msg.n_constraints_upper, msg.n_constraints_lower))
+            for name in FIELDS:
+                self.files['states', name].write(np.asarray(getattr(msg, name), dtype='<f8').tobytes())
+            self.num_states += 1
+
+    def action(self, sent, seq, e_ddot_star):
+        with self.lock:
+            self._write('actions', ACTION_COLUMNS, (sent, seq, np.reshape(e_ddot_star, self.action_dim)))
+            self.num_actions += 1
+
+    def step(self, kind, returned, ros_time):
+        """Marks reset (RESET) or step (STEP) returning, after the states and actions so far"""
+        with self.lock:
+            self._write('steps', STEP_COLUMNS, (returned, ros_time, kind, self.num_states, self.num_actions))
+
+    def flush(self):
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+
+class Trace(object):
+    """Reads a trace written by TraceWriter.
+
+    Columns are loaded as NumPy arrays, `states[name]` etc. `state(i)`
+    returns the i-th state with the attributes of a StateMsg, `transitions`
+    the recorded env steps as arrays for a ReplayMemory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, HEADER)) as f:
+            self.header = json.load(f)
+        if self.header['version'] != VERSION:
+            raise ValueError('Unsupported trace version {} in {}'.format(self.header['version'], directory))
+        self.goal = np.asarray(self.header['goal'], dtype=np.float64)
+        action_dim = self.header['action_dim']
+
+        self.states = self._load('states', STATE_COLUMNS)
+        self.actions = self._load('actions', ACTION_COLUMNS, {'e_ddot_star': action_dim})
+        self.steps = self._load('steps', STEP_COLUMNS)
+
+        # offsets of every row into the concatenated field values
+        dims = (self.states['n_joints'], self.states['n_upper'], self.states['n_lower'])
+        num_states = len(self.states['time'])
+        self.offsets = {}
+        self.values = {}
+        for name in FIELDS:
+            sizes = np.ones(len(dims[0]), dtype=np.int64)
+            for dim in field_shape(name, *dims):
+                sizes *= dim
+            offsets = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+            values = np.fromfile(os.path.join(directory, 'states', name + '.bin'), dtype='<f8')
+            num_states = min(num_states, int(np.searchsorted(offsets, len(values), side='right')) - 1)
+            self.offsets[name] = offsets
+            self.values[name] = values
+        for name in self.states:
+            self.states[name] = self.states[name][:num_states]
+        # steps may only refer to complete rows
+        incomplete = np.flatnonzero((self.steps['states'] > num_states)
+                                    | (self.steps['actions'] > len(self.actions['time'])))
+        num_steps = incomplete[0] if len(incomplete) else len(self.steps['time'])
+        for name in self.steps:
+            self.steps[name] = self.steps[name][:num_steps]
+
+    def _load(self, stream, columns, widths=None):
+        data = {}
+        for name, dtype in columns:
+            values = np.fromfile(os.path.join(self.directory, stream, name + '.bin'), dtype=dtype)
+            width = (widths or {}).get(name, 1)
+            data[name] = values[:len(values) // width * width].reshape(-1, width) if width > 1 else values
+        rows = min(len(values) for values in data.values())
+        return dict((name, values[:rows]) for name, values in data.items())
+
+    def __len__(self):
+        return len(self.states['time'])
+
+    def field(self, name, i):
+        """Values of StateMsg array field `name` of state i, flat as in the message"""
+        return self.values[name][self.offsets[name][i]:self.offsets[name][i + 1]]
+
+    def state(self, i):
+        msg = SimpleNamespace(**dict((MSG_NAMES.get(name, name), self.states[name][i].item())
+                                     for name, _ in STATE_COLUMNS))
+        for name in FIELDS:
+            setattr(msg, name, self.field(name, i))
+        return msg
+
+    def transitions(self, reward_fn):
+        """(state, action, reward, next_state, done) arrays of every recorded step.
+
+        The observation of a step is the goal delta of the last state received
+        before it returned; the action is the last one sent before that.
+        `reward_fn` maps (N, 2) observations to rewards and dones, like
+        planar_arm.shaped_reward.
+        """
+        kind = self.steps['kind']
+        last_state = self.steps['states'].astype(np.int64) - 1
+        e = np.stack([self.field('e', max(i, 0)) for i in last_state]) if len(last_state) else np.zeros((0, 2))
+        observations = self.goal - e
+        # a step follows the reset or step right before it
+        is_step = np.flatnonzero((kind == STEP) & (np.arange(len(kind)) > 0))
+        valid = is_step[(last_state[is_step - 1] >= 0) & (self.steps['actions'][is_step] > 0)]
+        actions = self.actions['e_ddot_star'][self.steps['actions'][valid].astype(np.int64) - 1] / 100
+        rewards, dones = reward_fn(observations[valid])
+        return observations[valid - 1], actions, rewards, observations[valid], dones
@@ -1,26 +1,325 @@
-import random
+import os
+import numpy as np
+import torch
 from collections import namedtuple
 
+import experience_store
+
 Transition = namedtuple('Transition', ('state', 'action', 'mask', 'next_state', 'reward'))
 
 class ReplayMemory(object):
+    """Ring buffer keeping every transition field in one preallocated tensor.
 
-    def __init__(self, capacity):
+    Storage is allocated on the first push (or up front when the state and
+    action sizes are given), so `sample` only has to gather rows by index and
+    returns a Transition of ready-to-use batch tensors:
+    state/next_state (B, state_dim), action (B, action_dim), mask/reward (B,).
+
+    With a `directory` the columns are memory-mapped files of an
+    experience_store, so every push is persisted incrementally and `flush`
+    only has to record the ring position. An existing store there is only
+    replaced with `overwrite`.
+    """
+
+    def __init__(self, capacity, state_dim=None, action_dim=None, directory=None, overwrite=False):
         self.capacity = capacity
-        self.memory = []
+        self.directory = directory
+        self.overwrite = overwrite
         self.position = 0
+        self.size = 0
+        self.memory = None
+        if state_dim is not None and action_dim is not None:
+            self._allocate(state_dim, action_dim)
+
+    def _allocate(self, state_dim, action_dim):
+        if self.directory is not None:
+            columns = experience_store.create(self.directory, self.capacity, state_dim, action_dim,
+                                              self.overwrite)
+            self.memory = Transition(*[torch.from_numpy(columns[name]) for name in Transition._fields])
+            return
+        self.memory = Transition(state=torch.zeros(self.capacity, state_dim),
+                                 action=torch.zeros(self.capacity, action_dim),
+                                 mask=torch.zeros(self.capacity),
+                                 next_state=torch.zeros(self.capacity, state_dim),
+                                 reward=torch.zeros(self.capacity))
+
+    def _restore(self, size, position):
+        self.size = size
+        self.position = position
+
+    @classmethod
+    def load(cls, source, limit=None, **kwargs):
+        """Warm-starts from the experience store in directory `source`.
+
+        Without `limit` the store is mapped in place and the ring position is
+        resumed, so loading is instant and new pushes keep appending to it.
+        With `limit` only the newest `limit` transitions are copied into a new
+        memory built from `kwargs` (capacity defaults to the stored one).
+        """
+        header, columns = experience_store.open_store(source)
+        if limit is None:
+            memory = cls(header['capacity'], directory=source, **kwargs)
+            memory.memory = Transition(*[torch.from_numpy(columns[name]) for name in Transition._fields])
+            memory._restore(header['size'], header['position'])
+            return memory
+
+        if os.path.abspath(kwargs.get('directory') or '') == os.path.abspath(source):
+            raise ValueError('A partial load cannot write back into the store it reads from')
+        kwargs.setdefault('capacity', header['capacity'])
+        memory = cls(state_dim=header['state_dim'], action_dim=header['action_dim'], **kwargs)
+        count = min(limit, header['size'], memory.capacity)
+        indices = (header['position'] - count + np.arange(count)) % header['capacity']
+        for column, name in zip(memory.memory, Transition._fields):
+            column[:count] = torch.from_numpy(columns[name][indices])
+        memory._restore(count, count % memory.capacity)
+        return memory
+
+    def state_dict(self):
+        """Copy of the stored transitions and ring position, for checkpoints"""
+        columns = None if self.memory is None else [column[:self.size].clone() for column in self.memory]
+        return {'size': self.size, 'position': self.position, 'columns': columns}
+
+    def load_state_dict(self, state):
+        if state['columns'] is not None:
+            if self.memory is None:
+                self._allocate(state['columns'][0].shape[1], state['columns'][1].shape[1])
+            for column, values in zip(self.memory, state['columns']):
+                column[:len(values)] = values
+        self.size = state['size']
+        self.position = state['position']
+
+    def flush(self):
+        """Records the ring position of a disk-backed memory"""
+        if self.directory is None or self.memory is None:
+            return
+        header = experience_store.read_header(self.directory)
+        header.update(size=self.size, position=self.position)
+        experience_store.write_header(self.directory, header)
 
     #@profile
-    def push(self, *args):
+    def push(self, state, action, mask, next_state, reward):
         """Saves a transition"""
-        if len(self.memory) < self.capacity:
-            self.memory.append(None)
-        self.memory[self.position] = Transition(*args)
+        if self.memory is None:
+            self._allocate(torch.as_tensor(state).numel(), torch.as_tensor(action).numel())
+        for column, value in zip(self.memory, (state, action, mask, next_state, reward)):
+            column[self.position] = torch.as_tensor(value, dtype=torch.float32).view_as(column[self.position])
         self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, states, actions, masks, next_states, rewards):
+        """Saves a batch of transitions, one per row, in a single write per field"""
+        if self.memory is None:
+            self._allocate(states.shape[1], actions.shape[1])
+        indices = (self.position + torch.arange(len(states))) % self.capacity
+        for column, values in zip(self.memory, (states, actions, masks, next_states, rewards)):
+            column[indices] = torch.as_tensor(values, dtype=torch.float32).view(column[indices].shape)
+        self.position = (self.position + len(states)) % self.capacity
+        self.size = min(self.size + len(states), self.capacity)
+        return indices
+
+    def sample_indices(self, batch_size):
+        return torch.from_numpy(np.random.randint(0, self.size, size=batch_size))
+
+    def gather(self, indices):
+        return Transition(*[column[indices] for column in self.memory])
 
     #@profile
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        return self.gather(self.sample_indices(batch_size))
+
+    def sample_batches(self, num_batches, batch_size):
+        """`num_batches` batches in one gather, every field stacked as (num_batches, batch_size, ...)"""
+        return self.gather(self.sample_indices(num_batches * batch_size).view(num_batches, batch_size))
 
     def __len__(self):
-        return len(self.memory)
+        return self.size
+
+
+class SegmentTree(object):
+    """Array-backed binary tree reducing leaf values with a NumPy ufunc.
+
+    Leaves live at [size, 2*size); every update and query is vectorized over
+    a batch of indices and touches O(log n) nodes per index.
+    """
+
+    def __init__(self, capacity, operation, neutral):
+        self.size = 1
+        while self.size < capacity:
+            self.size *= 2
+        self.operation = operation
+        self.tree = np.full(2 * self.size, neutral, dtype=np.float64)
+
+    def __getitem__(self, indices):
+        return self.tree[np.asarray(indices) + self.size]
+
+    def __setitem__(self, indices, values):
+        nodes = np.asarray(indices) + self.size
+        self.tree[nodes] = values
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+
+    def reduce(self):
+        return self.tree[1]
+
+
+class SumTree(SegmentTree):
+
+    def __init__(self, capacity):
+        super(SumTree, self).__init__(capacity, np.add, 0.0)
+
+    def find_prefixsum_idx(self, prefixsums):
+        """Index of the first leaf whose running sum exceeds each prefix sum"""
+        prefixsums = np.array(prefixsums, dtype=np.float64)
+        nodes = np.ones(len(prefixsums), dtype=np.int64)
+        while nodes[0] < self.size:
+            left = self.tree[2 * nodes]
+            go_right = prefixsums >= left
+            prefixsums -= left * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.size
+
+
+class MinTree(SegmentTree):
+
+    def __init__(self, capacity):
+        super(MinTree, self).__init__(capacity, np.minimum, np.inf)
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """Proportional prioritized replay (Schaul et al., 2016).
+
+    `sample` returns the batch together with normalized importance-sampling
+    weights and the sampled indices, which are handed back to
+    `update_priorities` with the new TD errors.
+    """
+
+    def __init__(self, capacity, alpha=0.6, epsilon=1e-6, state_dim=None, action_dim=None, directory=None,
+                 overwrite=False):
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.sum_tree = SumTree(capacity)
+        self.min_tree = MinTree(capacity)
+        super(PrioritizedReplayMemory, self).__init__(capacity, state_dim, action_dim, directory, overwrite)
+
+    def _restore(self, size, position):
+        # priorities are not persisted, restored transitions start out equal
+        super(PrioritizedReplayMemory, self)._restore(size, position)
+        if size > 0:
+            self.update_priorities(np.arange(size), np.full(size, self.max_priority))
+
+    def state_dict(self):
+        state = super(PrioritizedReplayMemory, self).state_dict()
+        state.update(sum_tree=self.sum_tree.tree.copy(), min_tree=self.min_tree.tree.copy(),
+                     max_priority=self.max_priority)
+        return state
+
+    def load_state_dict(self, state):
+        super(PrioritizedReplayMemory, self).load_state_dict(state)
+        self.sum_tree.tree[:] = state['sum_tree']
+        self.min_tree.tree[:] = state['min_tree']
+        self.max_priority = state['max_priority']
+
+    #@profile
+    def push(self, *args):
+        """Saves a transition with the highest priority seen so far"""
+        index = self.position
+        super(PrioritizedReplayMemory, self).push(*args)
+        priority = self.max_priority ** self.alpha
+        self.sum_tree[[index]] = priority
+        self.min_tree[[index]] = priority
+
+    def extend(self, *args):
+        indices = super(PrioritizedReplayMemory, self).extend(*args)
+        priority = self.max_priority ** self.alpha
+        self.sum_tree[indices.numpy()] = priority
+        self.min_tree[indices.numpy()] = priority
+        return indices
+
+    def sample_indices(self, batch_size, num_batches=None):
+        # stratified sampling: one draw from each of batch_size equal segments, per batch
+        shape = batch_size if num_batches is None else (num_batches, batch_size)
+        segment = self.sum_tree.reduce() / batch_size
+        prefixsums = (np.arange(batch_size) + np.random.uniform(size=shape)) * segment
+        indices = self.sum_tree.find_prefixsum_idx(prefixsums.ravel()).reshape(prefixsums.shape)
+        return torch.from_numpy(np.minimum(indices, self.size - 1))
+
+    def _weights(self, indices, beta):
+        total = self.sum_tree.reduce()
+        probabilities = self.sum_tree[indices.numpy()] / total
+        max_weight = (self.size * self.min_tree.reduce() / total) ** -beta
+        return torch.from_numpy((self.size * probabilities) ** -beta / max_weight).float()
+
+    #@profile
+    def sample(self, batch_size, beta=0.4):
+        indices = self.sample_indices(batch_size)
+        batch = self.gather(indices)
+        return batch, self._weights(indices, beta), indices
+
+    def sample_batches(self, num_batches, batch_size, beta=0.4):
+        """Like `sample`, with a leading num_batches dimension on everything returned.
+
+        All batches are drawn from the current priorities, they are only
+        updated once the caller hands back the TD errors of all of them.
+        """
+        indices = self.sample_indices(batch_size, num_batches)
+        batch = self.gather(indices)
+        return batch, self._weights(indices, beta), indices
+
+    def update_priorities(self, indices, td_errors):
+        indices = np.asarray(indices).ravel()
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64).ravel()) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.sum_tree[indices] = priorities ** self.alpha
+        self.min_tree[indices] = priorities ** self.alpha
+
+
+class SharedReplayMemory(ReplayMemory):
+    """ReplayMemory that actor processes forked from the learner push into.
+
+    Columns live in shared memory (or in the store's file mapping, which
+    forked processes share anyway) and the ring position is a shared tensor,
+    so all processes see one buffer. Writers serialize on `lock`. Storage
+    has to be allocated before the actors are forked, so pass the sizes.
+    """
+
+    def __init__(self, capacity, state_dim=None, action_dim=None, directory=None, overwrite=False):
+        self._ring = torch.zeros(2, dtype=torch.long).share_memory_()
+        self.lock = torch.multiprocessing.Lock()
+        super(SharedReplayMemory, self).__init__(capacity, state_dim, action_dim, directory, overwrite)
+
+    def _allocate(self, state_dim, action_dim):
+        super(SharedReplayMemory, self)._allocate(state_dim, action_dim)
+        if self.directory is None:
+            for column in self.memory:
+                column.share_memory_()
+
+    @property
+    def position(self):
+        return int(self._ring[0])
+
+    @position.setter
+    def position(self, value):
+        self._ring[0] = value
+
+    @property
+    def size(self):
+        return int(self._ring[1])
+
+    @size.setter
+    def size(self, value):
+        self._ring[1] = value
+
+    def push(self, *args):
+        with self.lock:
+            super(SharedReplayMemory, self).push(*args)
+
+    def extend(self, *args):
+        with self.lock:
+            return super(SharedReplayMemory, self).extend(*args)
+
+    def gather(self, indices):
+        # rows an actor is halfway through writing would mix two transitions
+        with self.lock:
+            return super(SharedReplayMemory, self).gather(indices)
@@ -3,3 +3,5 @@ clear
 python main.py --num_episodes 5000 --batch_size 256 --seed 4
 #python main.py --num_episodes 50000 --batch_size 512
 #python main.py --num_episodes 50000 --batch_size 256
+#sweeps on the surrogate arm, one run per core:
+#python sweep.py --param batch_size=128,256,512 --param gamma=0.95,0.99 -- --num_episodes 500
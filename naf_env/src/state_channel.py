@@ -0,0 +1,213 @@
+import fcntl
+import mmap
+import os
+from types import SimpleNamespace
+import numpy as np
+
+# Python side of the shared memory state ring written by TDynAsyncPolicy,
+# see rl_task_plugins/include/rl_task_plugins/state_channel.h for the layout.
+MAGIC = 0x54534c52
+VERSION = 2
+SHM_DIR = '/dev/shm'
+
+FIELDS = ('e', 'de', 'q', 'dq', 'ddq_star', 'J_upper', 'J_lower', 'b_upper', 'rhs_fixed_term')
+FIELD_BITS = dict((name, 1 << i) for i, name in enumerate(FIELDS))
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('num_slots', '<u4'),
+                         ('max_joints', '<u4'), ('max_upper', '<u4'), ('max_lower', '<u4'),
+                         ('subscribed_fields', '<u4'), ('pad', '<u4'),
+                         ('write_count', '<u8'), ('reserved', '<u8', (3,))])
+SLOT_DTYPE = np.dtype([('seq', '<u8'), ('stamp', '<f8'), ('n_joints', '<u4'),
+                       ('n_upper', '<u4'), ('n_lower', '<u4'), ('fields', '<u4'),
+                       ('action_seq', '<u4'), ('pad', '<u4')])
+
+
+def field_mask(names):
+    mask = 0
+    for name in names:
+        mask |= FIELD_BITS[name]
+    return mask
+
+
+def layout(max_joints, max_upper, max_lower):
+    """Capacities (doubles) and byte offsets of every field in a slot, and the slot size"""
+    capacities = (max_lower, max_lower, max_joints, max_joints, max_joints,
+                  max_upper * max_joints, max_lower * max_joints, max_upper, max_lower)
+    offsets = []
+    offset = SLOT_DTYPE.itemsize
+    for capacity in capacities:
+        offsets.append(offset)
+        offset += 8 * capacity
+    return capacities, offsets, (offset + 63) // 64 * 64
+
+
+def field_shape(name, n_joints, n_upper, n_lower):
+    """Shape as stored, matrices are column-major so (cols, rows)"""
+    return {'e': (n_lower,), 'de': (n_lower,), 'q': (n_joints,), 'dq': (n_joints,),
+            'ddq_star': (n_joints,), 'J_upper': (n_joints, n_upper), 'J_lower': (n_joints, n_lower),
+            'b_upper': (n_upper,), 'rhs_fixed_term': (n_lower,)}[name]
+
+
+class _Segment(object):
+    """Structured views over a mapped channel segment"""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.header = np.ndarray((), HEADER_DTYPE, buffer=buf)
+        self.num_slots = int(self.header['num_slots'])
+        capacities, offsets, slot_size = layout(int(self.header['max_joints']),
+                                                int(self.header['max_upper']),
+                                                int(self.header['max_lower']))
+        self.capacities = dict(zip(FIELDS, capacities))
+        self.slots = []
+        self.data = []
+        for i in range(self.num_slots):
+            base = HEADER_DTYPE.itemsize + i * slot_size
+            self.slots.append(np.ndarray((), SLOT_DTYPE, buffer=buf, offset=base))
+            self.data.append(dict((name, np.ndarray(capacity, '<f8', buffer=buf, offset=base + offset))
+                                  for name, capacity, offset in zip(FIELDS, capacities, offsets)))
+
+
+class StateChannel(object):
+    """Reads the latest state from a channel without allocating per message.
+
+    `read()` copies the newest complete slot into buffers preallocated at
+    their maximum size and returns its sequence number (the writer's write
+    count), which stays the same until a newer state arrives, so a repeated
+    value means the state is stale. `stamp` and `action_seq` are the
+    controller time of the state and the number of the last action applied
+    before it. Torn reads are detected with the slot's
+    seqlock and retried. Only the `fields` asked for are copied. The writer
+    fills the union of the fields of all readers of the channel and skips
+    the rest. States written before a reader subscribed may lack its fields
+    and are not returned; a later state without them raises IOError.
+    """
+
+    def __init__(self, name, fields=FIELDS, shm_dir=SHM_DIR):
+        self.file = open(os.path.join(shm_dir, name.lstrip('/')), 'r+b')
+        self.segment = _Segment(mmap.mmap(self.file.fileno(), 0))
+        if int(self.segment.header['magic']) != MAGIC or int(self.segment.header['version']) != VERSION:
+            raise IOError('{} is not a version {} state channel'.format(name, VERSION))
+        self.fields = tuple(fields)
+        self.mask = field_mask(self.fields)
+        header = self.segment.header
+        # add to what other readers asked for, serialized between readers by the file lock
+        fcntl.lockf(self.file, fcntl.LOCK_EX)
+        try:
+            header['subscribed_fields'] = int(header['subscribed_fields']) | self.mask
+            # the write in progress may still use the old mask, later ones have our fields
+            self.subscribed_at = int(header['write_count']) + 1
+        finally:
+            fcntl.lockf(self.file, fcntl.LOCK_UN)
+        self.buffers = dict((name, np.zeros(self.segment.capacities[name])) for name in self.fields)
+        self.seq = 0
+        self.stamp = 0.0
+        self.action_seq = 0
+        self.dims = (0, 0, 0)
+
+    def read(self, retries=100):
+        """Copies the newest state, returns its sequence number (0 if none yet)"""
+        header, slots, data = self.segment.header, self.segment.slots, self.segment.data
+        for _ in range(retries):
+            k = int(header['write_count'])
+            if k < self.seq:
+                self.seq = 0  # the writer restarted and re-created the channel
+            if k == 0 or k == self.seq:
+                return k
+            slot = slots[(k - 1) % self.segment.num_slots]
+            seq = int(slot['seq'])
+            if seq != 2 * k:
+                continue  # being overwritten, a newer write_count is on its way
+            dims = (int(slot['n_joints']), int(slot['n_upper']), int(slot['n_lower']))
+            stamp = float(slot['stamp'])
+            action_seq = int(slot['action_seq'])
+            missing = self.mask & ~int(slot['fields'])
+            slot_data = data[(k - 1) % self.segment.num_slots]
+            if not missing:
+                for name in self.fields:
+                    n = int(np.prod(field_shape(name, *dims)))
+                    np.copyto(self.buffers[name][:n], slot_data[name][:n])
+            if int(slot['seq']) != seq:
+                continue
+            if missing and k <= self.subscribed_at:
+                return self.seq  # written before the writer knew our fields
+            if missing:
+                raise IOError('state channel: state {} lacks {}'.format(
+                    k, ', '.join(name for name in self.fields if FIELD_BITS[name] & missing)))
+            self.seq, self.stamp, self.action_seq, self.dims = k, stamp, action_seq, dims
+            return k
+        raise IOError('state channel: no consistent read after {} retries'.format(retries))
+
+    def get(self, name):
+        """View of a field of the last read state, matrices as (rows, cols)"""
+        shape = field_shape(name, *self.dims)
+        view = self.buffers[name][:int(np.prod(shape))].reshape(shape)
+        return view.T if view.ndim == 2 else view
+
+    def message(self):
+        """The last read state with the attributes of a StateMsg, fields flat as in the message.
+
+        Fields this reader does not copy are zeros of the right size.
+        """
+        n_joints, n_upper, n_lower = self.dims
+        msg = SimpleNamespace(seq=self.seq, stamp=self.stamp, action_seq=self.action_seq, n_joints=n_joints,
+                              n_constraints_upper=n_upper, n_constraints_lower=n_lower)
+        for name in FIELDS:
+            n = int(np.prod(field_shape(name, *self.dims)))
+            setattr(msg, name, self.buffers[name][:n] if name in self.buffers else np.zeros(n))
+        return msg
+
+    def close(self):
+        self.segment = None
+        self.file.close()
+
+
+class StateChannelWriter(object):
+    """Creates a channel and writes states to it the way TDynAsyncPolicy does.
+
+    Used to stand in for the controller when running without ROS.
+    """
+
+    def __init__(self, name, num_slots=8, max_joints=7, max_upper=64, max_lower=2, shm_dir=SHM_DIR):
+        _, _, slot_size = layout(max_joints, max_upper, max_lower)
+        size = HEADER_DTYPE.itemsize + num_slots * slot_size
+        self.file = open(os.path.join(shm_dir, name.lstrip('/')), 'w+b')
+        self.file.truncate(size)
+        buf = mmap.mmap(self.file.fileno(), size)
+        header = np.ndarray((), HEADER_DTYPE, buffer=buf)
+        header['version'] = VERSION
+        header['num_slots'] = num_slots
+        header['max_joints'] = max_joints
+        header['max_upper'] = max_upper
+        header['max_lower'] = max_lower
+        header['magic'] = MAGIC
+        self.segment = _Segment(buf)
+
+    def write(self, stamp, action_seq=0, **fields):
+        header = self.segment.header
+        k = int(header['write_count'])
+        slot = self.segment.slots[k % self.segment.num_slots]
+        data = self.segment.data[k % self.segment.num_slots]
+        mask = int(header['subscribed_fields']) or ALL_FIELDS
+
+        slot['seq'] = 2 * k + 1
+        written = 0
+        for name, value in fields.items():
+            value = np.asarray(value, dtype=np.float64).ravel(order='F')
+            if not mask & FIELD_BITS[name] or value.size > self.segment.capacities[name]:
+                continue
+            data[name][:value.size] = value
+            written |= FIELD_BITS[name]
+        slot['stamp'] = stamp
+        slot['action_seq'] = action_seq
+        slot['n_joints'] = np.size(fields.get('q', ()))
+        slot['n_upper'] = np.shape(fields['J_upper'])[0] if 'J_upper' in fields else 0
+        slot['n_lower'] = np.size(fields.get('e', ()))
+        slot['fields'] = written
+        slot['seq'] = 2 * k + 2
+        header['write_count'] = k + 1
+
+    def close(self):
+        self.segment = None
+        self.file.close()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Hyperparameter sweeps of main.py over all cores of one machine.
+
+    python sweep.py --param gamma=0.95,0.99 --param batch_size=128,256 -- --num_episodes 200
+    python sweep.py --search random --samples 32 --param tau=1e-4:1e-2:log \\
+        --param hidden_size=64,128,256 --seeds 1 2 -- --num_episodes 200 --num_envs 8
+
+A --param is either a list of values (NAME=a,b,c) or, for random search, a
+range sampled uniformly (NAME=low:high) or log-uniformly (NAME=low:high:log).
+Names and types are checked against the options of main.py. Arguments after
+`--` are passed to every run unchanged.
+
+Every run is a `main.py --surrogate` process started in its own directory
+under --sweep_dir, so its tensorboard logs (runs/), model (models/) and
+results.json stay apart from the others. Runs are pinned to their own
+--threads_per_run cores and limited to as many torch threads; by default
+the sweep keeps every core available to this process busy. A summary table,
+sorted by final reward, is printed and written to summary.csv.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from main import build_parser
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def parse_param(spec, options):
+    """NAME=a,b,c or NAME=low:high[:log] into (name, values or (low, high, log))"""
+    name, _, values = spec.partition('=')
+    name = name.lstrip('-')
+    action = options.get('--' + name)
+    if action is None or not values:
+        raise ValueError('{} is not an option of main.py or has no values'.format(name))
+    cast = action.type or str
+    if ':' in values:
+        bounds = values.split(':')
+        if len(bounds) not in (2, 3) or (len(bounds) == 3 and bounds[2] != 'log'):
+            raise ValueError('range of {} must be low:high or low:high:log'.format(name))
+        return name, (cast(bounds[0]), cast(bounds[1]), len(bounds) == 3)
+    return name, [cast(value) for value in values.split(',')]
+
+
+def grid(params):
+    """Every combination of the listed values"""
+    names = [name for name, _ in params]
+    for name, values in params:
+        if isinstance(values, tuple):
+            raise ValueError('grid search needs a list of values for {}'.format(name))
+    for combination in itertools.product(*[values for _, values in params]):
+        yield dict(zip(names, combination))
+
+
+def random_search(params, samples, rng):
+    """`samples` draws, uniform over lists and (log-)uniform over ranges"""
+    for _ in range(samples):
+        config = {}
+        for name, values in params:
+            if isinstance(values, list):
+                config[name] = values[rng.randint(len(values))]
+                continue
+            low, high, log = values
+            value = np.exp(rng.uniform(np.log(low), np.log(high))) if log else rng.uniform(low, high)
+            config[name] = type(low)(round(value)) if isinstance(low, int) else float(value)
+        yield config
+
+
+def run(index, config, seed, args, extra, slots):
+    """Runs main.py for one configuration on a free core slot, returns its summary row"""
+    run_dir = os.path.join(args.sweep_dir, 'run_{:03d}'.format(index))
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    command = [sys.executable, MAIN, '--surrogate', '--num_threads', str(args.threads_per_run),
+               '--results', 'results.json']
+    for name, value in sorted(config.items()):
+        command += ['--' + name, str(value)]
+    if seed is not None:
+        command += ['--seed', str(seed)]
+    command += extra
+    with open(os.path.join(run_dir, 'params.json'), 'w') as f:
+        json.dump({'params': config, 'seed': seed, 'command': command}, f, indent=2)
+
+    # OpenMP/MKL pools size themselves at import, before main.py can set the torch thread count
+    env = dict(os.environ, OMP_NUM_THREADS=str(args.threads_per_run), MKL_NUM_THREADS=str(args.threads_per_run))
+    cores = slots.get()
+    t_start = time.time()
+    try:
+        with open(os.path.join(run_dir, 'stdout.log'), 'w') as log:
+            returncode = subprocess.call(command, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                         preexec_fn=lambda: os.sched_setaffinity(0, cores))
+    finally:
+        slots.put(cores)
+
+    row = dict(run=os.path.basename(run_dir), seed=seed, status='ok' if returncode == 0 else 'failed',
+               minutes=(time.time() - t_start) / 60, **config)
+    results = os.path.join(run_dir, 'results.json')
+    if returncode == 0 and os.path.exists(results):
+        with open(results) as f:
+            row.update(json.load(f))
+        row['minutes'] = (time.time() - t_start) / 60
+    if not args.keep_experience:
+        shutil.rmtree(os.path.join(run_dir, 'experience'), ignore_errors=True)
+    print('{} {} in {:.1f} min: {}'.format(row['run'], row['status'], row['minutes'],
+                                           ' '.join('{}={}'.format(k, v) for k, v in sorted(config.items()))))
+    return row
+
+
+def summarize(rows, names, path):
+    """Prints the runs sorted by final reward and writes them to `path` as CSV"""
+    rows = sorted(rows, key=lambda row: -row.get('final_reward', -np.inf))
+    columns = ['run', 'status', 'seed'] + names + ['final_reward', 'mean_reward', 'max_reward', 'minutes']
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    def cell(value):
+        return '{:.4g}'.format(value) if isinstance(value, float) else str(value)
+    table = [columns] + [[cell(row.get(column, '-')) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print('  '.join(value.rjust(width) for value, width in zip(line, widths)))
+
+
+def main():
+    argv = sys.argv[1:]
+    extra = []
+    if '--' in argv:
+        argv, extra = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+
+    cores = sorted(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser(description='NAF hyperparameter sweep')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUES',
+                        help='swept option of main.py, a,b,c or low:high[:log] (repeatable)')
+    parser.add_argument('--search', choices=['grid', 'random'], default='grid',
+                        help='grid over all listed values or random samples (default: grid)')
+    parser.add_argument('--samples', type=int, default=16, metavar='N',
+                        help='configurations drawn by random search (default: 16)')
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, metavar='S',
+                        help='run every configuration once per seed (default: main.py seed)')
+    parser.add_argument('--threads_per_run', type=int, default=1, metavar='T',
+                        help='cores and torch threads of every run (default: 1)')
+    parser.add_argument('--workers', type=int, default=None, metavar='N',
+                        help='concurrent runs (default: available cores / threads_per_run, {} cores)'.format(len(cores)))
+    parser.add_argument('--sweep_dir', default='sweeps/{}'.format(time.strftime('%Y%m%d_%H%M%S')),
+                        help='directory of the run directories and summary (default: sweeps/<time>)')
+    parser.add_argument('--sweep_seed', type=int, default=0,
+                        help='seed of the random search (default: 0)')
+    parser.add_argument('--keep_experience', action='store_true',
+                        help='keep the experience store of every run')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='only print the configurations')
+    args = parser.parse_args(argv)
+
+    options = build_parser()._option_string_actions
+    try:
+        params = [parse_param(spec, options) for spec in args.param]
+        if args.search == 'grid':
+            configs = list(grid(params))
+        else:
+            configs = list(random_search(params, args.samples, np.random.RandomState(args.sweep_seed)))
+    except ValueError as e:
+        parser.error(str(e))
+    names = [name for name, _ in params]
+    jobs = [(config, seed) for config in configs for seed in (args.seeds or [None])]
+
+    # one slot of threads_per_run cores per worker
+    workers = args.workers or max(1, len(cores) // args.threads_per_run)
+    workers = min(workers, len(jobs))
+    if workers * args.threads_per_run > len(cores):
+        parser.error('{} workers of {} threads need more than the {} available cores'.format(
+            workers, args.threads_per_run, len(cores)))
+    slots = queue.Queue()
+    for i in range(workers):
+        slots.put(set(cores[i * args.threads_per_run:(i + 1) * args.threads_per_run]))
+
+    print('sweep: {} runs on {} workers x {} threads in {}'.format(
+        len(jobs), workers, args.threads_per_run, args.sweep_dir))
+    if args.dry_run:
+        for config, seed in jobs:
+            print(config, 'seed={}'.format(seed))
+        return
+    if not os.path.exists(args.sweep_dir):
+        os.makedirs(args.sweep_dir)
+    with open(os.path.join(args.sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump({'argv': sys.argv[1:], 'jobs': [{'params': c, 'seed': s} for c, s in jobs]}, f, indent=2)
+
+    t_start = time.time()
+    with ThreadPoolExecutor(workers) as pool:
+        rows = list(pool.map(lambda job: run(job[0], job[1][0], job[1][1], args, extra, slots), enumerate(jobs)))
+    print('sweep: {} runs in {:.1f} min'.format(len(rows), (time.time() - t_start) / 60))
+    summarize(rows, names, os.path.join(args.sweep_dir, 'summary.csv'))
+    if any(row['status'] != 'ok' for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+
+
+class VecEnv(object):
+    """Steps N environments together on batched actions.
+
+    Every wrapped env keeps the single-env interface used by main.py:
+    `step` takes a (1, action_dim) action tensor and returns
+    (observation, reward, done, info), `reset` returns an observation.
+    The envs are stepped from a thread pool, so N ROS environments waiting
+    on their own `rate.sleep()` overlap instead of adding up.
+    """
+
+    def __init__(self, env_fns):
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.pool = ThreadPoolExecutor(self.num_envs) if self.num_envs > 1 else None
+        self.observations = None
+        self.reset_latency = None
+
+    def _map(self, fn, indices):
+        if self.pool is None:
+            return [fn(i) for i in indices]
+        return list(self.pool.map(fn, indices))
+
+    @property
+    def goal(self):
+        """Goals of the envs, (N, goal_dim)"""
+        return np.array([env.goal for env in self.envs], dtype=np.float64)
+
+    def seed(self, seed):
+        for i, env in enumerate(self.envs):
+            env.seed(seed + i)
+
+    def reset(self):
+        """Resets every env, returns stacked observations (N, obs_dim)"""
+        t_start = time.time()
+        self.observations = np.array(self._map(lambda i: self.envs[i].reset(), range(self.num_envs)),
+                                     dtype=np.float32)
+        self.reset_latency = time.time() - t_start
+        return self.observations.copy()
+
+    def step(self, actions, active=None):
+        """Steps the envs flagged in `active` (default all) with rows of `actions`.
+
+        Inactive envs are left untouched and report their last observation,
+        zero reward and done=True.
+        Returns observations (N, obs_dim), rewards (N,), dones (N,), infos.
+        """
+        indices = range(self.num_envs) if active is None else np.flatnonzero(active)
+        results = self._map(lambda i: self.envs[i].step(actions[i:i + 1]), indices)
+
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.ones(self.num_envs, dtype=bool)
+        infos = [None] * self.num_envs
+        for i, (observation, reward, done, info) in zip(indices, results):
+            self.observations[i] = observation
+            rewards[i] = reward
+            dones[i] = done
+            infos[i] = info
+        return self.observations.copy(), rewards, dones, infos
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+        if self.pool is not None:
+            self.pool.shutdown()
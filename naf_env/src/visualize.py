@@ -0,0 +1,114 @@
+import os
+import queue
+import multiprocessing as mp
+import numpy as np
+import torch
+
+
+@torch.no_grad()
+def evaluate_path(model, states, actions, grid_size=41, extent=None, margin=0.2):
+    """V and mu of `model` over a state grid and Q along a path, in one forward pass.
+
+    `states` and `actions` are the (T, 2) observations and actions of an
+    episode. The grid spans `extent` (xmin, xmax, ymin, ymax), by default
+    the path's bounding box grown by `margin`. Returns a dict of NumPy
+    arrays ready to be pickled to the render worker.
+    """
+    states = torch.as_tensor(states, dtype=torch.float32)
+    actions = torch.as_tensor(actions, dtype=torch.float32)
+    if extent is None:
+        low, high = states.min(0)[0].numpy(), states.max(0)[0].numpy()
+        pad = np.maximum(margin * (high - low), 0.05)
+        extent = (low[0] - pad[0], high[0] + pad[0], low[1] - pad[1], high[1] + pad[1])
+    gx, gy = np.meshgrid(np.linspace(extent[0], extent[1], grid_size),
+                         np.linspace(extent[2], extent[3], grid_size))
+    grid = torch.from_numpy(np.stack([gx.ravel(), gy.ravel()], axis=1)).float()
+
+    # the grid rows only need V and mu, their action input is a placeholder
+    inputs = torch.cat([grid, states])
+    u = torch.cat([torch.zeros(len(grid), actions.shape[1]), actions])
+    training = model.training
+    model.eval()
+    mu, Q, V = model((inputs, u))
+    model.train(training)
+
+    n = len(grid)
+    return {'extent': tuple(float(e) for e in extent),
+            'V': V[:n, 0].numpy().reshape(gx.shape), 'mu': mu[:n].numpy().reshape(gx.shape + (-1,)),
+            'states': states.numpy(), 'actions': actions.numpy(), 'Q': Q[n:, 0].numpy()}
+
+
+def render(values, path, title=None):
+    """Writes the V colormap, the mu field and the Q-colored path of `evaluate_path` to a PNG"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    extent = values['extent']
+    fig, ax = plt.subplots(figsize=(8, 6))
+    image = ax.imshow(values['V'], origin='lower', extent=extent, cmap='viridis', aspect='auto')
+    fig.colorbar(image, ax=ax, label='V(s)')
+    mu = values['mu']
+    gy, gx = np.mgrid[0:mu.shape[0], 0:mu.shape[1]]
+    gx = extent[0] + (extent[1] - extent[0]) * gx / max(mu.shape[1] - 1, 1)
+    gy = extent[2] + (extent[3] - extent[2]) * gy / max(mu.shape[0] - 1, 1)
+    ax.quiver(gx, gy, mu[..., 0], mu[..., 1], color='w', alpha=0.5)
+
+    states, actions = values['states'], values['actions']
+    ax.plot(states[:, 0], states[:, 1], color='k', linewidth=0.5)
+    path_arrows = ax.quiver(states[:, 0], states[:, 1], actions[:, 0], actions[:, 1], values['Q'],
+                            cmap='plasma', angles='xy')
+    fig.colorbar(path_arrows, ax=ax, label='Q(s, a) along the path')
+    ax.set_xlabel('goal delta x')
+    ax.set_ylabel('goal delta y')
+    if title is not None:
+        ax.set_title(title)
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def _render_worker(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        values, path, title = job
+        try:
+            render(values, path, title)
+        except Exception as e:
+            print('PathPlotter: could not render {}: {}'.format(path, e))
+
+
+class PathPlotter(object):
+    """Renders episode paths in a worker process.
+
+    `submit` runs the one batched forward pass of `evaluate_path` in the
+    caller and queues its small result for the worker, which owns matplotlib
+    and the PNG encoding. When the worker falls behind, new plots are
+    dropped and counted in `dropped` rather than blocking training.
+    """
+
+    def __init__(self, directory='plots/', grid_size=41, extent=None, max_queue=4):
+        self.directory = directory
+        self.grid_size = grid_size
+        self.extent = extent
+        self.dropped = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        ctx = mp.get_context('fork')
+        self.jobs = ctx.Queue(max_queue)
+        self.worker = ctx.Process(target=_render_worker, args=(self.jobs,), name='path-plotter', daemon=True)
+        self.worker.start()
+
+    def submit(self, model, states, actions, episode):
+        values = evaluate_path(model, states, actions, self.grid_size, self.extent)
+        path = os.path.join(self.directory, 'path_{}.png'.format(episode))
+        try:
+            self.jobs.put_nowait((values, path, 'episode {}'.format(episode)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Waits for the queued plots to be written"""
+        self.jobs.put(None)
+        self.worker.join()
@@ -0,0 +1,26 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+# the naf_env modules are flat scripts in src/, import them the way the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from naf import Policy  # noqa: E402
+
+
+@pytest.fixture
+def make_policy():
+    """Factory of seeded NAF Policies in eval mode, with non-trivial bn0 statistics"""
+    def make(action_dim, hidden_size=32, state_dim=2):
+        torch.manual_seed(action_dim)
+        policy = Policy(hidden_size, state_dim, SimpleNamespace(shape=(action_dim,)))
+        with torch.no_grad():
+            policy.bn0.running_mean.uniform_(-0.5, 0.5)
+            policy.bn0.running_var.uniform_(0.5, 2.0)
+            # the initial 0.1 scaling leaves mu close to linear, use weights that saturate tanh
+            policy.mu.weight.normal_(0, 1)
+        return policy.eval()
+    return make
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+import torch
+
+from checkpoint import Checkpointer
+
+
+def test_keeps_the_newest(tmp_path):
+    checkpointer = Checkpointer(str(tmp_path), keep=2)
+    for step in range(5):
+        checkpointer.save({'step': step, 'weights': torch.full((3,), float(step))}, step)
+    checkpointer.wait()
+    assert len(checkpointer.checkpoints()) == 2
+    assert [Checkpointer.load(path)['step'] for path in checkpointer.checkpoints()] == [3, 4]
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+
+
+def test_keep_zero_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Checkpointer(str(tmp_path), keep=0)
@@ -0,0 +1,247 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip('rospy')
+pytest.importorskip('gym')
+environment = pytest.importorskip('environment')
+import instrumentation  # noqa: E402
+
+
+class FakeRos(object):
+    """Stands in for rospy: records service calls and plays a controller that
+    reaches the home pose when commanded and publishes states while running.
+
+    Every 1 ms of controller time it applies the latest action and reports its
+    seq in the state, with e[0] = 0.01 * seq so observations show which action
+    they reflect. With apply_actions off it keeps reporting the old one.
+    """
+
+    def __init__(self, initialized=True):
+        self.initialized = initialized
+        self.init_threads = []
+        self.core = SimpleNamespace(is_initialized=lambda: self.initialized)
+        self.calls = []
+        self.warnings = []
+        self.home_times = []
+        self.publish_states = True
+        self.apply_actions = True
+        self.action_seq = 0 #seq of the last action published
+        self.applied_seq = 0 #seq of the action the controller runs with
+        self.failing = set()
+        self.callbacks = {}
+        self.running = True
+        self.stamp = 0.0
+        self.positions = [0.5, 0.0, 0.0]
+        self.thread = threading.Thread(target=self._spin)
+        self.thread.daemon = True
+
+    def init_node(self, *args, **kwargs):
+        self.init_threads.append(threading.current_thread())
+        self.initialized = True
+
+    def Subscriber(self, topic, msg_type, callback):
+        self.callbacks[topic] = callback
+
+    def Publisher(self, topic, msg_type, **kwargs):
+        ros = self
+
+        class _Publisher(object):
+            def publish(self, msg):
+                if topic.endswith('/command'):
+                    ros.home_times.append(msg.points[0].time_from_start)
+                    ros.positions = list(environment.HOME_POSE)
+                elif topic.endswith('/ee_rl/act'):
+                    ros.action_seq = msg.seq
+
+            def get_num_connections(self):
+                return 1
+        return _Publisher()
+
+    def ServiceProxy(self, name, srv_type):
+        service = name.split('/')[-1]
+
+        def call(*args):
+            if service in self.failing:
+                raise IOError('{} unavailable'.format(service))
+            self.calls.append((service, args))
+        return call
+
+    def Rate(self, hz):
+        return SimpleNamespace(sleep=lambda: None)
+
+    def Duration(self, seconds):
+        return seconds
+
+    def get_time(self):
+        return self.stamp
+
+    def logwarn(self, message):
+        self.warnings.append(message)
+
+    def _spin(self):
+        while self.running:
+            self.stamp += 0.001
+            if self.apply_actions:
+                self.applied_seq = self.action_seq
+            for topic, callback in list(self.callbacks.items()):
+                if topic.endswith('/joint_states'):
+                    callback(SimpleNamespace(name=environment.HOME_JOINTS, position=self.positions,
+                                             velocity=[0.0] * len(self.positions)))
+                elif topic.endswith('/ee_rl/state') and self.publish_states:
+                    callback(SimpleNamespace(e=[0.01 * self.applied_seq, 0.0], stamp=self.stamp,
+                                             action_seq=self.applied_seq))
+            time.sleep(0.001)
+
+    def sent(self, service):
+        """Names of the definitions sent to `service`, in call order"""
+        return [d.name for name, args in self.calls if name == service for d in args[0]]
+
+
+@pytest.fixture
+def ros():
+    ros = FakeRos()
+    ros.thread.start()
+    yield ros
+    ros.running = False
+    ros.thread.join()
+
+
+@pytest.fixture
+def uninitialized_ros():
+    ros = FakeRos(initialized=False)
+    ros.thread.start()
+    yield ros
+    ros.running = False
+    ros.thread.join()
+
+
+@pytest.fixture
+def counters():
+    instrumentation.enable()
+    yield lambda: instrumentation.summary()['counters']
+    instrumentation.enable(False)
+
+
+def make_env(ros, **kwargs):
+    return environment.ManipulateEnv(ros=ros, home_timeout=1.0, state_timeout=1.0, **kwargs)
+
+
+def test_reset_without_reload_sends_unchanged_definitions_once(ros):
+    env = make_env(ros, reload_controller=False)
+    env.reset()
+    assert len(ros.sent('set_primitives')) == 6
+    assert len(ros.sent('set_tasks')) == 6
+
+    del ros.calls[:]
+    env.reset()
+    env.reset()
+    assert ros.sent('set_primitives') == []
+    assert ros.sent('set_tasks') == []
+    assert [name for name, _ in ros.calls] == ['switch_controller'] * 4
+
+
+def test_reset_without_reload_sends_changed_definitions(ros):
+    env = make_env(ros, reload_controller=False)
+    env.reset()
+    del ros.calls[:]
+    env.goal = [0.3, 0.1]
+    env.reset()
+    assert ros.sent('set_primitives') == ['goal']
+    assert ros.sent('set_tasks') == []
+
+
+def test_reset_with_reload_sends_everything(ros):
+    env = make_env(ros, reload_controller=True)
+    env.reset()
+    del ros.calls[:]
+    env.reset()
+    assert len(ros.sent('set_primitives')) == 6
+    assert len(ros.sent('set_tasks')) == 6
+
+
+def test_failed_upload_is_resent(ros):
+    env = make_env(ros, reload_controller=False)
+    env.reset()
+    env.goal = [0.3, 0.1]
+    ros.failing.add('set_primitives')
+    with pytest.raises(IOError):
+        env.reset()
+    ros.failing.clear()
+    del ros.calls[:]
+    env.reset()
+    assert len(ros.sent('set_primitives')) == 6
+    assert ros.sent('set_tasks') == []
+
+
+def test_reset_moves_home_in_home_time_and_warns_through_ros(ros):
+    env = make_env(ros, home_time=0.25)
+    env.reset()
+    assert ros.home_times == [0.25]
+    assert ros.warnings == []
+
+    ros.publish_states = False
+    env.reset()
+    assert len(ros.warnings) == 1
+    assert 'no fresh state' in ros.warnings[0]
+
+
+def test_sync_step_returns_the_state_of_the_sent_action(ros, counters):
+    env = make_env(ros, sync_step=True, control_rate=100.0, step_timeout=1.0)
+    env.reset()
+    for _ in range(3):
+        observation, _, _, _ = env.step(torch.zeros(1, 2))
+        assert env.applied_seq == env.action_seq
+        assert observation[0] == pytest.approx(env.goal[0] - 0.01 * env.action_seq)
+        #a full control period of the action has passed
+        assert env.state_stamp >= env.applied_stamp + 0.01 - 1e-9
+        assert env.action_latency is not None and env.action_latency >= 0
+    assert counters().get('env/step_timeouts', 0) == 0
+    assert counters().get('env/unapplied_actions', 0) == 0
+
+
+def test_sync_step_times_out_on_an_unapplied_action(ros, counters):
+    env = make_env(ros, sync_step=True, control_rate=100.0, step_timeout=0.05)
+    env.reset()
+    ros.apply_actions = False
+    seq = ros.applied_seq
+    t_start = time.time()
+    observation, _, _, _ = env.step(torch.zeros(1, 2))
+    assert time.time() - t_start >= 0.05
+    assert env.applied_seq == seq < env.action_seq
+    assert observation[0] == pytest.approx(env.goal[0] - 0.01 * seq)
+    assert env.action_latency is None
+    assert counters()['env/step_timeouts'] == 1
+    assert counters()['env/unapplied_actions'] == 1
+
+
+def test_envs_connect_from_workers_after_init_node_on_main_thread(uninitialized_ros):
+    from vec_env import VecEnv
+    ros = uninitialized_ros
+    environment.init_node(ros)
+    env = VecEnv([lambda i=i: make_env(ros, ns='/env{}'.format(i)) for i in range(3)])
+    env.reset()
+    assert ros.init_threads == [threading.main_thread()]
+    assert all(e.connected for e in env.envs)
+    assert sorted(topic for topic in ros.callbacks if topic.endswith('/ee_rl/state')) == \
+        ['/env0/ee_rl/state', '/env1/ee_rl/state', '/env2/ee_rl/state']
+
+
+def test_connect_off_main_thread_without_node_raises(uninitialized_ros):
+    env = make_env(uninitialized_ros)
+    errors = []
+
+    def connect():
+        try:
+            env.connect()
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=connect)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+    assert uninitialized_ros.init_threads == []
+    assert not env.connected
@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+import experience_store
+from replay_memory import ReplayMemory
+
+
+def fill(memory, count):
+    for i in range(count):
+        memory.push(torch.full((2,), float(i)), torch.zeros(2), 1.0, torch.zeros(2), float(i))
+    memory.flush()
+
+
+def test_create_refuses_to_replace_a_store(tmp_path):
+    directory = str(tmp_path / 'experience')
+    fill(ReplayMemory(8, 2, 2, directory=directory), 5)
+
+    with pytest.raises(IOError):
+        ReplayMemory(8, 2, 2, directory=directory)
+    loaded = ReplayMemory.load(directory)
+    assert len(loaded) == 5
+    assert loaded.memory.reward[:5].tolist() == [0, 1, 2, 3, 4]
+
+
+def test_create_overwrites_when_asked(tmp_path):
+    directory = str(tmp_path / 'experience')
+    fill(ReplayMemory(8, 2, 2, directory=directory), 5)
+
+    ReplayMemory(8, 2, 2, directory=directory, overwrite=True)
+    assert experience_store.read_header(directory)['size'] == 0
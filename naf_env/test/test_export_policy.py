@@ -0,0 +1,77 @@
+import os
+import shutil
+import struct
+import subprocess
+
+import numpy as np
+import pytest
+
+import inference
+from export_policy import check
+from inference import InferencePolicy
+
+PLUGINS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'rl_task_plugins')
+
+
+def eigen_flags():
+    try:
+        return subprocess.check_output(['pkg-config', '--cflags', 'eigen3'], universal_newlines=True).split()
+    except (OSError, subprocess.CalledProcessError):
+        return ['-I/usr/include/eigen3'] if os.path.isdir('/usr/include/eigen3') else None
+
+
+@pytest.fixture(scope='module')
+def check_policy(tmp_path_factory):
+    """rl_task_plugins_check_policy from $CHECK_POLICY, else built from the plugin sources"""
+    if os.environ.get('CHECK_POLICY'):
+        return os.environ['CHECK_POLICY']
+    compiler = shutil.which('c++') or shutil.which('g++')
+    flags = eigen_flags()
+    if compiler is None or flags is None:
+        pytest.skip('needs CHECK_POLICY or a C++ compiler and Eigen')
+    binary = str(tmp_path_factory.mktemp('check_policy') / 'check_policy')
+    subprocess.check_call([compiler, '-std=c++11', '-O2', '-I', os.path.join(PLUGINS, 'include')] + flags +
+                          [os.path.join(PLUGINS, 'src', 'check_policy.cpp'),
+                           os.path.join(PLUGINS, 'src', 'mlp_policy.cpp'), '-o', binary])
+    return binary
+
+
+def test_export_layout(tmp_path, make_policy):
+    policy = InferencePolicy(make_policy(2))
+    path = str(tmp_path / 'policy.bin')
+    policy.export(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == inference.EXPORT_MAGIC
+    assert struct.unpack_from('<II', data, 4) == (inference.EXPORT_VERSION, 3)
+    offset = 12
+    for weight, bias in policy.layers():
+        rows, cols, activation = struct.unpack_from('<III', data, offset)
+        assert (rows, cols, activation) == (weight.shape[0], weight.shape[1], inference.TANH)
+        offset += 12
+        stored = np.frombuffer(data, '<f4', rows * cols, offset).reshape(rows, cols)
+        offset += 4 * rows * cols
+        np.testing.assert_array_equal(stored, weight)
+        np.testing.assert_array_equal(np.frombuffer(data, '<f4', rows, offset), bias)
+        offset += 4 * rows
+    assert offset == len(data)
+
+
+@pytest.mark.parametrize('action_dim', [1, 2, 3])
+def test_cpp_matches_inference_policy(tmp_path, check_policy, make_policy, action_dim):
+    policy = InferencePolicy(make_policy(action_dim))
+    path = str(tmp_path / 'policy.bin')
+    policy.export(path)
+    assert check(policy, path, check_policy, samples=200, tolerance=1e-5) <= 1e-5
+
+
+def test_cpp_rejects_truncated_file(tmp_path, check_policy, make_policy):
+    path = str(tmp_path / 'policy.bin')
+    InferencePolicy(make_policy(2)).export(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-8])
+    result = subprocess.run([check_policy, path], input='0 0\n', stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode != 0
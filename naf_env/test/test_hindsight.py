@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('gym')
+from hindsight import HindsightRelabeler  # noqa: E402
+from planar_arm import shaped_reward  # noqa: E402
+from replay_memory import ReplayMemory  # noqa: E402
+
+NUM_STEPS = 6
+
+
+def run_episodes(memory, hindsight, goals, close=True):
+    """Writes one episode per goal, all envs stepping together like main.py.
+
+    Returns the end effector positions, (num_envs, NUM_STEPS + 1, 2), and
+    the memory row of every step, (num_envs, NUM_STEPS).
+    """
+    positions = np.random.uniform(-0.5, 0.5, size=(len(goals), NUM_STEPS + 1, 2))
+    rows = np.zeros((len(goals), NUM_STEPS), dtype=np.int64)
+    for t in range(NUM_STEPS):
+        state = goals - positions[:, t]
+        next_state = goals - positions[:, t + 1]
+        rewards, dones = shaped_reward(next_state)
+        written = memory.extend(torch.Tensor(state), torch.zeros(len(goals), 2), torch.Tensor(~dones),
+                                torch.Tensor(next_state), torch.Tensor(rewards))
+        hindsight.extend(written, np.arange(len(goals)), goals, positions[:, t + 1])
+        rows[:, t] = written.numpy()
+    if close:
+        hindsight.end_episodes()
+    return positions, rows
+
+
+def setup(ratio=1.0):
+    np.random.seed(0)
+    memory = ReplayMemory(64, state_dim=2, action_dim=2)
+    hindsight = HindsightRelabeler(memory.capacity, ratio=ratio)
+    goals = np.array([[0.6, 0.6], [-0.6, 0.2]])
+    positions, rows = run_episodes(memory, hindsight, goals)
+    return memory, hindsight, positions, rows
+
+
+def test_relabeled_goals_are_reached_later_in_the_same_episode():
+    memory, hindsight, positions, rows = setup()
+    offsets = set()
+    for _ in range(20):
+        indices = memory.sample_indices(16)
+        batch = hindsight.relabel(memory.gather(indices), indices)
+        for row, state, next_state in zip(indices.numpy(), batch.state.numpy(), batch.next_state.numpy()):
+            env, t = [int(i) for i in np.argwhere(rows == row)[0]]
+            goal = next_state + positions[env, t + 1]
+            # the goal is a position this episode's arm reached at step t or after
+            later = np.flatnonzero(np.isclose(positions[env, t + 1:], goal, atol=1e-5).all(axis=1))
+            assert len(later) == 1
+            offsets.add(int(later[0]))
+            np.testing.assert_allclose(state, goal - positions[env, t], atol=1e-5)
+    # every future step is a candidate, not only the next one
+    assert len(offsets) > 2
+
+
+def test_rewards_and_masks_are_recomputed_for_the_new_goal():
+    memory, hindsight, positions, rows = setup()
+    indices = memory.sample_indices(256)
+    batch = hindsight.relabel(memory.gather(indices), indices)
+    rewards, dones = shaped_reward(batch.next_state.numpy().astype(np.float64))
+    np.testing.assert_allclose(batch.reward.numpy(), rewards, rtol=1e-5)
+    assert np.array_equal(batch.mask.numpy(), (~dones).astype(np.float32))
+    # relabeling to the goal the step itself reached ends the episode there
+    assert dones.any() and not dones.all()
+
+
+def test_relabeling_leaves_the_stored_transitions_unchanged():
+    memory, hindsight, positions, rows = setup()
+    stored = [column.clone() for column in memory.memory]
+    indices = memory.sample_indices(4 * 16).view(4, 16)
+    batch = hindsight.relabel(memory.gather(indices), indices)
+    assert batch.state.shape == (4, 16, 2)
+    assert not torch.equal(batch.state, memory.memory.state[indices])
+    for column, before in zip(memory.memory, stored):
+        assert torch.equal(column, before)
+
+
+def test_rows_of_open_episodes_are_not_relabeled():
+    memory, hindsight, positions, rows = setup()
+    _, open_rows = run_episodes(memory, hindsight, np.array([[0.1, -0.6]]), close=False)
+    indices = torch.from_numpy(open_rows.ravel())
+    batch = hindsight.relabel(memory.gather(indices), indices)
+    for column, stored in zip(batch, memory.gather(indices)):
+        assert torch.equal(column, stored)
@@ -0,0 +1,25 @@
+import pytest
+import torch
+
+from inference import InferencePolicy
+
+
+@pytest.mark.parametrize('action_dim', [1, 2, 4])
+def test_matches_policy_in_eval_mode(make_policy, action_dim):
+    policy = make_policy(action_dim)
+    state = torch.randn(10, 2)
+    with torch.no_grad():
+        mu, _, _ = policy((state, None))
+    torch.testing.assert_close(InferencePolicy(policy).select_action(state), mu.clamp(-1, 1))
+
+
+@pytest.mark.parametrize('action_dim', [1, 2])
+def test_snapshot_does_not_follow_training(make_policy, action_dim):
+    policy = make_policy(action_dim)
+    inference = InferencePolicy(policy)
+    state = torch.randn(10, 2)
+    before = inference.select_action(state).clone()
+    with torch.no_grad():
+        for p in policy.parameters():
+            p.add_(1.0)
+    torch.testing.assert_close(inference.select_action(state), before)
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from naf import Policy
+
+
+def dense_forward(model, inputs):
+    """NAF forward with the full P = L L^T matrix, as in Gu et al. (2016)"""
+    x, u = inputs
+    x = model.bn0(x)
+    x = model.linear1(x).tanh()
+    x = model.linear2(x).tanh()
+    V = model.V(x)
+    mu = model.mu(x).tanh()
+    n = mu.shape[1]
+    entries = model.L(x).view(-1, n, n)
+    L = torch.tril(entries, diagonal=-1) + torch.diag_embed(torch.diagonal(entries, dim1=1, dim2=2).exp())
+    P = L @ L.transpose(1, 2)
+    u_mu = (u - mu).unsqueeze(2)
+    A = -0.5 * (u_mu.transpose(1, 2) @ P @ u_mu)[:, :, 0]
+    return mu, A + V, V
+
+
+@pytest.mark.parametrize('action_dim', [1, 2, 3, 7])
+@pytest.mark.parametrize('training', [True, False])
+def test_forward_matches_dense_reference(action_dim, training):
+    torch.manual_seed(action_dim)
+    model = Policy(32, 4, SimpleNamespace(shape=(action_dim,))).double()
+    # larger L entries than the initial 0.1 scaling, so the advantage is not negligible
+    model.L.weight.data.normal_(0, 0.5)
+    model.L.bias.data.normal_(0, 0.5)
+    model.train(training)
+    x = torch.randn(64, 4, dtype=torch.float64)
+    u = torch.rand(64, action_dim, dtype=torch.float64) * 2 - 1
+
+    mu, Q, V = model((x, u))
+    Q.sum().backward()
+    # bn1 and bn2 are defined but unused, they get no gradient
+    grads = {name: p.grad.clone() for name, p in model.named_parameters() if p.grad is not None}
+    model.zero_grad()
+    mu_ref, Q_ref, V_ref = dense_forward(model, (x, u))
+    Q_ref.sum().backward()
+
+    assert Q.shape == (64, 1)
+    torch.testing.assert_close(mu, mu_ref)
+    torch.testing.assert_close(V, V_ref)
+    torch.testing.assert_close(Q, Q_ref)
+    for name, p in model.named_parameters():
+        if name in grads:
+            torch.testing.assert_close(grads[name], p.grad)
+
+
+def test_forward_without_action_has_no_q():
+    model = Policy(32, 4, SimpleNamespace(shape=(2,)))
+    model.eval()
+    mu, Q, V = model((torch.randn(5, 4), None))
+    assert Q is None
+    assert mu.shape == (5, 2) and V.shape == (5, 1)
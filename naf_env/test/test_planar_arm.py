@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('gym')
+import planar_arm  # noqa: E402
+from planar_arm import PlanarArmEnv, PlanarArmVecEnv  # noqa: E402
+
+
+@pytest.fixture
+def manipulate_env():
+    """ManipulateEnv with the definitions it would upload captured instead"""
+    environment = pytest.importorskip('environment')
+    env = environment.ManipulateEnv()
+    env.set_primitives_srv = env.set_tasks_srv = None
+    env.definitions = {}
+    env._upload = lambda srv, uploaded, definitions: env.definitions.update((d.name, d) for d in definitions)
+    env.set_primitives()
+    env.set_tasks()
+    return env
+
+
+def test_task_hierarchy_matches_manipulate_env(manipulate_env):
+    environment = pytest.importorskip('environment')
+    arm = PlanarArmVecEnv()
+    definitions = manipulate_env.definitions
+    assert list(planar_arm.HOME_POSE) == list(environment.HOME_POSE)
+    assert definitions['goal'].parameters[:2] == planar_arm.GOAL == manipulate_env.goal
+    for plane in ('back_plane', 'front_plane', 'left_plane', 'right_plane'):
+        assert abs(definitions[plane].parameters[3]) == planar_arm.CAGE
+
+    cage = ['ee_cage_front', 'ee_cage_back', 'ee_cage_left', 'ee_cage_right']
+    assert [definitions[name].priority for name in cage + ['ee_rl', 'full_pose']] == [0, 0, 0, 0, 1, 2]
+    for name in cage:
+        assert [float(g) for g in definitions[name].dyn_params[1:]] == list(arm.cage_gains)
+    assert [float(q) for q in definitions['full_pose'].def_params[1:]] == list(planar_arm.HOME_POSE)
+    assert [float(g) for g in definitions['full_pose'].dyn_params[1:]] == list(arm.posture_gains)
+
+
+def test_reward_matches_manipulate_env(manipulate_env):
+    arm = PlanarArmEnv(step_dt=0.01, control_dt=0.01)
+    arm.reset()
+    observation, reward, done, _ = arm.step(np.array([[0.1, -0.2]]))
+    manipulate_env.observation = observation
+    assert (reward, done, False) == pytest.approx(manipulate_env.calc_shaped_reward())
+    assert reward == pytest.approx(-10 * np.linalg.norm(observation))
+
+    # a goal 1 cm from the end effector counts as reached in both
+    arm.goal[:] = arm.end_effector + [0.01, 0.0]
+    manipulate_env.observation = arm._observe()[0]
+    assert manipulate_env.calc_shaped_reward() == (500, True, False)
+    assert planar_arm.shaped_reward(arm._observe())[0][0] == 500
+
+
+def test_ee_rl_drives_the_end_effector_acceleration():
+    # at rest in the home pose an action small enough for the cage dynamics
+    # to allow sets e_ddot = 100 a
+    arm = PlanarArmVecEnv(step_dt=0.01, control_dt=0.01)
+    arm.reset()
+    _, J, _ = arm.kinematics(arm.q, arm.dq)
+    action = np.array([[0.002, -0.001]])
+    arm.step(action)
+    velocity = np.einsum('bij,bj->bi', J, arm.dq)
+    # up to the damping of the pseudo-inverse
+    np.testing.assert_allclose(velocity, 100 * action * arm.control_dt, rtol=1e-3)
+
+    # a larger one is cut back by the cage level above it
+    arm.reset()
+    arm.step(np.array([[0.1, 0.0]]))
+    velocity = np.einsum('bij,bj->bi', J, arm.dq)
+    assert 0 < velocity[0, 0] < 100 * 0.1 * arm.control_dt
+
+
+def test_cage_keeps_the_end_effector_inside():
+    arm = PlanarArmVecEnv()
+    arm.reset()
+    for _ in range(50):
+        arm.step(np.array([[10.0, 0.0]]))
+    assert arm.end_effector[0, 0] <= planar_arm.CAGE + 0.02
+
+
+def test_vec_env_steps_independent_arms_deterministically():
+    def rollout(active=None):
+        arm = PlanarArmVecEnv(3, home_noise=0.1)
+        arm.seed(7)
+        arm.reset()
+        start = arm.q.copy()
+        actions = np.random.RandomState(0).uniform(-1, 1, size=(5, 3, 2))
+        observations = [arm.step(a, active)[0] for a in actions]
+        return start, actions, np.array(observations)
+
+    start, actions, observations = rollout()
+    _, _, again = rollout()
+    assert np.array_equal(observations, again)
+
+    # every arm moves exactly as it would alone
+    for i in range(3):
+        arm = PlanarArmVecEnv(1)
+        arm.reset()
+        arm.q[:] = start[i]
+        alone = np.array([arm.step(a[i:i + 1])[0][0] for a in actions])
+        np.testing.assert_allclose(observations[:, i], alone, atol=1e-9)
+
+    # an inactive arm does not move and does not disturb the others
+    _, _, masked = rollout(active=[True, False, True])
+    assert (masked[:, 1] == masked[0, 1]).all()
+    np.testing.assert_allclose(masked[:, [0, 2]], observations[:, [0, 2]], atol=1e-9)
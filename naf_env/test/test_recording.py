@@ -0,0 +1,112 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from recording import TraceWriter, Trace, RESET, STEP
+from state_channel import FIELDS, field_shape
+
+GOAL = [-0.2, -0.5]
+N_JOINTS, N_UPPER, N_LOWER = 3, 4, 2
+NUM_STEPS = 3
+
+
+def shaped_reward(observations):
+    # planar_arm.shaped_reward, without importing gym
+    dist = np.sqrt((observations ** 2).sum(axis=1))
+    dones = dist < 0.02
+    return np.where(dones, 500.0, -10 * dist), dones
+
+
+def state_msg(i, action_seq):
+    """StateMsg number i, every array field filled with values derived from i"""
+    msg = SimpleNamespace(seq=i, stamp=0.01 * i, action_seq=action_seq, n_joints=N_JOINTS,
+                          n_constraints_upper=N_UPPER, n_constraints_lower=N_LOWER)
+    for k, name in enumerate(FIELDS):
+        size = int(np.prod(field_shape(name, N_JOINTS, N_UPPER, N_LOWER)))
+        setattr(msg, name, 100.0 * k + i + 0.1 * np.arange(size))
+    msg.e = np.array([0.1 * i, -0.05 * i])
+    return msg
+
+
+def action(k):
+    return np.array([0.01 * k, -0.02 * k])
+
+
+@pytest.fixture
+def trace_dir(tmp_path):
+    """One reset after two states, then NUM_STEPS steps of one action and one state each"""
+    directory = str(tmp_path / 'trace')
+    writer = TraceWriter(directory, GOAL)
+    writer.state(1.0, state_msg(0, 0))
+    writer.state(1.1, state_msg(1, 0))
+    writer.step(RESET, 1.15, 0.15)
+    for k in range(1, NUM_STEPS + 1):
+        writer.action(1.1 + 0.1 * k, k, 100 * action(k))
+        writer.state(1.15 + 0.1 * k, state_msg(1 + k, k))
+        writer.step(STEP, 1.2 + 0.1 * k, 0.2 + 0.1 * k)
+    writer.close()
+    return directory
+
+
+def test_trace_reads_back_what_was_written(trace_dir):
+    trace = Trace(trace_dir)
+    assert len(trace) == NUM_STEPS + 2
+    assert trace.goal.tolist() == GOAL
+    assert trace.states['action_seq'].tolist() == [0, 0, 1, 2, 3]
+    for i in range(len(trace)):
+        written, read = state_msg(i, trace.states['action_seq'][i]), trace.state(i)
+        assert read.seq == i and read.stamp == pytest.approx(written.stamp)
+        assert read.n_constraints_upper == N_UPPER and read.n_constraints_lower == N_LOWER
+        for name in FIELDS:
+            np.testing.assert_array_equal(getattr(read, name), getattr(written, name))
+    assert trace.actions['seq'].tolist() == [1, 2, 3]
+    np.testing.assert_allclose(trace.actions['e_ddot_star'], [100 * action(k) for k in range(1, NUM_STEPS + 1)])
+    assert trace.steps['kind'].tolist() == [RESET] + [STEP] * NUM_STEPS
+    assert trace.steps['states'].tolist() == [2, 3, 4, 5]
+    assert trace.steps['actions'].tolist() == [0, 1, 2, 3]
+
+
+def test_transitions_pair_consecutive_observations_with_the_action(trace_dir):
+    states, actions, rewards, next_states, dones = Trace(trace_dir).transitions(shaped_reward)
+    e = np.array([state_msg(i, 0).e for i in range(NUM_STEPS + 2)])
+    np.testing.assert_allclose(states, GOAL - e[1:-1])
+    np.testing.assert_allclose(next_states, GOAL - e[2:])
+    np.testing.assert_allclose(actions, [action(k) for k in range(1, NUM_STEPS + 1)])
+    expected_rewards, expected_dones = shaped_reward(GOAL - e[2:])
+    np.testing.assert_allclose(rewards, expected_rewards)
+    assert dones.tolist() == expected_dones.tolist()
+
+
+def test_partially_written_rows_are_dropped(trace_dir):
+    # a crash in the middle of a state leaves some of its columns one row longer
+    with open(os.path.join(trace_dir, 'states', 'time.bin'), 'ab') as f:
+        f.write(np.float64(9.0).tobytes())
+    with open(os.path.join(trace_dir, 'states', 'e.bin'), 'ab') as f:
+        f.write(np.float64(9.0).tobytes())
+    trace = Trace(trace_dir)
+    assert len(trace) == NUM_STEPS + 2
+    assert len(trace.transitions(shaped_reward)[0]) == NUM_STEPS
+
+
+def test_replay_env_returns_the_recorded_steps(trace_dir):
+    pytest.importorskip('rospy')
+    pytest.importorskip('gym')
+    environment = pytest.importorskip('environment')
+    states, actions, rewards, next_states, dones = Trace(trace_dir).transitions(shaped_reward)
+    env = environment.ReplayEnv(trace_dir)
+    np.testing.assert_allclose(env.reset(), states[0])
+    for k in range(NUM_STEPS):
+        # the recorded action is replayed whatever is passed in
+        observation, reward, done, _ = env.step(torch.zeros(1, 2))
+        np.testing.assert_allclose(env.recorded_action, actions[k])
+        np.testing.assert_allclose(observation, next_states[k])
+        assert reward == pytest.approx(rewards[k])
+        assert done == dones[k]
+        assert env.applied_seq == env.action_seq == k + 1
+    # the recorded episode is over
+    assert env.step(torch.zeros(1, 2))[2]
+    with pytest.raises(EOFError):
+        env.reset()
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+import torch
+
+from replay_memory import ReplayMemory, PrioritizedReplayMemory, SharedReplayMemory
+
+
+def push(memory, i):
+    """Pushes transition number i, every field derived from i"""
+    memory.push(torch.Tensor([[i, -i]]), torch.Tensor([[i]]), torch.Tensor([1]), torch.Tensor([[i + 1, -i - 1]]),
+                torch.Tensor([i]))
+
+
+def batch(first, count):
+    i = torch.arange(first, first + count, dtype=torch.float32)
+    return (torch.stack([i, -i], 1), i.view(-1, 1), torch.ones(count), torch.stack([i + 1, -i - 1], 1), i)
+
+
+def test_push_wraps_around_the_ring():
+    memory = ReplayMemory(3)
+    for i in range(5):
+        push(memory, i)
+    assert len(memory) == 3
+    assert memory.position == 2
+    assert memory.memory.reward.tolist() == [3, 4, 2]
+    assert memory.memory.next_state[:, 0].tolist() == [4, 5, 3]
+
+
+def test_extend_wraps_around_the_ring():
+    memory = ReplayMemory(4)
+    for i in range(3):
+        push(memory, i)
+    indices = memory.extend(*batch(3, 3))
+    assert isinstance(indices, torch.Tensor)
+    assert indices.tolist() == [3, 0, 1]
+    assert len(memory) == 4
+    assert memory.position == 2
+    assert memory.memory.reward.tolist() == [4, 5, 2, 3]
+    assert memory.memory.state[:, 1].tolist() == [-4, -5, -2, -3]
+    assert memory.memory.action[:, 0].tolist() == [4, 5, 2, 3]
+
+
+def test_sampled_rows_are_whole_transitions():
+    memory = ReplayMemory(8)
+    memory.extend(*batch(0, 5))
+    sample = memory.sample(64)
+    assert sample.state.shape == (64, 2)
+    assert (sample.reward < 5).all()
+    assert torch.equal(sample.state[:, 0], sample.reward)
+    assert torch.equal(sample.next_state[:, 0], sample.reward + 1)
+
+
+def test_shared_memory_samples_whole_transitions():
+    memory = SharedReplayMemory(4, state_dim=2, action_dim=1)
+    memory.extend(*batch(0, 6))
+    assert len(memory) == 4
+    assert memory.position == 2
+    sample = memory.sample(32)
+    assert torch.equal(sample.state[:, 0], sample.reward)
+    assert set(sample.reward.tolist()) <= {2, 3, 4, 5}
+
+
+def prioritized(priorities, **kwargs):
+    """Memory holding len(priorities) transitions with those priorities (alpha=1, no epsilon)"""
+    memory = PrioritizedReplayMemory(len(priorities), alpha=1.0, epsilon=0.0, **kwargs)
+    memory.extend(*batch(0, len(priorities)))
+    memory.update_priorities(np.arange(len(priorities)), priorities)
+    return memory
+
+
+def test_sample_indices_returns_a_tensor_like_the_base_class():
+    memory = prioritized([1.0, 2.0, 3.0, 4.0])
+    indices = memory.sample_indices(8)
+    assert isinstance(indices, torch.Tensor)
+    assert indices.dtype == torch.int64
+    assert indices.shape == (8,)
+    assert memory.sample_indices(8, num_batches=3).shape == (3, 8)
+    batch, weights, indices = memory.sample(8)
+    assert isinstance(indices, torch.Tensor)
+    assert torch.equal(batch.reward, indices.float())
+
+
+def test_stratified_sampling_is_proportional_to_priority():
+    np.random.seed(0)
+    priorities = np.array([1.0, 2.0, 3.0, 4.0, 0.0, 6.0])
+    memory = prioritized(priorities)
+    indices = memory.sample_indices(16, num_batches=2000).numpy().ravel()
+    frequencies = np.bincount(indices, minlength=len(priorities)) / float(len(indices))
+    assert frequencies[4] == 0
+    np.testing.assert_allclose(frequencies, priorities / priorities.sum(), atol=0.01)
+
+
+def test_update_priorities_propagates_to_the_root():
+    memory = prioritized([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert memory.sum_tree.reduce() == pytest.approx(15.0)
+    assert memory.min_tree.reduce() == pytest.approx(1.0)
+    memory.update_priorities([0, 3], [7.0, 0.5])
+    assert memory.sum_tree.reduce() == pytest.approx(7.0 + 2.0 + 3.0 + 0.5 + 5.0)
+    assert memory.min_tree.reduce() == pytest.approx(0.5)
+    assert memory.max_priority == pytest.approx(7.0)
+
+
+def test_trees_stay_consistent_after_the_ring_wraps():
+    memory = prioritized([1.0, 2.0, 3.0, 4.0])
+    # rows 0 and 1 are overwritten and start out at the highest priority seen
+    memory.extend(*batch(4, 2))
+    assert memory.sum_tree[np.arange(4)].tolist() == [4.0, 4.0, 3.0, 4.0]
+    assert memory.sum_tree.reduce() == pytest.approx(15.0)
+    assert memory.min_tree.reduce() == pytest.approx(3.0)
+    push(memory, 6)
+    assert memory.sum_tree.reduce() == pytest.approx(16.0)
+    assert memory.min_tree.reduce() == pytest.approx(4.0)
+    assert (memory.sample_indices(64).numpy() < 4).all()
+
+
+def test_importance_weights_are_normalized_by_the_max_weight():
+    priorities = np.array([1.0, 2.0, 4.0, 8.0])
+    memory = prioritized(priorities)
+    beta = 0.5
+    weights = memory._weights(torch.arange(4), beta)
+    # the lowest priority transition has the largest weight, which becomes 1
+    np.testing.assert_allclose(weights.numpy(), (priorities.min() / priorities) ** beta, rtol=1e-6)
+    _, weights, _ = memory.sample(32, beta)
+    assert weights.max() <= 1.0 + 1e-6
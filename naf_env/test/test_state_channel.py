@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from state_channel import FIELD_BITS, StateChannel, StateChannelWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = StateChannelWriter('channel', max_joints=3, max_upper=4, max_lower=2, shm_dir=str(tmp_path))
+    yield writer
+    writer.close()
+
+
+def state(i):
+    return dict(e=[i, -i], de=[0.5 * i, 0.0], q=[1.0, 2.0, 3.0], J_upper=np.arange(6.0).reshape(2, 3) + i)
+
+
+def test_round_trip(tmp_path, writer):
+    reader = StateChannel('channel', fields=['e', 'J_upper'], shm_dir=str(tmp_path))
+    assert reader.read() == 0
+    writer.write(0.1, action_seq=3, **state(1))
+    assert reader.read() == 1
+    assert reader.stamp == 0.1 and reader.action_seq == 3
+    np.testing.assert_array_equal(reader.get('e'), [1, -1])
+    np.testing.assert_array_equal(reader.get('J_upper'), state(1)['J_upper'])
+    assert reader.read() == 1  # nothing newer
+
+
+def test_readers_add_up_their_fields(tmp_path, writer):
+    full = StateChannel('channel', fields=['e', 'de', 'q'], shm_dir=str(tmp_path))
+    StateChannel('channel', fields=['e'], shm_dir=str(tmp_path))
+    assert int(writer.segment.header['subscribed_fields']) == full.mask
+    writer.write(0.1, **state(2))
+    assert full.read() == 1
+    np.testing.assert_array_equal(full.get('de'), [1.0, 0.0])
+
+
+def test_state_from_before_subscribing_is_skipped(tmp_path, writer):
+    first = StateChannel('channel', fields=['e'], shm_dir=str(tmp_path))
+    writer.write(0.1, **state(1))
+    writer.write(0.2, **state(2))
+    # both states above went out with only e, the next one has de as well
+    late = StateChannel('channel', fields=['e', 'de'], shm_dir=str(tmp_path))
+    assert late.read() == 0
+    writer.write(0.3, **state(3))
+    assert late.read() == 3
+    np.testing.assert_array_equal(late.get('de'), [1.5, 0.0])
+    assert first.read() == 3
+
+
+def test_missing_field_raises(tmp_path, writer):
+    reader = StateChannel('channel', fields=['e', 'ddq_star'], shm_dir=str(tmp_path))
+    writer.write(0.1, **state(1))  # the writer has no ddq_star to give
+    writer.write(0.2, **state(2))
+    with pytest.raises(IOError, match='ddq_star'):
+        reader.read()
+    assert reader.mask & FIELD_BITS['ddq_star']
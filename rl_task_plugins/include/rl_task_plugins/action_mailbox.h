@@ -0,0 +1,100 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_ACTION_MAILBOX_H
+#define HIQP_ACTION_MAILBOX_H
+
+#include <atomic>
+#include <stdint.h>
+#include <vector>
+
+#include <Eigen/Core>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Wait-free hand-over of the latest action from a ROS callback to the control loop.
+   *
+   *  A triple buffer: the writer fills its back buffer and swaps it with the
+   *  middle one, the reader swaps its front buffer with the middle one when
+   *  that holds a newer action. Neither side ever waits for the other or
+   *  allocates, and the reader always sees a complete action. Actions written
+   *  faster than they are read replace each other, only the newest counts.
+   *
+   *  There is one reader (the control loop) and one writer at a time; several
+   *  writer threads have to serialize their write() calls themselves. */
+    class ActionMailbox {
+    public:
+      ActionMailbox() {}
+
+      /*! Sets the action dimension and clears the mailbox. Allocates, so it is
+       *  not safe while reading or writing. */
+      void resize(unsigned int size) {
+        for (int i = 0; i < 3; i++) {
+          buffers_[i].values.assign(size, 0.0);
+          buffers_[i].seq = 0;
+        }
+        back_ = 0;
+        front_ = 1;
+        middle_.store(2, std::memory_order_release);
+      }
+
+      unsigned int size() const { return buffers_[0].values.size(); }
+
+      /*! Publishes an action of size() values, replacing any unread one. */
+      void write(const double *values, uint32_t seq) {
+        Buffer &buffer = buffers_[back_];
+        for (unsigned int i = 0; i < buffer.values.size(); i++) buffer.values[i] = values[i];
+        buffer.seq = seq;
+        back_ = middle_.exchange(back_ | FRESH, std::memory_order_acq_rel) & INDEX;
+      }
+
+      /*! Copies the newest unread action into values, which must have size()
+       *  rows, and its number into seq. Returns false, leaving both untouched,
+       *  if nothing new was written since the last read. */
+      bool read(Eigen::VectorXd &values, uint32_t &seq) {
+        if (!(middle_.load(std::memory_order_acquire) & FRESH)) return false;
+        front_ = middle_.exchange(front_, std::memory_order_acq_rel) & INDEX;
+        const Buffer &buffer = buffers_[front_];
+        for (unsigned int i = 0; i < buffer.values.size(); i++) values(i) = buffer.values[i];
+        seq = buffer.seq;
+        return true;
+      }
+
+    private:
+      ActionMailbox(const ActionMailbox &other) = delete;
+      ActionMailbox &operator=(const ActionMailbox &other) = delete;
+
+      static const unsigned int INDEX = 3;
+      static const unsigned int FRESH = 4;
+
+      struct Buffer {
+        std::vector<double> values;
+        uint32_t seq{0};
+      };
+
+      Buffer buffers_[3];
+      unsigned int back_{0}; //owned by the writer
+      unsigned int front_{1}; //owned by the reader
+      std::atomic<unsigned int> middle_{2}; //buffer index, plus FRESH when it holds an unread action
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
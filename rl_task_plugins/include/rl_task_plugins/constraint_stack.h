@@ -0,0 +1,91 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_CONSTRAINT_STACK_H
+#define HIQP_CONSTRAINT_STACK_H
+
+#include <Eigen/Core>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief The higher priority tasks as inequality constraints J*ddq <= b, in reused buffers.
+   *
+   *  Every task status row of a task with a priority below (numerically
+   *  lower than) the given one becomes one row, sign*J*ddq <= sign*(dde_star
+   *  - dJ*dq), or two rows of opposite signs for an equality (sign 0). The
+   *  statuses can be anything with the priority_, task_signs_, J_, dJ_ and
+   *  dde_star_ members of hiqp::TaskStatus.
+   *
+   *  J and b keep their storage between updates and are only reallocated
+   *  when the number of rows or joints changes, i.e. when tasks are added
+   *  or removed. The rows are counted before they are filled so that J
+   *  stays one contiguous column-major matrix. */
+    class ConstraintStack {
+    public:
+      template <typename TaskStatusIterator>
+      void update(TaskStatusIterator begin, TaskStatusIterator end, unsigned int priority,
+                  const Eigen::VectorXd &dq) {
+        int rows = 0;
+        for (TaskStatusIterator it = begin; it != end; ++it) {
+          if (it->priority_ >= priority) continue;
+          for (size_t i = 0; i < it->task_signs_.size(); i++) rows += (it->task_signs_[i] != 0) ? 1 : 2;
+        }
+        if (rows != J_.rows() || dq.rows() != J_.cols()) {
+          J_.resize(rows, dq.rows());
+          b_.resize(rows);
+          num_resizes_++;
+        }
+
+        int nt = 0;
+        for (TaskStatusIterator it = begin; it != end; ++it) {
+          if (it->priority_ >= priority) continue;
+          for (size_t i = 0; i < it->task_signs_.size(); i++) {
+            double sign = it->task_signs_[i];
+            double rhs = it->dde_star_(i) - it->dJ_.row(i).dot(dq);
+            if (sign != 0) {
+              J_.row(nt) = sign * it->J_.row(i);
+              b_(nt) = sign * rhs;
+              nt++;
+            } else {
+              J_.row(nt) = it->J_.row(i);
+              b_(nt) = rhs;
+              J_.row(nt + 1) = -it->J_.row(i);
+              b_(nt + 1) = -rhs;
+              nt += 2;
+            }
+          }
+        }
+      }
+
+      const Eigen::MatrixXd &J() const { return J_; }
+      const Eigen::VectorXd &b() const { return b_; }
+      unsigned int rows() const { return J_.rows(); }
+      //times the buffers were reallocated, once per change of the task set
+      unsigned int numResizes() const { return num_resizes_; }
+
+    private:
+      Eigen::MatrixXd J_;
+      Eigen::VectorXd b_;
+      unsigned int num_resizes_{0};
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
@@ -0,0 +1,108 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_KINEMATICS_CACHE_H
+#define HIQP_KINEMATICS_CACHE_H
+
+#include <memory>
+#include <mutex>
+#include <stdint.h>
+#include <string>
+#include <vector>
+
+#include <kdl/frames.hpp>
+#include <kdl/jacobian.hpp>
+#include <kdl/jntarrayvel.hpp>
+#include <kdl/tree.hpp>
+#include <kdl/treefksolverpos_recursive.hpp>
+#include <kdl/treejnttojacsolver.hpp>
+
+#include <Eigen/Core>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Pose, Jacobian and Jacobian derivative of tree frames, computed once per control tick.
+   *
+   *  There is one cache per KDL tree, i.e. per robot state, shared by all
+   *  the tasks that get() it. Tasks register the frames they need in init
+   *  and ask for their kinematics in update; the first task asking for a
+   *  frame in a tick computes it, the others get the stored result. A tick
+   *  is a change of the joint positions or velocities, so the results are
+   *  exactly what each task would have computed itself.
+   *
+   *  Frames are created in init and never move, so update only touches
+   *  the Frame it holds. Like the tasks, a cache is updated from one
+   *  control loop at a time. */
+    class KinematicsCache {
+    public:
+      struct Frame {
+        std::string frame_id;
+        KDL::Frame pose;
+        KDL::Jacobian jacobian; ///< w.r.t. the frame origin, unmasked
+        KDL::Jacobian jacobian_dot;
+
+      private:
+        friend class KinematicsCache;
+        uint64_t pose_tick{0}, jacobian_tick{0}, jacobian_dot_tick{0};
+        int pose_status{0}, jacobian_status{0}, jacobian_dot_status{0};
+      };
+
+      /*! The cache of this tree, created on first use. Not realtime safe. */
+      static std::shared_ptr<KinematicsCache> get(const KDL::Tree &tree);
+
+      explicit KinematicsCache(const KDL::Tree &tree);
+
+      /*! The shared entry of frame_id, with its Jacobians sized for n_joints.
+       *  Call in init, not realtime safe. */
+      Frame *frame(const std::string &frame_id, unsigned int n_joints);
+
+      /*! Each returns the KDL error code of the solver, 0 on success, and
+       *  computes the quantity only on the first call of a tick. */
+      int pose(Frame *frame, const KDL::JntArrayVel &state);
+      int jacobian(Frame *frame, const KDL::JntArrayVel &state);
+      int jacobianDot(Frame *frame, const KDL::JntArrayVel &state);
+
+      uint64_t tick() const { return tick_; }
+      //quantities computed and served from the cache, for profiling
+      uint64_t numComputed() const { return num_computed_; }
+      uint64_t numReused() const { return num_reused_; }
+
+    private:
+      KinematicsCache(const KinematicsCache &other) = delete;
+      KinematicsCache &operator=(const KinematicsCache &other) = delete;
+
+      void advance(const KDL::JntArrayVel &state);
+
+      const KDL::Tree &tree_;
+      KDL::TreeFkSolverPos_recursive fk_solver_pos_;
+      KDL::TreeJntToJacSolver fk_solver_jac_;
+
+      std::mutex frames_lock_;
+      std::vector<std::unique_ptr<Frame> > frames_;
+
+      //joint state of the current tick
+      Eigen::VectorXd q_, qdot_;
+      uint64_t tick_{0};
+      uint64_t num_computed_{0}, num_reused_{0};
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
@@ -0,0 +1,79 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_MLP_POLICY_H
+#define HIQP_MLP_POLICY_H
+
+#include <stdint.h>
+#include <string>
+#include <vector>
+
+#include <Eigen/Core>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Feed-forward policy exported by naf_env (InferencePolicy.export).
+   *
+   *  The weight file is little-endian: the magic "NAFP", uint32 version and
+   *  number of layers, then per layer uint32 outputs, inputs and activation
+   *  followed by the float32 weights (outputs x inputs, row-major) and
+   *  biases. For a NAF Policy these are the mu head with the input
+   *  BatchNorm folded into the first layer.
+   *
+   *  evaluate() computes in float like the Python side and never
+   *  allocates, so it can run in the control loop. */
+    class MlpPolicy {
+    public:
+      enum Activation {
+        NONE = 0,
+        TANH = 1
+      };
+
+      static const uint32_t VERSION = 1;
+
+      MlpPolicy() {}
+
+      /*! Reads a weight file, returns false and sets error if it is not a valid one. */
+      bool load(const std::string &path, std::string &error);
+
+      bool isLoaded() const { return !layers_.empty(); }
+      unsigned int inputSize() const { return isLoaded() ? layers_.front().weight.cols() : 0; }
+      unsigned int outputSize() const { return isLoaded() ? layers_.back().weight.rows() : 0; }
+
+      /*! output = policy(input), both sized inputSize() and outputSize(). */
+      void evaluate(const Eigen::VectorXd &input, Eigen::VectorXd &output);
+
+    private:
+      typedef Eigen::Matrix<float, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor> Weights;
+
+      struct Layer {
+        Weights weight;
+        Eigen::VectorXf bias;
+        uint32_t activation;
+        Eigen::VectorXf output; ///< preallocated activations
+      };
+
+      std::vector<Layer> layers_;
+      Eigen::VectorXf input_;
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
@@ -0,0 +1,123 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#ifndef HIQP_STATE_CHANNEL_H
+#define HIQP_STATE_CHANNEL_H
+
+#include <cstddef>
+#include <stdint.h>
+#include <string>
+
+#include <Eigen/Core>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Fixed layout shared memory ring carrying the StateMsg fields.
+   *
+   *  The segment (/dev/shm/<name>) starts with a 64 byte StateChannelHeader
+   *  followed by num_slots slots. Every slot is a 40 byte
+   *  StateChannelSlotHeader followed by the fields as doubles, in the order
+   *  of the Field enum, each reserved at its maximum size. Matrices are
+   *  stored column-major, as Eigen keeps them.
+   *
+   *  Every slot is a seqlock: its seq is odd while the writer fills it and
+   *  2*(k+1) once write number k is complete, after which write_count in the
+   *  header becomes k+1. Readers check seq before and after copying to detect
+   *  torn or overwritten reads. Readers store the fields they need in
+   *  subscribed_fields and the writer skips the others (0 means all).
+   *  naf_env/src/state_channel.py implements the Python side. */
+    class StateChannel {
+    public:
+      enum Field {
+        E = 1 << 0,
+        DE = 1 << 1,
+        Q = 1 << 2,
+        DQ = 1 << 3,
+        DDQ_STAR = 1 << 4,
+        J_UPPER = 1 << 5,
+        J_LOWER = 1 << 6,
+        B_UPPER = 1 << 7,
+        RHS_FIXED_TERM = 1 << 8,
+        ALL_FIELDS = (1 << 9) - 1
+      };
+
+      static const uint32_t MAGIC = 0x54534c52; // "RLST"
+      static const uint32_t VERSION = 2;
+
+      StateChannel() {}
+      ~StateChannel() { close(); }
+
+      /*! Creates (or re-creates) the shared memory segment. */
+      bool open(const std::string &name, unsigned int num_slots, unsigned int max_joints,
+                unsigned int max_upper, unsigned int max_lower);
+      void close();
+      bool isOpen() const { return base_ != nullptr; }
+
+      /*! Copies one state into the next slot. Never blocks and never allocates;
+       *  fields larger than the reserved space are dropped from the slot. */
+      void write(double stamp, uint32_t action_seq, const Eigen::VectorXd &e, const Eigen::VectorXd &de,
+                 const Eigen::VectorXd &q, const Eigen::VectorXd &dq, const Eigen::VectorXd &ddq_star,
+                 const Eigen::MatrixXd &J_upper, const Eigen::MatrixXd &J_lower,
+                 const Eigen::VectorXd &b_upper, const Eigen::VectorXd &rhs_fixed_term);
+
+    private:
+      StateChannel(const StateChannel &other) = delete;
+      StateChannel &operator=(const StateChannel &other) = delete;
+
+      struct StateChannelHeader {
+        uint32_t magic;
+        uint32_t version;
+        uint32_t num_slots;
+        uint32_t max_joints;
+        uint32_t max_upper;
+        uint32_t max_lower;
+        uint32_t subscribed_fields;
+        uint32_t pad;
+        uint64_t write_count;
+        uint64_t reserved[3];
+      };
+
+      struct StateChannelSlotHeader {
+        uint64_t seq;
+        double stamp;
+        uint32_t n_joints;
+        uint32_t n_upper;
+        uint32_t n_lower;
+        uint32_t fields;
+        uint32_t action_seq;
+        uint32_t pad;
+      };
+
+      void copyField(double *data, Field field, const double *src, size_t size, uint32_t mask,
+                     uint32_t &fields) const;
+
+      std::string name_;
+      void *base_{nullptr};
+      size_t size_{0};
+      size_t slot_size_{0};
+      size_t offsets_[9];
+      size_t capacities_[9];
+      StateChannelHeader *header_{nullptr};
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
@@ -18,8 +18,7 @@
 
 #include <hiqp/robot_state.h>
 #include <hiqp/task_definition.h>
-#include <kdl/treefksolverpos_recursive.hpp>
-#include <kdl/treejnttojacsolver.hpp>
+#include <rl_task_plugins/kinematics_cache.h>
 
 #include <rl_task_plugins/Act.h>
 #include <ros/ros.h>
@@ -64,14 +63,11 @@ private:
 
     Eigen::VectorXd qdot_,qddot_;
 
-    //internal solver objects
-    KDL::Frame pose_a_;        ///pose of the target_point_ frame
-    KDL::Jacobian jacobian_a_; ///< tree jacobian w.r.t. the center of the frame
-                                ///TDefGeometricProjection::pose_a_
-    KDL::Jacobian jacobian_dot_a_;
-
-    std::shared_ptr<KDL::TreeFkSolverPos_recursive> fk_solver_pos_;
-    std::shared_ptr<KDL::TreeJntToJacSolver> fk_solver_jac_;
+    //pose and Jacobians of the target_point_ frame, shared with the other tasks on it
+    std::shared_ptr<KinematicsCache> kinematics_;
+    KinematicsCache::Frame *frame_{nullptr};
+    //the Jacobians moved to the target point, sized in init
+    KDL::Jacobian J_p1k_, J_dot_p1k_;
 
     void maskJacobian(RobotStatePtr robot_state){
         for (unsigned int c = 0; c < robot_state->getNumJoints(); ++c) {
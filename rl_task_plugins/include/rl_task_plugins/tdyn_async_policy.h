@@ -31,10 +31,17 @@
 #include <iostream>
 #include <stdio.h>
 #include <chrono>
+#include <atomic>
+#include <memory>
 
 #include <rl_task_plugins/DesiredErrorDynamicsMsg.h>
 #include <rl_task_plugins/StateMsg.h>
+#include <rl_task_plugins/state_channel.h>
+#include <rl_task_plugins/action_mailbox.h>
+#include <rl_task_plugins/constraint_stack.h>
+#include <rl_task_plugins/update_gate.h>
 
+#include <realtime_tools/realtime_publisher.h>
 #include <boost/thread/mutex.hpp>
 
 namespace hiqp
@@ -42,17 +49,26 @@ namespace hiqp
   namespace tasks
   {
 
-  /*! \brief Random task error behavior? 
+  /*! \brief Task error acceleration set by an external policy over ROS.
+   *
+   *  update() runs in the control loop without taking locks: actions arrive
+   *  through a wait-free ActionMailbox, the constraint and state buffers are
+   *  reused and only reallocated when the task set changes, and states go
+   *  out through a RealtimePublisher or the StateChannel. It is not fully
+   *  realtime safe, though: the TaskDefinition getters of hiqp return the
+   *  task value, its derivative, the Jacobian and its derivative by value,
+   *  which costs 4 heap allocations per cycle that only hiqp_core can avoid.
+   *  init() waits for a running update() before it changes anything.
    *  \author Jens Lundell, Todor Stoyanov */  
     class TDynAsyncPolicy : public TaskDynamics {
     public:
 
-      inline TDynAsyncPolicy() : TaskDynamics() { ROS_INFO("creating object TDynPolicy"); initialized_=false;}
+      inline TDynAsyncPolicy() : TaskDynamics() { ROS_INFO("creating object TDynPolicy"); }
       
       TDynAsyncPolicy(std::shared_ptr<GeometricPrimitiveMap> geom_prim_map,
        std::shared_ptr<Visualizer> visualizer);
 
-      ~TDynAsyncPolicy() noexcept { ROS_INFO("Destroying object TDynPolicy"); nh_.shutdown(); initialized_=false; }
+      ~TDynAsyncPolicy() noexcept { ROS_INFO("Destroying object TDynPolicy"); nh_.shutdown(); initialized_.close(); }
 
       int init(const std::vector<std::string>& parameters, 
               RobotStatePtr robot_state, 
@@ -78,16 +94,35 @@ namespace hiqp
       float damping_{1.0};
       unsigned int publish_rate_{100}; 
       ros::Time last_publish_;
+      //seq of the last applied action and of the last state sent, a newly
+      //applied action is reported right away instead of at publish_rate_
+      uint32_t action_seq_{0};
+      uint32_t published_action_seq_{0};
+      uint32_t state_seq_{0};
       Eigen::VectorXd desired_dynamics_;
       ros::Subscriber act_sub_;
-      ros::Publisher state_pub_;
-      bool initialized_{false};
+      std::unique_ptr<realtime_tools::RealtimePublisher<rl_task_plugins::StateMsg> > state_pub_;
+      //open once init() succeeded, closed while it runs, so a re-init never
+      //replaces state_pub_ or resizes the buffers under a running update()
+      UpdateGate initialized_;
+
+      //latest action from handleActMessage, read once per control cycle
+      ActionMailbox actions_;
+      //higher priority tasks as constraints, reused every cycle
+      ConstraintStack constraints_;
+      Eigen::VectorXd rhs_fixed_term_;
+
+      //optional shared memory channel replacing the StateMsg topic
+      StateChannel state_channel_;
+      unsigned int state_channel_slots_{8};
+      unsigned int state_channel_max_constraints_{64};
     
       void handleActMessage(const rl_task_plugins::DesiredErrorDynamicsMsgConstPtr &act_msg);
       void publishStateMessage(const Eigen::VectorXd &error);
 
       ros::NodeHandle nh_;
 
+      //serializes init and the ROS callbacks, never taken in update
       boost::mutex update_lock_;
 
     };
@@ -0,0 +1,117 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_TDYN_NAF_POLICY_H
+#define HIQP_TDYN_NAF_POLICY_H
+
+#include <hiqp/robot_state.h>
+#include <hiqp/task_dynamics.h>
+#include <ros/ros.h>
+
+#include <atomic>
+#include <condition_variable>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <sys/stat.h>
+
+#include <rl_task_plugins/mlp_policy.h>
+#include <rl_task_plugins/update_gate.h>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Task error acceleration from a NAF policy evaluated in the controller.
+   *
+   *  Does what TDynAsyncPolicy and naf_env do together, without the round
+   *  trip over ROS: every update() the observation goal - e goes through
+   *  the policy exported by naf_env/src/export_policy.py and
+   *  e_ddot_star = action_scale * mu - damping * e_dot. Parameters:
+   *
+   *    TDynNAFPolicy damping weight_file action_scale goal_1 ... goal_n
+   *
+   *  with n the task dimension. A thread watches the weight file and loads
+   *  it again whenever it is replaced; update() picks the new policy up
+   *  without locking or allocating. Until a valid file exists the task
+   *  holds e_ddot_star = -damping * e_dot. */
+    class TDynNAFPolicy : public TaskDynamics {
+    public:
+
+      inline TDynNAFPolicy() : TaskDynamics() {}
+
+      TDynNAFPolicy(std::shared_ptr<GeometricPrimitiveMap> geom_prim_map,
+       std::shared_ptr<Visualizer> visualizer);
+
+      ~TDynNAFPolicy() noexcept;
+
+      int init(const std::vector<std::string>& parameters, 
+              RobotStatePtr robot_state, 
+              const Eigen::VectorXd& e_initial, 
+              const Eigen::VectorXd& e_dot_initial, 
+              const Eigen::VectorXd& e_final, 
+              const Eigen::VectorXd& e_dot_final);
+
+      int update(const RobotStatePtr robot_state, 
+                const  TaskDefinitionPtr def);
+
+      int monitor();
+
+    private:
+      TDynNAFPolicy(const TDynNAFPolicy& other) = delete;
+      TDynNAFPolicy(TDynNAFPolicy&& other) = delete;
+      TDynNAFPolicy& operator=(const TDynNAFPolicy& other) = delete;
+      TDynNAFPolicy& operator=(TDynNAFPolicy&& other) noexcept = delete;
+
+      /*! Loads the weight file if it changed since the last attempt, returns the new policy or nullptr. */
+      MlpPolicy *loadIfChanged();
+      void watchWeights();
+      void stopWatching();
+
+      double damping_{1.0};
+      double action_scale_{1.0};
+      std::string weights_path_;
+      double reload_period_{0.5}; //seconds between checks of the weight file
+      Eigen::VectorXd goal_;
+      Eigen::VectorXd observation_;
+      Eigen::VectorXd action_;
+      Eigen::VectorXd desired_dynamics_;
+      //open once init() succeeded, closed while it runs
+      UpdateGate initialized_;
+
+      //the policy update() evaluates, owned by the control loop
+      MlpPolicy *active_{nullptr};
+      //a newly loaded policy waiting for update(), and the one it replaced
+      //waiting for the watcher to delete it, so update() never frees memory
+      std::atomic<MlpPolicy *> pending_{nullptr};
+      std::atomic<MlpPolicy *> retired_{nullptr};
+
+      //identity of the last weight file seen, a rename gives a new inode
+      ino_t weights_ino_{0};
+      struct timespec weights_mtime_{0, 0};
+      off_t weights_size_{-1};
+
+      std::thread watcher_;
+      std::mutex watch_lock_;
+      std::condition_variable watch_cv_;
+      bool stop_{false};
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
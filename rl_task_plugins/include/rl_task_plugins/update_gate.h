@@ -0,0 +1,89 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#ifndef HIQP_UPDATE_GATE_H
+#define HIQP_UPDATE_GATE_H
+
+#include <atomic>
+#include <thread>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+  /*! \brief Keeps init() from changing a task dynamics while its update() runs.
+   *
+   *  update() holds a Pass for its whole run, which is only granted while the
+   *  gate is open. init() calls close(), which waits for a running update()
+   *  to return, then changes whatever update() uses and calls open() to
+   *  publish it. update() never waits: while the gate is closed its Pass is
+   *  refused and it returns. There is one update() caller at a time. */
+    class UpdateGate {
+    public:
+      UpdateGate() {}
+
+      class Pass {
+      public:
+        /*! update() marks itself busy before it looks at the gate and init()
+         *  closes the gate before it looks at busy_. Both are sequentially
+         *  consistent, so at least one of them sees the other: either the
+         *  pass is refused or close() waits for it. */
+        explicit Pass(UpdateGate &gate) : gate_(gate) {
+          gate_.busy_.store(true);
+          granted_ = gate_.open_.load();
+          if (!granted_) gate_.busy_.store(false, std::memory_order_release);
+        }
+
+        ~Pass() {
+          if (granted_) gate_.busy_.store(false, std::memory_order_release);
+        }
+
+        explicit operator bool() const { return granted_; }
+
+      private:
+        Pass(const Pass &other) = delete;
+        Pass &operator=(const Pass &other) = delete;
+
+        UpdateGate &gate_;
+        bool granted_;
+      };
+
+      bool isOpen() const { return open_.load(std::memory_order_acquire); }
+
+      /*! Publishes everything written since close() to the next update(). */
+      void open() { open_.store(true, std::memory_order_release); }
+
+      /*! Refuses new passes and waits until a running update() returned. */
+      void close() {
+        open_.store(false);
+        //sequentially consistent like the store above, acquire alone would let
+        //this load and the pass's load of open_ both miss the other side's store
+        while (busy_.load()) std::this_thread::yield();
+      }
+
+    private:
+      UpdateGate(const UpdateGate &other) = delete;
+      UpdateGate &operator=(const UpdateGate &other) = delete;
+
+      std::atomic<bool> open_{false};
+      std::atomic<bool> busy_{false};
+    };
+
+} // namespace tasks
+
+} // namespace hiqp
+
+#endif // include guard
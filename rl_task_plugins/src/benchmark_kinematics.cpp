@@ -0,0 +1,193 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+/*! Per-tick kinematics time of the RL task definitions with and without the
+ *  shared KinematicsCache, on a 7 joint chain and without ROS:
+ *
+ *    rosrun rl_task_plugins rl_task_plugins_benchmark_kinematics --ticks 20000 --tasks 1 2 3
+ *
+ *  Every task needs the pose, Jacobian and Jacobian derivative of the same
+ *  end-effector frame and moves the Jacobians to its target point, as
+ *  TDefRL2DSpace and TDefRLPick do. "separate" is how they worked before,
+ *  each with its own solvers; "cached" shares one KinematicsCache. The
+ *  joints move every tick, so every tick computes the kinematics once. */
+
+#include <rl_task_plugins/kinematics_cache.h>
+
+#include <hiqp/utilities.h>
+
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <memory>
+#include <string>
+#include <vector>
+
+#include <kdl/tree.hpp>
+
+namespace
+{
+  using namespace hiqp;
+  using namespace hiqp::tasks;
+  typedef std::chrono::steady_clock Clock;
+
+  const char *EE_FRAME = "link7";
+
+  //a Panda-like arm, revolute joints about alternating axes
+  KDL::Tree makeTree() {
+    KDL::Tree tree("base");
+    const double lengths[7] = {0.333, 0.0, 0.316, 0.0825, 0.384, 0.0, 0.107};
+    std::string parent = "base";
+    for (int i = 0; i < 7; i++) {
+      std::string name = "link" + std::to_string(i + 1);
+      KDL::Joint joint("joint" + std::to_string(i + 1), (i % 2 == 0) ? KDL::Joint::RotZ : KDL::Joint::RotY);
+      tree.addSegment(KDL::Segment(name, joint, KDL::Frame(KDL::Vector(0.05 * (i % 3), 0.0, lengths[i]))), parent);
+      parent = name;
+    }
+    return tree;
+  }
+
+  //moves the frame Jacobians to a point on the end effector, the part of the
+  //task update that stays per task
+  struct TaskOutput {
+    KDL::Jacobian J_p1k, J_dot_p1k;
+    double checksum{0};
+
+    explicit TaskOutput(unsigned int n_joints) : J_p1k(n_joints), J_dot_p1k(n_joints) {}
+
+    void use(const KDL::Frame &pose, const KDL::Jacobian &jacobian, const KDL::Jacobian &jacobian_dot,
+             const KDL::JntArrayVel &state) {
+      KDL::Vector p1__ = pose.M * KDL::Vector(0.0, 0.0, 0.1);
+      changeJacRefPoint(jacobian, p1__, J_p1k);
+      changeJacDotRefPoint(jacobian, jacobian_dot, state, p1__, J_dot_p1k);
+      checksum += (pose.p + p1__).x() + J_p1k.data(0, 0) + J_dot_p1k.data(0, 0);
+    }
+  };
+
+  //what every task did before: own solvers, Jacobians resized every update
+  struct SeparateTask {
+    KDL::TreeFkSolverPos_recursive fk_solver_pos;
+    KDL::TreeJntToJacSolver fk_solver_jac;
+    KDL::Frame pose;
+    KDL::Jacobian jacobian, jacobian_dot;
+    TaskOutput output;
+
+    SeparateTask(const KDL::Tree &tree, unsigned int n_joints)
+    : fk_solver_pos(tree), fk_solver_jac(tree), output(n_joints) {}
+
+    int update(const KDL::Tree &tree, const KDL::JntArrayVel &state) {
+      if (fk_solver_pos.JntToCart(state.q, pose, EE_FRAME) != 0) return -1;
+      jacobian.resize(state.q.rows());
+      if (fk_solver_jac.JntToJac(state.q, jacobian, EE_FRAME) != 0) return -3;
+      jacobian_dot.resize(state.q.rows());
+      if (treeJntToJacDot(tree, jacobian, state, jacobian_dot, EE_FRAME) != 0) return -5;
+      output.use(pose, jacobian, jacobian_dot, state);
+      return 0;
+    }
+  };
+
+  struct CachedTask {
+    std::shared_ptr<KinematicsCache> kinematics;
+    KinematicsCache::Frame *frame;
+    TaskOutput output;
+
+    CachedTask(const KDL::Tree &tree, unsigned int n_joints)
+    : kinematics(KinematicsCache::get(tree)), frame(kinematics->frame(EE_FRAME, n_joints)), output(n_joints) {}
+
+    int update(const KDL::Tree &tree, const KDL::JntArrayVel &state) {
+      if (kinematics->pose(frame, state) != 0) return -1;
+      if (kinematics->jacobian(frame, state) != 0) return -3;
+      if (kinematics->jacobianDot(frame, state) != 0) return -5;
+      output.use(frame->pose, frame->jacobian, frame->jacobian_dot, state);
+      return 0;
+    }
+  };
+
+  struct Stats {
+    double mean, p50, p99, max;
+  };
+
+  //microseconds per tick of all tasks updating on a moving joint state
+  template <typename Task>
+  Stats run(const KDL::Tree &tree, int num_tasks, long ticks, double &checksum) {
+    unsigned int n_joints = tree.getNrOfJoints();
+    std::vector<std::unique_ptr<Task> > tasks;
+    for (int i = 0; i < num_tasks; i++) tasks.push_back(std::unique_ptr<Task>(new Task(tree, n_joints)));
+    KDL::JntArrayVel state(n_joints);
+    std::vector<double> times(ticks);
+    for (long t = 0; t < ticks; t++) {
+      for (unsigned int j = 0; j < n_joints; j++) {
+        state.q(j) = 0.5 * std::sin(1e-3 * t + j);
+        state.qdot(j) = 0.5e-3 * std::cos(1e-3 * t + j);
+      }
+      auto t_start = Clock::now();
+      for (auto &task : tasks) {
+        if (task->update(tree, state) != 0) {
+          fprintf(stderr, "kinematics of %s failed\n", EE_FRAME);
+          std::exit(1);
+        }
+      }
+      times[t] = std::chrono::duration<double, std::micro>(Clock::now() - t_start).count();
+    }
+    for (auto &task : tasks) checksum += task->output.checksum;
+
+    Stats stats;
+    stats.mean = 0;
+    for (double t : times) stats.mean += t / times.size();
+    std::sort(times.begin(), times.end());
+    stats.p50 = times[times.size() / 2];
+    stats.p99 = times[std::min(times.size() - 1, (size_t) (0.99 * times.size()))];
+    stats.max = times.back();
+    return stats;
+  }
+
+} // namespace
+
+int main(int argc, char **argv) {
+  long ticks = 20000;
+  std::vector<int> num_tasks;
+  for (int i = 1; i < argc; i++) {
+    std::string name = argv[i];
+    if (name == "--ticks" && i + 1 < argc) {
+      ticks = std::atol(argv[++i]);
+    } else if (name == "--tasks") {
+      while (i + 1 < argc && argv[i + 1][0] != '-') num_tasks.push_back(std::atoi(argv[++i]));
+    } else {
+      fprintf(stderr, "usage: %s [--ticks N] [--tasks N [N ...]]\n", argv[0]);
+      return 1;
+    }
+  }
+  if (num_tasks.empty()) num_tasks = {1, 2, 3};
+
+  KDL::Tree tree = makeTree();
+  printf("%ld ticks, %u joints, all tasks on %s\n", ticks, tree.getNrOfJoints(), EE_FRAME);
+  printf("%6s %10s %18s %18s %9s\n", "tasks", "", "mean/p50/p99 us", "max us", "speedup");
+  for (int n : num_tasks) {
+    double separate_sum = 0, cached_sum = 0;
+    Stats separate = run<SeparateTask>(tree, n, ticks, separate_sum);
+    Stats cached = run<CachedTask>(tree, n, ticks, cached_sum);
+    if (std::abs(separate_sum - cached_sum) > 1e-6 * std::abs(separate_sum)) {
+      fprintf(stderr, "cached kinematics differ from the separate ones\n");
+      return 1;
+    }
+    printf("%6d %10s %6.2f/%5.2f/%5.2f %18.2f\n", n, "separate", separate.mean, separate.p50, separate.p99,
+           separate.max);
+    printf("%6d %10s %6.2f/%5.2f/%5.2f %18.2f %8.2fx\n", n, "cached", cached.mean, cached.p50, cached.p99,
+           cached.max, separate.mean / cached.mean);
+  }
+  return 0;
+}
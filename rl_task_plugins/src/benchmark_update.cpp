@@ -0,0 +1,345 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+/*! Per-cycle time, jitter and heap allocations of the TDynAsyncPolicy::update
+ *  work on synthetic task statuses, without ROS or a robot:
+ *
+ *    rosrun rl_task_plugins rl_task_plugins_benchmark_update --cycles 100000 --tasks 4 --rows 3 --joints 7
+ *
+ *  "allocating" is the update as it was, fresh matrices, copies and a mutex
+ *  shared with the action callback; "realtime" is the current one,
+ *  ConstraintStack, ActionMailbox and preallocated message buffers. A writer
+ *  thread delivers actions at --action_rate Hz to both. With --period_us the
+ *  cycles are paced like a control loop instead of running back to back.
+ *  The 4 allocations per cycle left in "realtime" are the copies returned by
+ *  the TaskDefinition getters, which both variants pay. */
+
+#include <rl_task_plugins/action_mailbox.h>
+#include <rl_task_plugins/constraint_stack.h>
+#include <rl_task_plugins/update_gate.h>
+
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+#include <Eigen/Core>
+
+//heap allocations of the thread being measured, Eigen and operator new both end up in malloc (glibc)
+extern "C" void *__libc_malloc(size_t size);
+static thread_local bool count_allocations = false;
+static thread_local unsigned long num_allocations = 0;
+
+extern "C" void *malloc(size_t size) {
+  if (count_allocations) num_allocations++;
+  return __libc_malloc(size);
+}
+
+namespace
+{
+  using namespace hiqp::tasks;
+  typedef std::chrono::steady_clock Clock;
+
+  //the members of hiqp::TaskStatus that update reads
+  struct SyntheticTaskStatus {
+    unsigned int priority_;
+    std::vector<int> task_signs_;
+    Eigen::MatrixXd J_;
+    Eigen::MatrixXd dJ_;
+    Eigen::VectorXd dde_star_;
+  };
+
+  //what the robot state and the task definition hand to update
+  struct SyntheticState {
+    std::vector<SyntheticTaskStatus> task_status_map_;
+    Eigen::VectorXd q, qdot, ddq_star, e, de;
+    Eigen::MatrixXd J_lower, J_dot;
+    unsigned int priority;
+  };
+
+  //stand-in for the StateMsg arrays
+  struct StateBuffers {
+    std::vector<double> e, de, q, dq, ddq_star, J_upper, J_lower, b_upper, rhs_fixed_term;
+  };
+
+  SyntheticState makeState(int tasks, int rows, int joints, int lower) {
+    SyntheticState state;
+    for (int t = 0; t < tasks; t++) {
+      SyntheticTaskStatus status;
+      status.priority_ = 1;
+      for (int i = 0; i < rows; i++) status.task_signs_.push_back((i + t) % 3 - 1);
+      status.J_ = Eigen::MatrixXd::Random(rows, joints);
+      status.dJ_ = Eigen::MatrixXd::Random(rows, joints);
+      status.dde_star_ = Eigen::VectorXd::Random(rows);
+      state.task_status_map_.push_back(status);
+    }
+    state.q = Eigen::VectorXd::Random(joints);
+    state.qdot = Eigen::VectorXd::Random(joints);
+    state.ddq_star = Eigen::VectorXd::Random(joints);
+    state.e = Eigen::VectorXd::Random(lower);
+    state.de = Eigen::VectorXd::Random(lower);
+    state.J_lower = Eigen::MatrixXd::Random(lower, joints);
+    state.J_dot = Eigen::MatrixXd::Random(lower, joints);
+    state.priority = 2;
+    return state;
+  }
+
+  //TaskDefinition returns its matrices by value, both variants pay for that
+  Eigen::MatrixXd getJacobian(const SyntheticState &s) { return s.J_lower; }
+  Eigen::MatrixXd getJacobianDerivative(const SyntheticState &s) { return s.J_dot; }
+  Eigen::VectorXd getTaskValue(const SyntheticState &s) { return s.e; }
+  Eigen::VectorXd getTaskDerivative(const SyntheticState &s) { return s.de; }
+
+  //the constraint assembly update used to do, fresh matrices every call
+  void buildConstraints(const SyntheticState &s, const Eigen::VectorXd &qdot, Eigen::MatrixXd &J_upper,
+                        Eigen::VectorXd &rhs) {
+    int tasks_dim = 0;
+    for (auto it = s.task_status_map_.begin(); it != s.task_status_map_.end(); it++) {
+      if (it->priority_ >= s.priority) continue;
+      for (int i = 0; i < it->task_signs_.size(); i++) tasks_dim += (it->task_signs_[i] != 0) ? 1 : 2;
+    }
+    J_upper = Eigen::MatrixXd(tasks_dim, qdot.rows());
+    rhs = Eigen::VectorXd(tasks_dim);
+    int nt = 0;
+    for (auto it = s.task_status_map_.begin(); it != s.task_status_map_.end(); it++) {
+      if (it->priority_ >= s.priority) continue;
+      for (int i = 0; i < it->task_signs_.size(); i++) {
+        int task_sign = it->task_signs_[i];
+        if (task_sign != 0) {
+          J_upper.row(nt) = ((double) task_sign) * it->J_.row(i);
+          rhs(nt) = ((double) task_sign) * (it->dde_star_(i) - it->dJ_.row(i).dot(qdot));
+          nt++;
+        } else {
+          J_upper.row(nt) = it->J_.row(i);
+          rhs(nt) = (it->dde_star_(i) - it->dJ_.row(i).dot(qdot));
+          J_upper.row(nt + 1) = (-1) * it->J_.row(i);
+          rhs(nt + 1) = (-1) * (it->dde_star_(i) - it->dJ_.row(i).dot(qdot));
+          nt += 2;
+        }
+      }
+    }
+  }
+
+  struct Allocating {
+    std::mutex lock;
+    Eigen::VectorXd desired_dynamics, e_ddot_star;
+    uint32_t action_seq{0};
+    double checksum{0};
+
+    void init(unsigned int lower) {
+      desired_dynamics = Eigen::VectorXd::Zero(lower);
+      e_ddot_star = Eigen::VectorXd::Zero(lower);
+    }
+
+    void act(const std::vector<double> &action, uint32_t seq) {
+      std::lock_guard<std::mutex> guard(lock);
+      for (unsigned int i = 0; i < action.size(); i++) desired_dynamics(i) = action[i];
+      action_seq = seq;
+    }
+
+    void update(const SyntheticState &s) {
+      std::lock_guard<std::mutex> guard(lock);
+      Eigen::VectorXd qdot = s.qdot;
+      Eigen::VectorXd q = s.q;
+      Eigen::MatrixXd J_upper;
+      Eigen::VectorXd rhs;
+      buildConstraints(s, qdot, J_upper, rhs);
+      Eigen::MatrixXd J_lower = getJacobian(s);
+      e_ddot_star = desired_dynamics - 1.0 * getTaskDerivative(s);
+      Eigen::VectorXd error = getTaskValue(s);
+      Eigen::VectorXd error_derivative = getTaskDerivative(s);
+      Eigen::VectorXd rhs_fixed_term = (-getJacobianDerivative(s) * qdot);
+
+      StateBuffers msg;
+      msg.e = std::vector<double>(error.data(), error.data() + error.size());
+      msg.de = std::vector<double>(error_derivative.data(), error_derivative.data() + error_derivative.size());
+      msg.q = std::vector<double>(q.data(), q.data() + q.size());
+      msg.dq = std::vector<double>(qdot.data(), qdot.data() + qdot.size());
+      msg.ddq_star = std::vector<double>(s.ddq_star.data(), s.ddq_star.data() + s.ddq_star.size());
+      msg.J_upper = std::vector<double>(J_upper.data(), J_upper.data() + J_upper.size());
+      msg.J_lower = std::vector<double>(J_lower.data(), J_lower.data() + J_lower.size());
+      msg.b_upper = std::vector<double>(rhs.data(), rhs.data() + rhs.size());
+      msg.rhs_fixed_term = std::vector<double>(rhs_fixed_term.data(), rhs_fixed_term.data() + rhs_fixed_term.size());
+      checksum += msg.b_upper.back() + msg.rhs_fixed_term[0] + e_ddot_star(0);
+    }
+  };
+
+  struct Realtime {
+    std::mutex writers; //only between action writers, like update_lock_
+    ActionMailbox actions;
+    ConstraintStack constraints;
+    Eigen::VectorXd desired_dynamics, e_ddot_star, rhs_fixed_term;
+    uint32_t action_seq{0};
+    StateBuffers msg;
+    UpdateGate initialized;
+    double checksum{0};
+
+    void init(unsigned int lower, unsigned int joints, unsigned int max_constraints) {
+      initialized.close();
+      desired_dynamics = Eigen::VectorXd::Zero(lower);
+      e_ddot_star = Eigen::VectorXd::Zero(lower);
+      rhs_fixed_term = Eigen::VectorXd::Zero(lower);
+      actions.resize(lower);
+      msg.e.reserve(lower);
+      msg.de.reserve(lower);
+      msg.q.reserve(joints);
+      msg.dq.reserve(joints);
+      msg.ddq_star.reserve(joints);
+      msg.J_upper.reserve(max_constraints * joints);
+      msg.J_lower.reserve(lower * joints);
+      msg.b_upper.reserve(max_constraints);
+      msg.rhs_fixed_term.reserve(lower);
+      initialized.open();
+    }
+
+    void act(const std::vector<double> &action, uint32_t seq) {
+      std::lock_guard<std::mutex> guard(writers);
+      actions.write(action.data(), seq);
+    }
+
+    void update(const SyntheticState &s) {
+      UpdateGate::Pass pass(initialized);
+      if (!pass) return;
+      actions.read(desired_dynamics, action_seq);
+      const Eigen::VectorXd &qdot = s.qdot;
+      const Eigen::VectorXd &q = s.q;
+      constraints.update(s.task_status_map_.begin(), s.task_status_map_.end(), s.priority, qdot);
+      const Eigen::MatrixXd &J_upper = constraints.J();
+      const Eigen::VectorXd &rhs = constraints.b();
+      const Eigen::MatrixXd &J_lower = getJacobian(s);
+      const Eigen::VectorXd &error = getTaskValue(s);
+      const Eigen::VectorXd &error_derivative = getTaskDerivative(s);
+      const Eigen::MatrixXd &J_dot = getJacobianDerivative(s);
+      e_ddot_star = desired_dynamics - 1.0 * error_derivative;
+      rhs_fixed_term.noalias() = -J_dot * qdot;
+
+      msg.e.assign(error.data(), error.data() + error.size());
+      msg.de.assign(error_derivative.data(), error_derivative.data() + error_derivative.size());
+      msg.q.assign(q.data(), q.data() + q.size());
+      msg.dq.assign(qdot.data(), qdot.data() + qdot.size());
+      msg.ddq_star.assign(s.ddq_star.data(), s.ddq_star.data() + s.ddq_star.size());
+      msg.J_upper.assign(J_upper.data(), J_upper.data() + J_upper.size());
+      msg.J_lower.assign(J_lower.data(), J_lower.data() + J_lower.size());
+      msg.b_upper.assign(rhs.data(), rhs.data() + rhs.size());
+      msg.rhs_fixed_term.assign(rhs_fixed_term.data(), rhs_fixed_term.data() + rhs_fixed_term.size());
+      checksum += msg.b_upper.back() + msg.rhs_fixed_term[0] + e_ddot_star(0);
+    }
+  };
+
+  struct Options {
+    long cycles{100000};
+    int tasks{4};
+    int rows{3};
+    int joints{7};
+    int lower{2};
+    double action_rate{1000.0};
+    long period_us{0};
+  };
+
+  template <typename Policy>
+  void run(const char *name, Policy &policy, const SyntheticState &state, const Options &options) {
+    std::atomic<bool> stop{false};
+    std::thread writer([&]() {
+      std::vector<double> action(options.lower);
+      uint32_t seq = 0;
+      auto period = std::chrono::duration<double>(1.0 / options.action_rate);
+      while (!stop.load()) {
+        for (int i = 0; i < options.lower; i++) action[i] = seq + i;
+        policy.act(action, ++seq);
+        std::this_thread::sleep_for(period);
+      }
+    });
+
+    std::vector<double> times(options.cycles);
+    for (long i = 0; i < options.cycles / 10; i++) policy.update(state); //warm up, sizes the buffers
+    unsigned long allocations = 0;
+    auto next = Clock::now();
+    for (long i = 0; i < options.cycles; i++) {
+      if (options.period_us > 0) {
+        next += std::chrono::microseconds(options.period_us);
+        std::this_thread::sleep_until(next);
+      }
+      num_allocations = 0;
+      count_allocations = true;
+      auto t_start = Clock::now();
+      policy.update(state);
+      auto t_end = Clock::now();
+      count_allocations = false;
+      allocations += num_allocations;
+      times[i] = std::chrono::duration<double, std::micro>(t_end - t_start).count();
+    }
+    stop = true;
+    writer.join();
+
+    double mean = 0;
+    for (double t : times) mean += t / times.size();
+    std::sort(times.begin(), times.end());
+    auto percentile = [&](double p) { return times[std::min(times.size() - 1, (size_t) (p * times.size()))]; };
+    printf("%12s %9.2f %9.2f %9.2f %9.2f %9.2f %9.2f %10.2f\n", name, mean, percentile(0.5), percentile(0.99),
+           percentile(0.999), times.back(), times.back() - percentile(0.5), (double) allocations / options.cycles);
+  }
+
+} // namespace
+
+int main(int argc, char **argv) {
+  Options options;
+  for (int i = 1; i + 1 < argc; i += 2) {
+    std::string name = argv[i];
+    double value = std::atof(argv[i + 1]);
+    if (name == "--cycles") options.cycles = value;
+    else if (name == "--tasks") options.tasks = value;
+    else if (name == "--rows") options.rows = value;
+    else if (name == "--joints") options.joints = value;
+    else if (name == "--lower") options.lower = value;
+    else if (name == "--action_rate") options.action_rate = value;
+    else if (name == "--period_us") options.period_us = value;
+    else {
+      fprintf(stderr, "usage: %s [--cycles N] [--tasks N] [--rows N] [--joints N] [--lower N] "
+                      "[--action_rate HZ] [--period_us US]\n", argv[0]);
+      return 1;
+    }
+  }
+
+  SyntheticState state = makeState(options.tasks, options.rows, options.joints, options.lower);
+  printf("%ld cycles, %d tasks x %d rows, %d joints, actions at %.0f Hz, %s\n", options.cycles, options.tasks,
+         options.rows, options.joints, options.action_rate,
+         options.period_us > 0 ? ("every " + std::to_string(options.period_us) + " us").c_str() : "back to back");
+  printf("%12s %9s %9s %9s %9s %9s %9s %10s\n", "update", "mean us", "p50", "p99", "p99.9", "max",
+         "jitter", "allocs/cyc");
+
+  Allocating allocating;
+  allocating.init(options.lower);
+  run("allocating", allocating, state, options);
+
+  Realtime realtime;
+  realtime.init(options.lower, options.joints, 64);
+  run("realtime", realtime, state, options);
+
+  Eigen::MatrixXd J_upper;
+  Eigen::VectorXd rhs;
+  buildConstraints(state, state.qdot, J_upper, rhs);
+  if (!J_upper.isApprox(realtime.constraints.J()) || !rhs.isApprox(realtime.constraints.b())) {
+    fprintf(stderr, "ConstraintStack differs from the allocating assembly\n");
+    return 1;
+  }
+  //keeps the compiler from dropping the work
+  return (allocating.checksum == realtime.checksum + 1.0) ? 2 : 0;
+}
@@ -0,0 +1,57 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+/*! Evaluates an exported policy on the inputs read from stdin, one
+ *  whitespace separated input vector per line, and prints one output per
+ *  line. naf_env/src/export_policy.py --check compares them to PyTorch:
+ *
+ *    rosrun rl_task_plugins rl_task_plugins_check_policy policy.bin < inputs.txt */
+
+#include <rl_task_plugins/mlp_policy.h>
+
+#include <cstdio>
+#include <iostream>
+#include <sstream>
+#include <string>
+
+int main(int argc, char **argv) {
+  if (argc != 2) {
+    fprintf(stderr, "usage: %s WEIGHTS < inputs\n", argv[0]);
+    return 1;
+  }
+  hiqp::tasks::MlpPolicy policy;
+  std::string error;
+  if (!policy.load(argv[1], error)) {
+    fprintf(stderr, "%s\n", error.c_str());
+    return 1;
+  }
+
+  Eigen::VectorXd input(policy.inputSize()), output(policy.outputSize());
+  std::string line;
+  while (std::getline(std::cin, line)) {
+    std::istringstream values(line);
+    unsigned int n = 0;
+    while (n < input.size() && values >> input(n)) n++;
+    if (n == 0) continue;
+    if (n != input.size()) {
+      fprintf(stderr, "expected %u inputs per line\n", policy.inputSize());
+      return 1;
+    }
+    policy.evaluate(input, output);
+    for (unsigned int i = 0; i < output.size(); i++) printf(i ? " %.9g" : "%.9g", output(i));
+    printf("\n");
+  }
+  return 0;
+}
@@ -0,0 +1,106 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#include <rl_task_plugins/kinematics_cache.h>
+
+#include <map>
+
+#include <hiqp/utilities.h>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+    std::shared_ptr<KinematicsCache> KinematicsCache::get(const KDL::Tree &tree) {
+      static std::mutex lock;
+      static std::map<const KDL::Tree *, std::weak_ptr<KinematicsCache> > caches;
+
+      std::lock_guard<std::mutex> guard(lock);
+      std::shared_ptr<KinematicsCache> cache = caches[&tree].lock();
+      if (!cache) {
+        cache = std::make_shared<KinematicsCache>(tree);
+        caches[&tree] = cache;
+      }
+      return cache;
+    }
+
+    KinematicsCache::KinematicsCache(const KDL::Tree &tree)
+    : tree_(tree), fk_solver_pos_(tree), fk_solver_jac_(tree) {}
+
+    KinematicsCache::Frame *KinematicsCache::frame(const std::string &frame_id, unsigned int n_joints) {
+      std::lock_guard<std::mutex> guard(frames_lock_);
+      for (auto &frame : frames_) {
+        if (frame->frame_id == frame_id && frame->jacobian.columns() == n_joints) return frame.get();
+      }
+      frames_.push_back(std::unique_ptr<Frame>(new Frame()));
+      Frame *frame = frames_.back().get();
+      frame->frame_id = frame_id;
+      frame->jacobian.resize(n_joints);
+      frame->jacobian_dot.resize(n_joints);
+      return frame;
+    }
+
+    void KinematicsCache::advance(const KDL::JntArrayVel &state) {
+      const Eigen::VectorXd &q = state.q.data;
+      const Eigen::VectorXd &qdot = state.qdot.data;
+      if (q_.size() == q.size() && qdot_.size() == qdot.size() && q_ == q && qdot_ == qdot) return;
+      q_ = q;
+      qdot_ = qdot;
+      tick_++;
+    }
+
+    int KinematicsCache::pose(Frame *frame, const KDL::JntArrayVel &state) {
+      advance(state);
+      if (frame->pose_tick == tick_) {
+        num_reused_++;
+        return frame->pose_status;
+      }
+      frame->pose_status = fk_solver_pos_.JntToCart(state.q, frame->pose, frame->frame_id);
+      frame->pose_tick = tick_;
+      num_computed_++;
+      return frame->pose_status;
+    }
+
+    int KinematicsCache::jacobian(Frame *frame, const KDL::JntArrayVel &state) {
+      advance(state);
+      if (frame->jacobian_tick == tick_) {
+        num_reused_++;
+        return frame->jacobian_status;
+      }
+      frame->jacobian_status = fk_solver_jac_.JntToJac(state.q, frame->jacobian, frame->frame_id);
+      frame->jacobian_tick = tick_;
+      num_computed_++;
+      return frame->jacobian_status;
+    }
+
+    int KinematicsCache::jacobianDot(Frame *frame, const KDL::JntArrayVel &state) {
+      //the derivative is computed from the Jacobian of the same tick
+      int retval = jacobian(frame, state);
+      if (retval != 0) return retval;
+      if (frame->jacobian_dot_tick == tick_) {
+        num_reused_++;
+        return frame->jacobian_dot_status;
+      }
+      frame->jacobian_dot_status = treeJntToJacDot(tree_, frame->jacobian, state, frame->jacobian_dot,
+                                                   frame->frame_id);
+      frame->jacobian_dot_tick = tick_;
+      num_computed_++;
+      return frame->jacobian_dot_status;
+    }
+
+} // namespace tasks
+
+} // namespace hiqp
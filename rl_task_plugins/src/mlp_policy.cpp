@@ -0,0 +1,112 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#include <rl_task_plugins/mlp_policy.h>
+
+#include <cstring>
+#include <fstream>
+#include <iterator>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+    namespace
+    {
+      //little-endian reads from a byte buffer, false past its end
+      struct Reader {
+        const std::vector<char> &data;
+        size_t offset;
+
+        bool read(void *out, size_t size) {
+          if (offset + size > data.size()) return false;
+          memcpy(out, data.data() + offset, size);
+          offset += size;
+          return true;
+        }
+      };
+    }
+
+    bool MlpPolicy::load(const std::string &path, std::string &error) {
+      std::ifstream file(path.c_str(), std::ios::binary);
+      if (!file) {
+        error = "cannot open " + path;
+        return false;
+      }
+      std::vector<char> data((std::istreambuf_iterator<char>(file)), std::istreambuf_iterator<char>());
+      Reader reader{data, 0};
+
+      char magic[4];
+      uint32_t version, num_layers;
+      if (!reader.read(magic, 4) || memcmp(magic, "NAFP", 4) != 0 || !reader.read(&version, 4)
+          || !reader.read(&num_layers, 4)) {
+        error = path + " is not a policy file";
+        return false;
+      }
+      if (version != VERSION) {
+        error = path + " has unsupported version " + std::to_string(version);
+        return false;
+      }
+
+      std::vector<Layer> layers(num_layers);
+      unsigned int inputs_expected = 0;
+      for (uint32_t i = 0; i < num_layers; i++) {
+        Layer &layer = layers[i];
+        uint32_t outputs, inputs;
+        if (!reader.read(&outputs, 4) || !reader.read(&inputs, 4) || !reader.read(&layer.activation, 4)) {
+          error = path + " is truncated";
+          return false;
+        }
+        if (outputs == 0 || inputs == 0 || (i > 0 && inputs != inputs_expected)
+            || layer.activation > TANH) {
+          error = path + ": layer " + std::to_string(i) + " does not fit the previous one";
+          return false;
+        }
+        layer.weight.resize(outputs, inputs);
+        layer.bias.resize(outputs);
+        layer.output.resize(outputs);
+        if (!reader.read(layer.weight.data(), sizeof(float) * outputs * inputs)
+            || !reader.read(layer.bias.data(), sizeof(float) * outputs)) {
+          error = path + " is truncated";
+          return false;
+        }
+        inputs_expected = outputs;
+      }
+      if (num_layers == 0 || reader.offset != data.size()) {
+        error = path + " has no layers or trailing data";
+        return false;
+      }
+
+      layers_.swap(layers);
+      input_.resize(inputSize());
+      return true;
+    }
+
+    void MlpPolicy::evaluate(const Eigen::VectorXd &input, Eigen::VectorXd &output) {
+      input_ = input.cast<float>();
+      const Eigen::VectorXf *x = &input_;
+      for (Layer &layer : layers_) {
+        layer.output = layer.bias;
+        layer.output.noalias() += layer.weight * *x;
+        if (layer.activation == TANH) layer.output = layer.output.array().tanh();
+        x = &layer.output;
+      }
+      output = x->cast<double>();
+    }
+
+} // namespace tasks
+
+} // namespace hiqp
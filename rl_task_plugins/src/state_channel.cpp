@@ -0,0 +1,136 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#include <rl_task_plugins/state_channel.h>
+
+#include <atomic>
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include <hiqp/utilities.h>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+    bool StateChannel::open(const std::string &name, unsigned int num_slots, unsigned int max_joints,
+                            unsigned int max_upper, unsigned int max_lower) {
+      close();
+      name_ = (name.empty() || name[0] != '/') ? "/" + name : name;
+
+      //field capacities in doubles, in the order of the Field enum
+      size_t capacities[9] = {max_lower, max_lower, max_joints, max_joints, max_joints,
+                              (size_t) max_upper * max_joints, (size_t) max_lower * max_joints,
+                              max_upper, max_lower};
+      size_t offset = sizeof(StateChannelSlotHeader);
+      for (int i = 0; i < 9; i++) {
+        capacities_[i] = capacities[i];
+        offsets_[i] = offset;
+        offset += capacities[i] * sizeof(double);
+      }
+      slot_size_ = (offset + 63) / 64 * 64;
+      size_ = sizeof(StateChannelHeader) + num_slots * slot_size_;
+
+      int fd = shm_open(name_.c_str(), O_CREAT | O_RDWR, 0666);
+      if (fd < 0 || ftruncate(fd, size_) != 0) {
+        printHiqpWarning("StateChannel: could not create shared memory segment " + name_);
+        if (fd >= 0) ::close(fd);
+        return false;
+      }
+      void *base = mmap(nullptr, size_, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+      ::close(fd);
+      if (base == MAP_FAILED) {
+        printHiqpWarning("StateChannel: could not map shared memory segment " + name_);
+        return false;
+      }
+      //touch every page now so the control loop never takes a page fault on them
+      memset(base, 0, size_);
+      base_ = base;
+
+      header_ = static_cast<StateChannelHeader *>(base_);
+      header_->version = VERSION;
+      header_->num_slots = num_slots;
+      header_->max_joints = max_joints;
+      header_->max_upper = max_upper;
+      header_->max_lower = max_lower;
+      header_->subscribed_fields = 0;
+      header_->write_count = 0;
+      //readers only trust the layout once the magic is in place
+      __atomic_store_n(&header_->magic, MAGIC, __ATOMIC_RELEASE);
+      return true;
+    }
+
+    void StateChannel::close() {
+      if (base_ == nullptr) return;
+      munmap(base_, size_);
+      base_ = nullptr;
+      header_ = nullptr;
+    }
+
+    void StateChannel::copyField(double *data, Field field, const double *src, size_t size,
+                                 uint32_t mask, uint32_t &fields) const {
+      int i = __builtin_ctz(field);
+      if (!(mask & field) || size > capacities_[i]) return;
+      memcpy(reinterpret_cast<char *>(data) + offsets_[i], src, size * sizeof(double));
+      fields |= field;
+    }
+
+    void StateChannel::write(double stamp, uint32_t action_seq, const Eigen::VectorXd &e, const Eigen::VectorXd &de,
+                             const Eigen::VectorXd &q, const Eigen::VectorXd &dq,
+                             const Eigen::VectorXd &ddq_star, const Eigen::MatrixXd &J_upper,
+                             const Eigen::MatrixXd &J_lower, const Eigen::VectorXd &b_upper,
+                             const Eigen::VectorXd &rhs_fixed_term) {
+      if (base_ == nullptr) return;
+
+      uint64_t k = header_->write_count;
+      char *slot_base = static_cast<char *>(base_) + sizeof(StateChannelHeader)
+                        + (k % header_->num_slots) * slot_size_;
+      StateChannelSlotHeader *slot = reinterpret_cast<StateChannelSlotHeader *>(slot_base);
+      double *data = reinterpret_cast<double *>(slot_base);
+
+      uint32_t mask = __atomic_load_n(&header_->subscribed_fields, __ATOMIC_RELAXED);
+      if (mask == 0) mask = ALL_FIELDS;
+
+      __atomic_store_n(&slot->seq, 2 * k + 1, __ATOMIC_RELAXED);
+      std::atomic_thread_fence(std::memory_order_release);
+
+      uint32_t fields = 0;
+      slot->stamp = stamp;
+      slot->action_seq = action_seq;
+      slot->n_joints = q.size();
+      slot->n_upper = J_upper.rows();
+      slot->n_lower = e.size();
+      copyField(data, E, e.data(), e.size(), mask, fields);
+      copyField(data, DE, de.data(), de.size(), mask, fields);
+      copyField(data, Q, q.data(), q.size(), mask, fields);
+      copyField(data, DQ, dq.data(), dq.size(), mask, fields);
+      copyField(data, DDQ_STAR, ddq_star.data(), ddq_star.size(), mask, fields);
+      copyField(data, J_UPPER, J_upper.data(), J_upper.size(), mask, fields);
+      copyField(data, J_LOWER, J_lower.data(), J_lower.size(), mask, fields);
+      copyField(data, B_UPPER, b_upper.data(), b_upper.size(), mask, fields);
+      copyField(data, RHS_FIXED_TERM, rhs_fixed_term.data(), rhs_fixed_term.size(), mask, fields);
+      slot->fields = fields;
+
+      __atomic_store_n(&slot->seq, 2 * k + 2, __ATOMIC_RELEASE);
+      __atomic_store_n(&header_->write_count, k + 1, __ATOMIC_RELEASE);
+    }
+
+} // namespace tasks
+
+} // namespace hiqp
@@ -44,12 +44,6 @@ namespace hiqp {
             qddot_ = Eigen::VectorXd::Zero(n_joints);
             qdot_ = Eigen::VectorXd::Zero(n_joints);
 
-            fk_solver_pos_ =
-                    std::make_shared<KDL::TreeFkSolverPos_recursive>(robot_state->kdl_tree_);
-            fk_solver_jac_ =
-                    std::make_shared<KDL::TreeJntToJacSolver>(robot_state->kdl_tree_);
-
-
             normal1_ = KDL::Vector(std::stod(parameters.at(1)),std::stod(parameters.at(2)),std::stod(parameters.at(3)));
             normal2_ = KDL::Vector(std::stod(parameters.at(4)),std::stod(parameters.at(5)),std::stod(parameters.at(6)));
             normal3_ = KDL::Vector(std::stod(parameters.at(7)),std::stod(parameters.at(8)),std::stod(parameters.at(9)));
@@ -78,6 +72,12 @@ namespace hiqp {
 
             gpm->addDependencyToPrimitive(parameters.at(10), this->getTaskName());
 
+            //the first task on a frame computes its kinematics each tick, the others reuse them
+            kinematics_ = KinematicsCache::get(robot_state->kdl_tree_);
+            frame_ = kinematics_->frame(target_point_->getFrameId(), n_joints);
+            J_p1k_.resize(n_joints);
+            J_dot_p1k_.resize(n_joints);
+
             return 0;
         }
 
@@ -85,8 +85,7 @@ namespace hiqp {
         {
             int retval = 0;
 
-            retval = fk_solver_pos_->JntToCart(robot_state->kdl_jnt_array_vel_.q, pose_a_,
-                                               target_point_->getFrameId());
+            retval = kinematics_->pose(frame_, robot_state->kdl_jnt_array_vel_);
             if (retval != 0) {
                 std::cerr << "In TDefRLPick::update : Can't solve position "
                           << "of link '" << target_point_->getFrameId() << "'"
@@ -96,9 +95,7 @@ namespace hiqp {
                 return -1;
             }
 
-            jacobian_a_.resize(robot_state->kdl_jnt_array_vel_.q.rows());
-            retval = fk_solver_jac_->JntToJac(robot_state->kdl_jnt_array_vel_.q,
-                                              jacobian_a_, target_point_->getFrameId());
+            retval = kinematics_->jacobian(frame_, robot_state->kdl_jnt_array_vel_);
             if (retval != 0) {
                 std::cerr << "In TDefRLPick::update : Can't solve jacobian "
                           << "of link '" << target_point_->getFrameId() << "'"
@@ -108,9 +105,7 @@ namespace hiqp {
                 return -3;
             }
 
-            jacobian_dot_a_.resize(robot_state->kdl_jnt_array_vel_.q.rows());
-            retval = treeJntToJacDot(robot_state->kdl_tree_, jacobian_a_, robot_state->kdl_jnt_array_vel_,
-                                     jacobian_dot_a_, target_point_->getFrameId());
+            retval = kinematics_->jacobianDot(frame_, robot_state->kdl_jnt_array_vel_);
             if (retval != 0) {
                 std::cerr << "In TDefRLPick::update : Can't solve jacobian derivative "
                           << "of link '" << target_point_->getFrameId() << "'"
@@ -120,40 +115,39 @@ namespace hiqp {
                 return -5;
             }
 
+            const KDL::Frame &pose_a = frame_->pose;
+            const KDL::Jacobian &jacobian_a = frame_->jacobian;
+            const KDL::Jacobian &jacobian_dot_a = frame_->jacobian_dot;
+
             //Note to self: the two plane normals are assumed to be in robot base frame,
             //Hence, pose is Identity and jacobians are zeros
 
             //calculate projection
-            KDL::Vector p1__ = pose_a_.M * target_point_->getPointKDL(); //point 1 from link origin to ee
+            KDL::Vector p1__ = pose_a.M * target_point_->getPointKDL(); //point 1 from link origin to ee
             //expressed in the world frame
-            KDL::Vector p1 = pose_a_.p + p1__; //absolute ee point 1 expressed in the world frame
-
-            double q_nr=jacobian_a_.columns();
-            KDL::Jacobian J_p1k, J_dot_p1k;
-            J_p1k.resize(q_nr);
-            J_dot_p1k.resize(q_nr);
+            KDL::Vector p1 = pose_a.p + p1__; //absolute ee point 1 expressed in the world frame
 
-            changeJacRefPoint(jacobian_a_, p1__, J_p1k);
-            changeJacDotRefPoint(jacobian_a_, jacobian_dot_a_, robot_state->kdl_jnt_array_vel_, p1__, J_dot_p1k);
+            changeJacRefPoint(jacobian_a, p1__, J_p1k_);
+            changeJacDotRefPoint(jacobian_a, jacobian_dot_a, robot_state->kdl_jnt_array_vel_, p1__, J_dot_p1k_);
 
             e_(0) = dot(normal1_,p1);
             e_(1) = dot(normal2_,p1);
             e_(2) = dot(normal3_,p1);
 
 
-            J_.row(0) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal1_.data)*J_p1k.data.topRows<3>();
-            J_.row(1) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal2_.data)*J_p1k.data.topRows<3>();
-            J_.row(2) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal3_.data)*J_p1k.data.topRows<3>();
+            J_.row(0) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal1_.data)*J_p1k_.data.topRows<3>();
+            J_.row(1) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal2_.data)*J_p1k_.data.topRows<3>();
+            J_.row(2) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal3_.data)*J_p1k_.data.topRows<3>();
 
-            Eigen::VectorXd qdot=robot_state->kdl_jnt_array_vel_.qdot.data;
+            const Eigen::VectorXd &qdot=robot_state->kdl_jnt_array_vel_.qdot.data;
             //qddot_ = (1/robot_state->sampling_time_)*(qdot-qdot_);
             //qdot_=qdot;
 
             e_dot_=J_*qdot;
 
-            J_dot_.row(0) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal1_.data)*J_dot_p1k.data.topRows<3>();
-            J_dot_.row(1) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal2_.data)*J_dot_p1k.data.topRows<3>();
-            J_dot_.row(2) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal3_.data)*J_dot_p1k.data.topRows<3>();
+            J_dot_.row(0) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal1_.data)*J_dot_p1k_.data.topRows<3>();
+            J_dot_.row(1) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal2_.data)*J_dot_p1k_.data.topRows<3>();
+            J_dot_.row(2) = Eigen::Map<Eigen::Matrix<double,1,3> >(normal3_.data)*J_dot_p1k_.data.topRows<3>();
 
             //FIXME seems this is not working properly
             qddot_ = robot_state->kdl_effort_.data;
@@ -44,29 +44,57 @@ namespace hiqp
 
       ROS_INFO("Creating object TDynPolicy");
       int size = parameters.size();
-      if (size != 4) {
-        printHiqpWarning("TDynAsyncPolicy requires 4 parameters, got " 
+      if (size < 4 || size > 6) {
+        printHiqpWarning("TDynAsyncPolicy requires 4 to 6 parameters, got " 
           + std::to_string(size) + "! Initialization failed!");
 
         return -1;
       }
 
       update_lock_.lock();
+      initialized_.close();
       damping_ = std::stod(parameters.at(1));
       action_topic_ = parameters.at(2);
       state_topic_ = parameters.at(3);
+      if (size > 4) logdir_base_ = parameters.at(4);
+      //with a channel name the state goes to shared memory instead of state_topic_,
+      //a channel of an earlier init is closed either way
+      state_channel_.close();
+      if (size > 5 && !parameters.at(5).empty()) {
+        if (!state_channel_.open(parameters.at(5), state_channel_slots_, robot_state->getNumJoints(),
+                                 state_channel_max_constraints_, e_initial.rows())) {
+          update_lock_.unlock();
+          return -2;
+        }
+      }
 
       e_ddot_star_.resize(e_initial.rows());
       desired_dynamics_ = Eigen::VectorXd::Zero(e_initial.rows());
+      rhs_fixed_term_.resize(e_initial.rows());
+      actions_.resize(e_initial.rows());
+      action_seq_ = published_action_seq_ = state_seq_ = 0;
 
       last_publish_ = ros::Time::now();
-      initialized_ = true;
       
       update_lock_.unlock();
       
       //subscribers and publishers will be requesting locks themselves, let's make it easier on them
+      state_pub_.reset(new realtime_tools::RealtimePublisher<rl_task_plugins::StateMsg>(nh_, state_topic_, 1));
+      //room for the largest state, so filling the message in update never allocates
+      unsigned int n_joints = robot_state->getNumJoints();
+      unsigned int n_lower = e_initial.rows();
+      rl_task_plugins::StateMsg &msg = state_pub_->msg_;
+      msg.e.reserve(n_lower);
+      msg.de.reserve(n_lower);
+      msg.q.reserve(n_joints);
+      msg.dq.reserve(n_joints);
+      msg.ddq_star.reserve(n_joints);
+      msg.J_upper.reserve(state_channel_max_constraints_ * n_joints);
+      msg.J_lower.reserve(n_lower * n_joints);
+      msg.b_upper.reserve(state_channel_max_constraints_);
+      msg.rhs_fixed_term.reserve(n_lower);
+      initialized_.open();
       act_sub_ = nh_.subscribe(action_topic_, 1, &TDynAsyncPolicy::handleActMessage, this);
-      state_pub_ = nh_.advertise<rl_task_plugins::StateMsg>(state_topic_, 1);
 
 
       return 0;
@@ -75,57 +103,32 @@ namespace hiqp
     int TDynAsyncPolicy::update(const RobotStatePtr robot_state, 
                 const TaskDefinitionPtr def) {
 
-      update_lock_.lock();
-      if (!initialized_) {
+      UpdateGate::Pass pass(initialized_);
+      if (!pass) {
          ROS_ERROR("TDynAsyncPolicy not initialized!");
-         update_lock_.unlock();
 	 return -1;
       }
 
-      Eigen::VectorXd qdot=robot_state->kdl_jnt_array_vel_.qdot.data;
-      Eigen::VectorXd q=robot_state->kdl_jnt_array_vel_.q.data;
-
-      int tasks_dim=0;
-      for(auto task_status_it=robot_state->task_status_map_.begin(); 
-		      task_status_it!=robot_state->task_status_map_.end(); task_status_it++) {
-	  if(task_status_it->priority_ >= def->getPriority()) continue;
-	  //inequality tasks take one row, equality tasks take two rows
-	  for(int i=0; i<task_status_it->task_signs_.size(); i++) {
-		tasks_dim += (task_status_it->task_signs_[i]!=0) ? 1 : 2;
-	  }
-      }
+      //the newest action, if one arrived since the last cycle
+      actions_.read(desired_dynamics_, action_seq_);
 
-      //constraint Jacobian
-      Eigen::MatrixXd J_upper = Eigen::MatrixXd(tasks_dim, qdot.rows());
-      //constraint right-hand side
-      Eigen::VectorXd rhs = Eigen::VectorXd(tasks_dim);
-      
-      Eigen::MatrixXd J_lower = def->getJacobian();
-      
-      int nt = 0;
-      for(auto task_status_it=robot_state->task_status_map_.begin(); 
-		      task_status_it!=robot_state->task_status_map_.end(); task_status_it++) {
-	  if(task_status_it->priority_ >= def->getPriority()) continue;
-	  for(int i=0; i<task_status_it->task_signs_.size(); i++) {
-	      int task_sign=task_status_it->task_signs_[i];
-	      //std::cerr<<"i = "<<i<<" nt = "<<nt<<" s = "<<task_sign;  
-	      if(task_sign!=0) {
-	         J_upper.row(nt) = ((double) task_sign)*task_status_it->J_.row(i);
-		 rhs(nt) = ((double) task_sign)*(task_status_it->dde_star_(i)-task_status_it->dJ_.row(i).dot(qdot));
-		 //std::cerr<<" J="<<task_status_it->J_.row(i)<<" dde="<<task_status_it->dde_star_(i)<<" dJ="<<task_status_it->dJ_.row(i)<<" rhs="<<rhs(nt)<<std::endl;
-	         nt++;
-	      } else {
-		 //std::cerr<<" equality!!!\n";
-	         J_upper.row(nt) = task_status_it->J_.row(i);
-		 rhs(nt) = (task_status_it->dde_star_(i)-task_status_it->dJ_.row(i).dot(qdot));
-	         J_upper.row(nt+1) = (-1)*task_status_it->J_.row(i);
-		 rhs(nt+1) = (-1)*(task_status_it->dde_star_(i)-task_status_it->dJ_.row(i).dot(qdot));
-		 nt+=2;
-	      }		      
-	  }	
-      }
+      const Eigen::VectorXd &qdot=robot_state->kdl_jnt_array_vel_.qdot.data;
+      const Eigen::VectorXd &q=robot_state->kdl_jnt_array_vel_.q.data;
+
+      //constraint Jacobian and right-hand side, inequality tasks take one row, equality tasks take two rows
+      constraints_.update(robot_state->task_status_map_.begin(), robot_state->task_status_map_.end(),
+                          def->getPriority(), qdot);
+      const Eigen::MatrixXd &J_upper = constraints_.J();
+      const Eigen::VectorXd &rhs = constraints_.b();
+      int tasks_dim = constraints_.rows();
+
+      //each getter returns a copy, so each is called once
+      const Eigen::MatrixXd &J_lower = def->getJacobian();
+      const Eigen::VectorXd &error = def->getTaskValue();
+      const Eigen::VectorXd &error_derivative = def->getTaskDerivative();
+      const Eigen::MatrixXd &J_dot = def->getJacobianDerivative();
       
-      e_ddot_star_= desired_dynamics_ - damping_*def->getTaskDerivative();
+      e_ddot_star_= desired_dynamics_ - damping_*error_derivative;
 
 #if 0
       logdir_base_ = "/home/tsv/hiqp_logs/";
@@ -140,7 +143,7 @@ namespace hiqp
       J_up_stream<<J_upper<<std::endl;
       J_stream<<J_lower<<std::endl;
       rhs_stream<<rhs.transpose()<<std::endl;
-      desired_stream<<(e_ddot_star_-def->getJacobianDerivative()*q).transpose()<<std::endl; 
+      desired_stream<<(e_ddot_star_-J_dot*q).transpose()<<std::endl; 
 
       J_up_stream.close();
       J_stream.close();
@@ -148,35 +151,43 @@ namespace hiqp
       desired_stream.close();
 #endif
 
-      //publishStateMessage(def->getTaskValue());
-      Eigen::VectorXd error = def->getTaskValue();
-      Eigen::VectorXd error_derivative = def->getTaskDerivative();
-      Eigen::VectorXd rhs_fixed_term = (-def->getJacobianDerivative()*qdot);
+      if (rhs_fixed_term_.rows() != J_dot.rows()) rhs_fixed_term_.resize(J_dot.rows());
+      rhs_fixed_term_.noalias() = -J_dot*qdot;
 
       //we will do this directly here, too much to carry around right now
       ros::Time now = ros::Time::now();
+      if(state_channel_.isOpen()) {
+        //every cycle, no copies beyond the one into shared memory
+        state_channel_.write(now.toSec(), action_seq_, error, error_derivative, q, qdot, robot_state->ddq_star,
+                             J_upper, J_lower, rhs, rhs_fixed_term_);
+        return 0;
+      }
       ros::Duration d = now - last_publish_;
-      if(d.toSec() >= 1.0 / publish_rate_ ) {
-        rl_task_plugins::StateMsg msg;
+      //a busy publisher thread skips this cycle, the state goes out on the next one
+      if((d.toSec() >= 1.0 / publish_rate_ || action_seq_ != published_action_seq_) && state_pub_->trylock()) {
+        rl_task_plugins::StateMsg &msg = state_pub_->msg_;
+	msg.seq = ++state_seq_;
+	msg.stamp = now.toSec();
+	msg.action_seq = action_seq_;
 	msg.n_joints = q.rows();
 	msg.n_constraints_upper = tasks_dim;
 	msg.n_constraints_lower = error.rows();
 	
-	//followed by shameless deep copy
-	msg.e = std::vector<double>(error.data(),error.data()+error.size());
-	msg.de = std::vector<double>(error_derivative.data(), error_derivative.data()+error_derivative.size());
-	msg.q = std::vector<double>(q.data(), q.data()+q.size());
-	msg.dq = std::vector<double>(qdot.data(), qdot.data()+qdot.size());
-	msg.ddq_star = std::vector<double>(robot_state->ddq_star.data(), robot_state->ddq_star.data()+robot_state->ddq_star.size());
-	msg.J_upper = std::vector<double>(J_upper.data(), J_upper.data()+J_upper.size());
-	msg.J_lower = std::vector<double>(J_lower.data(), J_lower.data()+J_lower.size());
-	msg.b_upper = std::vector<double>(rhs.data(), rhs.data()+rhs.size());
-	msg.rhs_fixed_term = std::vector<double>(rhs_fixed_term.data(),rhs_fixed_term.data()+rhs_fixed_term.size());
-
-        state_pub_.publish(msg);
+	//followed by shameless deep copy, into the capacity reserved in init
+	msg.e.assign(error.data(),error.data()+error.size());
+	msg.de.assign(error_derivative.data(), error_derivative.data()+error_derivative.size());
+	msg.q.assign(q.data(), q.data()+q.size());
+	msg.dq.assign(qdot.data(), qdot.data()+qdot.size());
+	msg.ddq_star.assign(robot_state->ddq_star.data(), robot_state->ddq_star.data()+robot_state->ddq_star.size());
+	msg.J_upper.assign(J_upper.data(), J_upper.data()+J_upper.size());
+	msg.J_lower.assign(J_lower.data(), J_lower.data()+J_lower.size());
+	msg.b_upper.assign(rhs.data(), rhs.data()+rhs.size());
+	msg.rhs_fixed_term.assign(rhs_fixed_term_.data(),rhs_fixed_term_.data()+rhs_fixed_term_.size());
+
+        state_pub_->unlockAndPublish();
         last_publish_ = now;
+        published_action_seq_ = action_seq_;
       }
-      update_lock_.unlock();
 
       return 0;
     }
@@ -189,7 +200,7 @@ namespace hiqp
             &act_msg) {
 
         update_lock_.lock();
-	if (!initialized_) {
+	if (!initialized_.isOpen()) {
           ROS_ERROR("TDynAsyncPolicy not initialized!");
 	  update_lock_.unlock();
 	  return;
@@ -206,14 +217,8 @@ namespace hiqp
             return;
         }
 
-        if(act_msg->e_ddot_star.size() != desired_dynamics_.rows()) {
-            printHiqpWarning("TDynAsyncPolicy: mismatch between dimensions of desired and available errors, resizing");
-            desired_dynamics_ = Eigen::VectorXd::Zero(e_ddot_star_.rows());
-        }
-        
-        for(int i=0; i<act_msg->e_ddot_star.size(); ++i) {
-            desired_dynamics_(i) = act_msg->e_ddot_star[i];
-        }
+        //picked up by the next update, which never waits for this
+        actions_.write(act_msg->e_ddot_star.data(), act_msg->seq);
         update_lock_.unlock();
 
     }
@@ -222,12 +227,9 @@ namespace hiqp
 
         ros::Time now = ros::Time::now();
         ros::Duration d = now - last_publish_;
-        if(d.toSec() >= 1.0 / publish_rate_ ) {
-            rl_task_plugins::StateMsg msg;
-            for(int i=0; i<error.rows(); ++i) {
-                msg.e.push_back(error(i));
-            }
-            state_pub_.publish(msg);
+        if(d.toSec() >= 1.0 / publish_rate_ && state_pub_->trylock()) {
+            state_pub_->msg_.e.assign(error.data(), error.data()+error.size());
+            state_pub_->unlockAndPublish();
             last_publish_ = now;
         }
 
@@ -0,0 +1,181 @@
+// The HiQP Control Framework, an optimal control framework targeted at robotics
+// Copyright (C) 2016 Marcus A Johansson
+//
+// This program is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#include <chrono>
+
+#include <hiqp/utilities.h>
+
+#include <rl_task_plugins/tdyn_naf_policy.h>
+#include <pluginlib/class_list_macros.h>
+
+#include <ros/ros.h>
+
+namespace hiqp
+{
+  namespace tasks
+  {
+
+    TDynNAFPolicy::TDynNAFPolicy(
+      std::shared_ptr<GeometricPrimitiveMap> geom_prim_map,
+      std::shared_ptr<Visualizer> visualizer)
+    : TaskDynamics(geom_prim_map, visualizer) {}
+
+    TDynNAFPolicy::~TDynNAFPolicy() noexcept {
+      initialized_.close();
+      stopWatching();
+      delete active_;
+      delete pending_.exchange(nullptr);
+      delete retired_.exchange(nullptr);
+    }
+
+    int TDynNAFPolicy::init(const std::vector<std::string>& parameters, 
+              RobotStatePtr robot_state, 
+              const Eigen::VectorXd& e_initial, 
+              const Eigen::VectorXd& e_dot_initial, 
+              const Eigen::VectorXd& e_final, 
+              const Eigen::VectorXd& e_dot_final) {
+
+      int size = parameters.size();
+      int n = e_initial.rows();
+      if (size != 4 + n) {
+        printHiqpWarning("TDynNAFPolicy requires " + std::to_string(4 + n) + " parameters (damping, weight file, "
+          "action scale and a goal of " + std::to_string(n) + "), got " + std::to_string(size)
+          + "! Initialization failed!");
+        return -1;
+      }
+
+      //update() does not run past this, so everything below is ours
+      initialized_.close();
+      stopWatching();
+      damping_ = std::stod(parameters.at(1));
+      weights_path_ = parameters.at(2);
+      action_scale_ = std::stod(parameters.at(3));
+      goal_.resize(n);
+      for (int i = 0; i < n; i++) goal_(i) = std::stod(parameters.at(4 + i));
+
+      e_ddot_star_ = Eigen::VectorXd::Zero(n);
+      desired_dynamics_ = Eigen::VectorXd::Zero(n);
+      observation_ = Eigen::VectorXd::Zero(n);
+      action_ = Eigen::VectorXd::Zero(n);
+
+      delete active_;
+      delete pending_.exchange(nullptr);
+      delete retired_.exchange(nullptr);
+      weights_size_ = -1;
+      active_ = loadIfChanged();
+      if (active_ == nullptr) {
+        printHiqpWarning("TDynNAFPolicy: no usable policy in " + weights_path_ + " yet, holding until there is");
+      }
+
+      stop_ = false;
+      watcher_ = std::thread(&TDynNAFPolicy::watchWeights, this);
+      initialized_.open();
+      return 0;
+    }
+
+    int TDynNAFPolicy::update(const RobotStatePtr robot_state, 
+                const TaskDefinitionPtr def) {
+
+      UpdateGate::Pass pass(initialized_);
+      if (!pass) {
+        ROS_ERROR("TDynNAFPolicy not initialized!");
+        return -1;
+      }
+
+      //swap in a reloaded policy once the watcher freed the last one we
+      //retired, so a retired policy is never overwritten before it is freed
+      MlpPolicy *empty = nullptr;
+      if (pending_.load(std::memory_order_acquire) != nullptr
+          && retired_.compare_exchange_strong(empty, active_, std::memory_order_acq_rel)) {
+        //only the watcher publishes, and only into an empty pending_, so it still holds the policy
+        active_ = pending_.exchange(nullptr, std::memory_order_acq_rel);
+      }
+
+      const Eigen::VectorXd &error = def->getTaskValue();
+      const Eigen::VectorXd &error_derivative = def->getTaskDerivative();
+      if (active_ != nullptr) {
+        //the observation of ManipulateEnv
+        observation_ = goal_ - error;
+        active_->evaluate(observation_, action_);
+        desired_dynamics_ = action_scale_ * action_;
+      }
+      e_ddot_star_ = desired_dynamics_ - damping_ * error_derivative;
+
+      return 0;
+    }
+
+    int TDynNAFPolicy::monitor() {
+      return 0;
+    }
+
+    MlpPolicy *TDynNAFPolicy::loadIfChanged() {
+      struct stat st;
+      if (stat(weights_path_.c_str(), &st) != 0) return nullptr;
+      if (st.st_ino == weights_ino_ && st.st_size == weights_size_
+          && st.st_mtim.tv_sec == weights_mtime_.tv_sec && st.st_mtim.tv_nsec == weights_mtime_.tv_nsec) {
+        return nullptr;
+      }
+      //remembered even if the file turns out unusable, so it is reported once
+      weights_ino_ = st.st_ino;
+      weights_size_ = st.st_size;
+      weights_mtime_ = st.st_mtim;
+
+      MlpPolicy *policy = new MlpPolicy();
+      std::string error;
+      if (!policy->load(weights_path_, error)) {
+        printHiqpWarning("TDynNAFPolicy: " + error);
+        delete policy;
+        return nullptr;
+      }
+      if (policy->inputSize() != goal_.size() || policy->outputSize() != e_ddot_star_.size()) {
+        printHiqpWarning("TDynNAFPolicy: the policy in " + weights_path_ + " maps "
+          + std::to_string(policy->inputSize()) + " to " + std::to_string(policy->outputSize())
+          + " values, the task has " + std::to_string(goal_.size()));
+        delete policy;
+        return nullptr;
+      }
+      ROS_INFO("TDynNAFPolicy: loaded policy from %s", weights_path_.c_str());
+      return policy;
+    }
+
+    void TDynNAFPolicy::watchWeights() {
+      std::unique_lock<std::mutex> lock(watch_lock_);
+      while (!stop_) {
+        delete retired_.exchange(nullptr, std::memory_order_acq_rel);
+        //one reload in flight at a time, update() takes it once retired_ is empty again
+        if (pending_.load(std::memory_order_acquire) == nullptr) {
+          MlpPolicy *policy = loadIfChanged();
+          if (policy != nullptr) pending_.store(policy, std::memory_order_release);
+        }
+        watch_cv_.wait_for(lock, std::chrono::duration<double>(reload_period_), [this] { return stop_; });
+      }
+    }
+
+    void TDynNAFPolicy::stopWatching() {
+      if (!watcher_.joinable()) return;
+      {
+        std::lock_guard<std::mutex> guard(watch_lock_);
+        stop_ = true;
+      }
+      watch_cv_.notify_all();
+      watcher_.join();
+    }
+
+} // namespace tasks
+
+} // namespace hiqp
+
+PLUGINLIB_EXPORT_CLASS(hiqp::tasks::TDynNAFPolicy,
+ hiqp::TaskDynamics)